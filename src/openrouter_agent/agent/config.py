@@ -7,6 +7,7 @@ from typing import List
 class PipelineConfig:
     max_review_iterations: int = 3
     max_retry_per_step: int = 3
+    max_parallel_steps: int = 1  # >1 - независимые шаги плана выполняются параллельно
     failed_tasks_threshold_percent: int = 30
     snapshot_strategy: str = "directory_copy"
     output_language: str = "ru"
@@ -15,6 +16,24 @@ class PipelineConfig:
     temperature_generation: float = 0.3
     temperature_code: float = 0.1
     max_tokens_per_call: int = 4096
+    llm_batch_size: int = 8
+    llm_batch_max_chars: int = 16000  # ~4k токенов на упакованный промпт
+    llm_max_retries: int = 3
+    max_concurrency: int = 4
+    llm_rpm: int = 0  # 0 - без ограничения
+    hedge_after_s: float = 0.0  # 0 - без дублирующих запросов
+    llm_backoff_base_s: float = 0.5
+    history_window: int = 40  # сообщений диалога в запросе к LLM; 0 - без ограничения
+    stream_responses: bool = False  # ответы _step - в progress по мере генерации; JSON-вызовы обрываются на конце объекта
+    prompt_cache: bool = False  # cache_control на system-промпте (кэш префикса у Anthropic/Gemini)
+
+    cache_enabled: bool = False
+    cache_dir: str = "~/.cache/ergodeon"
+    cache_ttl_s: float = 7 * 24 * 3600
+
+    use_batch_api: bool = False
+    batch_poll_interval_s: float = 10.0
+    batch_timeout_s: float = 24 * 3600
 
     max_file_size_bytes: int = 100000
     max_files_to_read: int = 50
@@ -49,5 +68,16 @@ class PipelineConfig:
         cfg = cls()
         cfg.max_review_iterations = int(os.getenv("PIPELINE_MAX_REVIEW", str(cfg.max_review_iterations)))
         cfg.max_retry_per_step = int(os.getenv("PIPELINE_MAX_RETRY", str(cfg.max_retry_per_step)))
+        cfg.max_parallel_steps = int(os.getenv("PIPELINE_MAX_PARALLEL_STEPS", str(cfg.max_parallel_steps)))
         cfg.output_language = os.getenv("PIPELINE_LANG", cfg.output_language)
+        cfg.max_concurrency = int(os.getenv("PIPELINE_MAX_CONCURRENCY", str(cfg.max_concurrency)))
+        cfg.llm_rpm = int(os.getenv("PIPELINE_LLM_RPM", str(cfg.llm_rpm)))
+        cfg.hedge_after_s = float(os.getenv("PIPELINE_HEDGE_AFTER_S", str(cfg.hedge_after_s)))
+        cfg.history_window = int(os.getenv("PIPELINE_HISTORY_WINDOW", str(cfg.history_window)))
+        cfg.stream_responses = os.getenv("PIPELINE_STREAM", "false").lower() == "true"
+        cfg.prompt_cache = os.getenv("PIPELINE_PROMPT_CACHE", "false").lower() == "true"
+        cfg.cache_enabled = os.getenv("PIPELINE_LLM_CACHE", "false").lower() == "true"
+        cfg.cache_dir = os.getenv("PIPELINE_LLM_CACHE_DIR", cfg.cache_dir)
+        cfg.cache_ttl_s = float(os.getenv("PIPELINE_LLM_CACHE_TTL_S", str(cfg.cache_ttl_s)))
+        cfg.use_batch_api = os.getenv("PIPELINE_BATCH_API", "false").lower() == "true"
         return cfg
@@ -8,7 +8,7 @@ ContextManager - управление context.yaml на уровне проек
 import os
 import logging
 from typing import Dict, Any, Optional
-from openrouter_agent.utils import save_yaml, load_yaml
+from openrouter_agent.utils import save_yaml, load_yaml_cached
 
 log = logging.getLogger(__name__)
 
@@ -30,9 +30,8 @@ class ContextManager:
         self.context_path = os.path.join(self.project_dir, CONTEXT_FILE)
 
     def load(self) -> Dict[str, Any]:
-        if os.path.exists(self.context_path):
-            return load_yaml(self.context_path) or dict(DEFAULT_CONTEXT)
-        return dict(DEFAULT_CONTEXT)
+        # Кэш по stat: повторные get_for_llm за один запрос не парсят YAML заново
+        return load_yaml_cached(self.context_path) or dict(DEFAULT_CONTEXT)
 
     def save(self, ctx: Dict[str, Any]):
         os.makedirs(os.path.dirname(self.context_path), exist_ok=True)
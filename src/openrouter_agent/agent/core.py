@@ -1,7 +1,10 @@
 import os
 import json
+import asyncio
 import logging
 import time
+from collections import Counter
+from functools import lru_cache
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Callable, Awaitable
@@ -15,17 +18,17 @@ from openrouter_agent.agent.scanner import ProjectScanner
 from openrouter_agent.agent.doc_generator import DocumentGenerator
 from openrouter_agent.agent.sandbox import Sandbox
 from openrouter_agent.agent.config import PipelineConfig
-from openrouter_agent.agent.prompts import PROMPT_EXECUTE_STEP
-from openrouter_agent.utils import find_balanced_json, load_yaml
+from openrouter_agent.agent.prompts import PROMPT_EXECUTE_STEP_FN, prompt_fn
+from openrouter_agent.utils import extract_json, load_yaml, json_dumps, json_loads
 
 log = logging.getLogger(__name__)
 
-DANGEROUS_TOOLS = {
+DANGEROUS_TOOLS = frozenset({
     "write_file", "delete_file", "edit_file", "edit_file_by_lines",
     "move_file", "execute_command", "multi_edit_file",
-}
+})
 
-PATH_ARGS = {"path", "directory", "source", "destination", "cwd"}
+PATH_ARGS = frozenset({"path", "directory", "source", "destination", "cwd"})
 
 
 def get_latest_stage_version(project_dir: str) -> tuple[int, int]:
@@ -73,8 +76,9 @@ def _resolve_and_guard(raw_path: str, project_dir: str) -> str:
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
-PROMPTS_DIR = Path(__file__).parent.parent.parent.parent / "promt"
+PROMPTS_DIR = Path(__file__).resolve().parents[3] / "promt"
 
+@lru_cache(maxsize=None)
 def _load_prompt(name: str) -> str:
     path = PROMPTS_DIR / f"{name}.md"
     try:
@@ -94,10 +98,7 @@ class Agent:
         memory_path: str = "memory/episodes.json",
         pipeline_config: PipelineConfig = None,
     ):
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
+        self.client = DocumentGenerator.make_client(api_key)
         self.model = model
         self.api_key = api_key
         self.tools_registry = ToolRegistry()
@@ -114,12 +115,12 @@ class Agent:
         self.confirmation_callback = confirmation_callback
         self.active_project_dir: str | None = None
 
-        self.intent_classifier = IntentClassifier()
+        self.pipeline_config = pipeline_config or PipelineConfig()
+        self.intent_classifier = IntentClassifier(self.pipeline_config.max_concurrency)
         self.memory = EpisodeMemory(memory_path)
-        self.planner = Planner()
+        self.planner = Planner(self.pipeline_config.max_concurrency)
         self.scanner = ProjectScanner()
         self.doc_generator = DocumentGenerator()
-        self.pipeline_config = pipeline_config or PipelineConfig()
 
         log.info(f"agent initialized, model={model}, memory={memory_path}")
 
@@ -143,8 +144,8 @@ class Agent:
                 temperature=0.2,
             )
             raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            name = json.loads(js).get("dir_name", "new_project") if js else "new_project"
+            data = extract_json(raw)
+            name = data.get("dir_name", "new_project") if data else "new_project"
         except Exception as e:
             log.warning(f"error generating project name: {e}")
             name = "new_project"
@@ -165,9 +166,10 @@ class Agent:
 
         if self.active_project_dir:
             prompt_name = "research_mode" if mode == "research" else "chat_mode"
-            mode_prompt = _load_prompt(prompt_name).format(active_project_dir=self.active_project_dir)
+            mode_prompt = prompt_fn(prompt_name)(active_project_dir=self.active_project_dir)
             
-            if not any(mode_prompt in str(m.get("content", "")) for m in self.history[-3:]):
+            if not any(isinstance(c := m.get("content"), str) and mode_prompt in c
+                       for m in self.history[-3:]):
                 self.history.append({
                     "role": "system",
                     "content": mode_prompt
@@ -234,10 +236,11 @@ class Agent:
         previous_entries: List[Dict] = []
 
         if existing_log:
-            for entry in existing_log.get("steps", []):
-                if entry.get("status") == "completed":
-                    completed_ids.add(str(entry.get("checklist_id", "")))
             previous_entries = existing_log.get("steps", [])
+            completed_ids = {
+                str(e.get("checklist_id", "")) for e in previous_entries
+                if e.get("status") == "completed"
+            }
             log.info(f"resume: найдено {len(completed_ids)} выполненных шагов: {completed_ids}")
         else:
             log.info("resume: лог не найден, выполняем все шаги")
@@ -261,7 +264,7 @@ class Agent:
         # Формируем digest строку для промтов
         from openrouter_agent.utils import load_yaml as _load_yaml
         digest_data = _load_yaml(os.path.join(docs_dir, "project_digest.yaml")) or {}
-        digest_str = json.dumps(digest_data, ensure_ascii=False)
+        digest_str = json_dumps(digest_data)
 
         result = {
             "status": "started",
@@ -313,12 +316,12 @@ class Agent:
 
             for attempt in range(self.pipeline_config.max_retry_per_step):
                 try:
-                    step_prompt = json.dumps(step, ensure_ascii=False)
-                    prompt = PROMPT_EXECUTE_STEP.format(
+                    step_prompt = json_dumps(step)
+                    prompt = PROMPT_EXECUTE_STEP_FN(
                         step=step_prompt,
                         project_digest=digest_str,
                         current_file_content="Определи сам в процессе",
-                        previous_steps_log=json.dumps(execution_log[-10:], ensure_ascii=False),
+                        previous_steps_log=json_dumps(execution_log[-10:]),
                     )
                     system_instruction = (
                         f"You are executing a step in the implementation plan.\n"
@@ -357,9 +360,8 @@ class Agent:
 
         # Финальный статус
         total = len(steps)
-        completed = sum(1 for e in execution_log if e["status"] == "completed")
-        failed = sum(1 for e in execution_log if e["status"] == "failed")
-        blocked = sum(1 for e in execution_log if e["status"] == "blocked")
+        counts = Counter(e["status"] for e in execution_log)
+        completed, failed, blocked = counts["completed"], counts["failed"], counts["blocked"]
         failed_pct = (failed / max(total, 1)) * 100
 
         if failed_pct > self.pipeline_config.failed_tasks_threshold_percent:
@@ -415,11 +417,11 @@ class Agent:
             from openrouter_agent.utils import load_yaml as _ly
             old_req = _ly(os.path.join(prev_docs_dir, "parsed_request.yaml"))
             if old_req:
-                old_context += f"ПРЕДЫДУЩИЙ ЗАПРОС:\n{json.dumps(old_req, ensure_ascii=False)}\n\n"
+                old_context += f"ПРЕДЫДУЩИЙ ЗАПРОС:\n{json_dumps(old_req)}\n\n"
             old_cl = self.doc_generator.load_checklist(prev_docs_dir)
             if old_cl:
                 old_context += (
-                    f"ТЕКУЩИЙ ЧЕКЛИСТ:\n{json.dumps(old_cl, ensure_ascii=False)}\n\n"
+                    f"ТЕКУЩИЙ ЧЕКЛИСТ:\n{json_dumps(old_cl)}\n\n"
                     "ВАЖНО: Добавь новые задачи в этот чеклист. Старые задачи сохрани как есть (если они не отменены)!"
                 )
 
@@ -430,43 +432,47 @@ class Agent:
         current_version = 1
         docs_dir = _docs_dir_path(project_dir, current_stage, current_version)
 
+        # Стадия 2-3 (сканирование) не зависит от разбора запроса -
+        # читаем проект в потоке параллельно со стадией 1
+        scan_task = asyncio.create_task(asyncio.to_thread(self._collect_scan, project_dir, goal))
+
         # Стадия 1
         log.info("stage 1: parsing request")
         goal_with_ctx = f"Новый запрос: {goal}\n\n---\nИстория проекта:\n{old_context}" if old_context else goal
-        parsed = await self.doc_generator.parse_request(goal_with_ctx, "", self.client, self.model)
+        try:
+            parsed = await self.doc_generator.parse_request(goal_with_ctx, "", self.client, self.model)
+        except BaseException:
+            scan_task.cancel()
+            raise
         result["stages"]["parse_request"] = parsed
         if parsed.get("clarification_needed"):
+            scan_task.cancel()
             result["status"] = "needs_clarification"
             result["questions"] = parsed["clarification_needed"]
             return result
 
-        # Стадия 2-3
         log.info("stage 2-3: scanning project and generating digest")
-        files = self.scanner.scan(project_dir)
-        prioritized = self.scanner.prioritize(files, goal)
-        file_tree = self.scanner.get_file_tree(files)
-        file_contents = self.scanner.read_files(prioritized)
-        contents_str = "\n\n".join(f"--- {k} ---\n{v}" for k, v in file_contents.items())
+        file_tree, contents_str = await scan_task
 
         digest = await self.doc_generator.generate_digest(
-            file_tree, contents_str, json.dumps(parsed, ensure_ascii=False),
+            file_tree, contents_str, json_dumps(parsed),
             self.client, self.model,
         )
         result["stages"]["digest"] = digest
 
         # Стадия 4
         log.info("stage 4: generating documents")
-        parsed_str = json.dumps(parsed, ensure_ascii=False)
-        digest_str = json.dumps(digest, ensure_ascii=False)
+        parsed_str = json_dumps(parsed)
+        digest_str = json_dumps(digest)
 
         checklist = await self.doc_generator.generate_checklist(digest_str, parsed_str, self.client, self.model)
         walkthrough = await self.doc_generator.generate_walkthrough(
-            digest_str, parsed_str, json.dumps(checklist, ensure_ascii=False), self.client, self.model,
+            digest_str, parsed_str, json_dumps(checklist), self.client, self.model,
         )
         plan = await self.doc_generator.generate_plan(
             digest_str, parsed_str,
-            json.dumps(checklist, ensure_ascii=False),
-            json.dumps(walkthrough, ensure_ascii=False),
+            json_dumps(checklist),
+            json_dumps(walkthrough),
             self.client, self.model,
         )
 
@@ -476,7 +482,7 @@ class Agent:
 
         docs = {"parsed_request": parsed, "digest": digest,
                 "checklist": checklist, "walkthrough": walkthrough, "plan": plan}
-        self.doc_generator.save_to_project(docs_dir, docs)
+        await self.doc_generator.asave_to_project(docs_dir, docs)
         result["stages"]["documents"] = {"path": docs_dir, "valid": valid, "issues": issues}
 
         # Стадия 5 - ревью
@@ -506,9 +512,9 @@ class Agent:
                 log.info("review: processing comments")
                 review_result = await self.doc_generator.parse_review_comments(
                     comments,
-                    json.dumps(checklist, ensure_ascii=False),
-                    json.dumps(walkthrough, ensure_ascii=False),
-                    json.dumps(plan, ensure_ascii=False),
+                    json_dumps(checklist),
+                    json_dumps(walkthrough),
+                    json_dumps(plan),
                     self.client, self.model,
                 )
                 overall = review_result.get("overall_status", "needs_revision")
@@ -527,35 +533,35 @@ class Agent:
                             digest_str, parsed_str + f"\nКомментарии: {comments}", self.client, self.model,
                         )
                         walkthrough = await self.doc_generator.generate_walkthrough(
-                            digest_str, parsed_str, json.dumps(checklist, ensure_ascii=False),
+                            digest_str, parsed_str, json_dumps(checklist),
                             self.client, self.model,
                         )
                         plan = await self.doc_generator.generate_plan(
                             digest_str, parsed_str,
-                            json.dumps(checklist, ensure_ascii=False),
-                            json.dumps(walkthrough, ensure_ascii=False),
+                            json_dumps(checklist),
+                            json_dumps(walkthrough),
                             self.client, self.model,
                         )
                     elif "walkthrough" in to_regen:
                         walkthrough = await self.doc_generator.generate_walkthrough(
                             digest_str, parsed_str + f"\nКомментарии: {comments}",
-                            json.dumps(checklist, ensure_ascii=False), self.client, self.model,
+                            json_dumps(checklist), self.client, self.model,
                         )
                         plan = await self.doc_generator.generate_plan(
                             digest_str, parsed_str,
-                            json.dumps(checklist, ensure_ascii=False),
-                            json.dumps(walkthrough, ensure_ascii=False),
+                            json_dumps(checklist),
+                            json_dumps(walkthrough),
                             self.client, self.model,
                         )
                     elif "implementation_plan" in to_regen:
                         plan = await self.doc_generator.generate_plan(
                             digest_str, parsed_str + f"\nКомментарии: {comments}",
-                            json.dumps(checklist, ensure_ascii=False),
-                            json.dumps(walkthrough, ensure_ascii=False),
+                            json_dumps(checklist),
+                            json_dumps(walkthrough),
                             self.client, self.model,
                         )
                     docs.update({"checklist": checklist, "walkthrough": walkthrough, "plan": plan})
-                    self.doc_generator.save_to_project(docs_dir, docs)
+                    await self.doc_generator.asave_to_project(docs_dir, docs)
 
         # Стадия 6 - имплементация
         log.info("stage 6: implementation")
@@ -604,12 +610,12 @@ class Agent:
 
             for attempt in range(self.pipeline_config.max_retry_per_step):
                 try:
-                    step_prompt = json.dumps(step, ensure_ascii=False)
-                    prompt = PROMPT_EXECUTE_STEP.format(
+                    step_prompt = json_dumps(step)
+                    prompt = PROMPT_EXECUTE_STEP_FN(
                         step=step_prompt,
                         project_digest=digest_str,
                         current_file_content="Определи сам в процессе",
-                        previous_steps_log=json.dumps(execution_log[-10:], ensure_ascii=False),
+                        previous_steps_log=json_dumps(execution_log[-10:]),
                     )
                     system_instruction = (
                         f"You are executing a step in the implementation plan.\n"
@@ -652,9 +658,8 @@ class Agent:
         # Стадия 7
         log.info("stage 7: final verification")
         total = len(steps)
-        completed = sum(1 for e in execution_log if e["status"] == "completed")
-        failed = sum(1 for e in execution_log if e["status"] == "failed")
-        blocked = sum(1 for e in execution_log if e["status"] == "blocked")
+        counts = Counter(e["status"] for e in execution_log)
+        completed, failed, blocked = counts["completed"], counts["failed"], counts["blocked"]
         failed_pct = (failed / max(total, 1)) * 100
 
         if failed_pct > self.pipeline_config.failed_tasks_threshold_percent:
@@ -687,85 +692,99 @@ class Agent:
 
     # ------------------------------------------------------------------ _step
 
+    def _collect_scan(self, project_dir: str, goal: str) -> tuple[str, str]:
+        files = self.scanner.scan(project_dir)
+        prioritized = self.scanner.prioritize(files, goal)
+        file_tree = self.scanner.get_file_tree(files)
+        contents_str = self.scanner.format_contents(self.scanner.read_files(prioritized))
+        return file_tree, contents_str
+
     async def _step(self, project_dir: str | None = None) -> str:
-        messages = [{"role": "system", "content": self.system_prompt}] + self.history
+        # Запросы к модели повторяются в цикле, пока она вызывает инструменты
         tools = self._get_openai_tools()
+        messages = [{"role": "system", "content": self.system_prompt}]
+        sent = 0
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            tools=tools if tools else None,
-            tool_choice="auto" if tools else None,
-        )
-
-        message = response.choices[0].message
+        while True:
+            # Список запроса дополняется только новыми сообщениями history
+            messages.extend(self.history[sent:])
+            sent = len(self.history)
 
-        # model_dump() включает tool_calls=None когда инструментов нет.
-        # Azure/некоторые провайдеры отклоняют такое сообщение если после него
-        # идут role=tool записи. Убираем None-поля перед добавлением в историю.
-        msg_dict = {k: v for k, v in message.model_dump().items() if v is not None}
-        self.history.append(msg_dict)
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=tools if tools else None,
+                tool_choice="auto" if tools else None,
+            )
 
-        if message.tool_calls:
-            for tool_call in message.tool_calls:
-                tool_name = tool_call.function.name
-                arguments_str = tool_call.function.arguments
-                result = None
+            message = response.choices[0].message
+
+            # model_dump() включает tool_calls=None когда инструментов нет.
+            # Azure/некоторые провайдеры отклоняют такое сообщение если после него
+            # идут role=tool записи. Убираем None-поля перед добавлением в историю.
+            msg_dict = message.model_dump(exclude_none=True)
+            self.history.append(msg_dict)
+
+            if message.tool_calls:
+                for tool_call in message.tool_calls:
+                    tool_name = tool_call.function.name
+                    arguments_str = tool_call.function.arguments
+                    result = None
+
+                    try:
+                        tool_args = json_loads(arguments_str)
+
+                        if project_dir:
+                            path_error = None
+                            for k in tool_args:  # меняются только значения - копия ключей не нужна
+                                if k in PATH_ARGS and isinstance(tool_args[k], str):
+                                    try:
+                                        tool_args[k] = _resolve_and_guard(tool_args[k], project_dir)
+                                    except ValueError as path_err:
+                                        log.error(str(path_err))
+                                        path_error = str(path_err)
+                                        break
+                            if path_error:
+                                result = f"ERROR: {path_error}"
+                            else:
+                                if tool_name == "execute_command" and "cwd" not in tool_args:
+                                    tool_args["cwd"] = project_dir
 
-                try:
-                    tool_args = json.loads(arguments_str)
-
-                    if project_dir:
-                        path_error = None
-                        for k in list(tool_args.keys()):
-                            if k in PATH_ARGS and isinstance(tool_args[k], str):
-                                try:
-                                    tool_args[k] = _resolve_and_guard(tool_args[k], project_dir)
-                                except ValueError as path_err:
-                                    log.error(str(path_err))
-                                    path_error = str(path_err)
-                                    break
-                        if path_error:
-                            result = f"ERROR: {path_error}"
-                        else:
-                            if tool_name == "execute_command" and "cwd" not in tool_args:
-                                tool_args["cwd"] = project_dir
-
-                    if result is None:
-                        tool = self.tools_registry.get(tool_name)
-                        if not tool:
-                            result = f"Error: Tool {tool_name} not found"
-                        else:
-                            log.info(f"Использую инструмент: {tool_name} с аргументами: {tool_args}")
-                            if tool_name in DANGEROUS_TOOLS and self.confirmation_callback:
-                                confirmed = await self.confirmation_callback(tool_name, tool_args)
-                                if not confirmed:
-                                    result = "Tool execution cancelled by user."
+                        if result is None:
+                            tool = self.tools_registry.get(tool_name)
+                            if not tool:
+                                result = f"Error: Tool {tool_name} not found"
+                            else:
+                                log.info(f"Использую инструмент: {tool_name} с аргументами: {tool_args}")
+                                if tool_name in DANGEROUS_TOOLS and self.confirmation_callback:
+                                    confirmed = await self.confirmation_callback(tool_name, tool_args)
+                                    if not confirmed:
+                                        result = "Tool execution cancelled by user."
+                                    else:
+                                        validated_args = tool.validate_args(tool_args)
+                                        result = await tool.run(validated_args)
                                 else:
                                     validated_args = tool.validate_args(tool_args)
                                     result = await tool.run(validated_args)
-                            else:
-                                validated_args = tool.validate_args(tool_args)
-                                result = await tool.run(validated_args)
-
-                except json.JSONDecodeError:
-                    result = f"Error: Invalid JSON arguments for {tool_name}"
-                except Exception as e:
-                    log.error(f"tool {tool_name} error: {e}")
-                    result = f"Error executing tool {tool_name}: {e}"
 
-                # tool result ВСЕГДА добавляется для каждого tool_call -
-                # каждый tool_call_id должен иметь ровно один tool result
-                self.history.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": tool_name,
-                    "content": str(result),
-                })
+                    except json.JSONDecodeError:
+                        result = f"Error: Invalid JSON arguments for {tool_name}"
+                    except Exception as e:
+                        log.error(f"tool {tool_name} error: {e}")
+                        result = f"Error executing tool {tool_name}: {e}"
+
+                    # tool result ВСЕГДА добавляется для каждого tool_call -
+                    # каждый tool_call_id должен иметь ровно один tool result
+                    self.history.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call.id,
+                        "name": tool_name,
+                        "content": str(result),
+                    })
 
-            return await self._step(project_dir=project_dir)
+                continue
 
-        return message.content or ""
+            return message.content or ""
 
     def _get_openai_tools(self) -> List[ChatCompletionToolParam]:
         return self.tools_registry.get_openai_schemas()
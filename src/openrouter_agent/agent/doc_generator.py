@@ -5,23 +5,120 @@ DocumentGenerator - генерация документов планирован
 
 import os
 import re
-import json
+import copy
+import asyncio
+import hashlib
+import importlib.util
 import logging
+import random
 import time
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional, Tuple
-from openai import AsyncOpenAI
-from openrouter_agent.utils import find_balanced_json, save_yaml, load_yaml, save_json, load_json
+from functools import partial
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import httpx
+from openai import (
+    AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError,
+)
+from openrouter_agent.utils import (
+    extract_json, save_yaml, load_yaml, save_json, load_json, atomic_write_text,
+    atomic_write_lines, dump_yaml, json_loads, json_dumps, json_dumpb, wait_shared,
+)
 from openrouter_agent.agent.prompts import (
-    PROMPT_PARSE_REQUEST, PROMPT_PROJECT_DIGEST, PROMPT_CHECKLIST,
-    PROMPT_WALKTHROUGH, PROMPT_IMPLEMENTATION_PLAN, PROMPT_REVIEW_COMMENTS,
+    PROMPT_PARSE_REQUEST_FN, PROMPT_PROJECT_DIGEST_FN, PROMPT_CHECKLIST_FN,
+    PROMPT_WALKTHROUGH_FN, PROMPT_IMPLEMENTATION_PLAN_FN, PROMPT_REVIEW_COMMENTS_FN,
 )
 from openrouter_agent.agent.config import PipelineConfig
+from openrouter_agent.agent.stage_manager import (
+    write_execution_log, read_execution_log, empty_log_stats,
+)
 
 log = logging.getLogger(__name__)
 
+__all__ = [
+    "DocumentGenerator", "DOCS_FILES", "LEGACY_FILES", "TASK_STATUSES", "OPENROUTER_BASE_URL",
+    "RETRYABLE_ERRORS",
+]
+
 TASK_STATUSES = {"pending", "in_progress", "completed", "failed", "blocked", "skipped"}
 
+_MARKER = {"completed": "x"}
+
+# Ошибки провайдера, после которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+
+class _RateLimiter:
+    """Ограничитель запросов в минуту: не более rpm стартов в скользящем окне 60с."""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self._starts: List[float] = []
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= 60.0:
+                    self._starts.pop(0)
+                if len(self._starts) < self.rpm:
+                    self._starts.append(now)
+                    return
+                await asyncio.sleep(60.0 - (now - self._starts[0]))
+
+
+# Один лимитер на значение rpm - общий для всех экземпляров DocumentGenerator
+_LIMITERS: Dict[int, _RateLimiter] = {}
+
+_JSON_SIG_RE = re.compile(r'[{}"\\]')
+
+
+class _JsonEnd:
+    """
+    По кускам потокового ответа отслеживает, закрылся ли первый JSON-объект
+    верхнего уровня (те же правила, что у utils.find_balanced_json).
+    """
+    __slots__ = ("started", "depth", "in_string", "escaped")
+
+    def __init__(self):
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False  # кусок закончился обратным слэшем внутри строки
+
+    def feed(self, text: str) -> bool:
+        esc_at = 0 if self.escaped else -1
+        self.escaped = False
+        for m in _JSON_SIG_RE.finditer(text):
+            i = m.start()
+            ch = text[i]
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            escaped = i == esc_at
+            if ch == '"':
+                if not escaped:
+                    self.in_string = not self.in_string
+            elif ch == "\\" and not escaped:
+                esc_at = i + 1
+                self.escaped = esc_at == len(text)
+                continue
+            if not self.in_string:
+                if ch == "{":
+                    self.depth += 1
+                elif ch == "}":
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return True
+        return False
+
+
+MANIFEST_FILE = ".manifest.json"
+
+_COMMENT_RE = re.compile(r"<!--\s*COMMENT:\s*(.*?)\s*-->", re.DOTALL)
+
 DOCS_FILES = {
     "parsed_request": "parsed_request.yaml",
     "digest": "project_digest.yaml",
@@ -31,6 +128,12 @@ DOCS_FILES = {
     "execution_log": "execution_log.yaml",
 }
 
+MD_FILES = {
+    "checklist": "checklist.md",
+    "walkthrough": "walkthrough.md",
+    "plan": "implementation_plan.md",
+}
+
 LEGACY_FILES = {
     "parsed_request": "parsed_request.json",
     "digest": "project_digest.json",
@@ -41,26 +144,147 @@ LEGACY_FILES = {
 }
 
 
+_MISSING = object()
+
+
 def _load_doc(docs_dir: str, key: str) -> Any:
     yaml_path = os.path.join(docs_dir, DOCS_FILES[key])
-    if os.path.exists(yaml_path):
-        return load_yaml(yaml_path)
-    legacy_path = os.path.join(docs_dir, LEGACY_FILES.get(key, ""))
-    if legacy_path and os.path.exists(legacy_path):
-        log.info(f"loading legacy json for {key}: {legacy_path}")
-        return load_json(legacy_path)
-    return None
+    data = load_yaml(yaml_path, _MISSING)
+    if data is not _MISSING:
+        return data
+    if os.path.exists(yaml_path):  # файл есть, но пустой/битый
+        return None
+    if key not in LEGACY_FILES:
+        return None
+    # Без кэша отсутствия: legacy-файл может появиться позже (копия старого проекта).
+    # Отсутствующий файл - одна неудачная попытка open, без отдельного exists
+    legacy_path = os.path.join(docs_dir, LEGACY_FILES[key])
+    data = load_json(legacy_path, _MISSING)
+    if data is _MISSING:
+        return None
+    log.info(f"loaded legacy json for {key}: {legacy_path}")
+    return data
+
+
+# ── Строки markdown: одна функция на элемент, документ собирается одним join ──
+
+def _checklist_row(task: Dict) -> str:
+    g = task.get
+    row = f"- [ ] {g('id', '?')} [{g('category', '')}] {g('title', '')}"
+    deps = g("depends_on", ())
+    if deps:
+        return f"{row}\n  Зависит от: {', '.join(map(str, deps))}"
+    return row
+
+
+def _walkthrough_block(block: Dict) -> str:
+    g = block.get
+    parts = [f"\n## {g('name', '')}", f"Цель: {g('purpose', '')}"]
+    parts += [
+        f"- [{fi.get('operation', '?')}] {fi.get('path', '')} - {fi.get('changes_description', '')}"
+        for fi in g("files", [])
+    ]
+    ids = g("checklist_ids", [])
+    if ids:
+        parts.append(f"Чеклист: {', '.join(map(str, ids))}")
+    risks = g("risks", [])
+    if risks:
+        parts.append(f"Риски: {', '.join(risks)}")
+    return "\n".join(parts)
+
+
+def _plan_row(step: Dict) -> str:
+    g = step.get
+    row = f"- [ ] Шаг {g('step_number', '?')}: {g('description', '')}"
+    target = g("target", "")
+    return f"{row}\n  Файл: {target}" if target else row
+
+
+def _log_row(entry: Dict) -> str:
+    g = entry.get
+    status = g("status", "unknown")
+    row = (f"- [{_MARKER.get(status, ' ')}] Шаг {g('step_number', '?')}: "
+           f"{g('description', '')} [{status}] ({g('elapsed', 0):.1f}s)")
+    error = g("error", "")
+    return f"{row}\n  Ошибка: {error}" if error else row
+
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# (api_key, base_url) -> общий клиент процесса
+_CLIENTS: Dict[Tuple[str, str], AsyncOpenAI] = {}
+
+# Files/Batches API есть только у самого OpenAI; у OpenRouter и прочих
+# OpenAI-совместимых шлюзов его нет - запрос заведомо упадёт
+_BATCH_API_HOSTS = frozenset({"api.openai.com"})
+
+
+def _has_batch_api(client: AsyncOpenAI) -> bool:
+    return client.base_url.host in _BATCH_API_HOSTS
+
+
+def _create_review_file(path: str):
+    # "x" - проверка существования и создание одним системным вызовом
+    try:
+        with open(path, "x", encoding="utf-8") as fh:
+            fh.write(
+                "# Review Comments\n\n"
+                "Оставляйте комментарии в markdown файлах:\n\n"
+                "```\n<!-- COMMENT: текст комментария -->\n```\n\n"
+                "Размещайте тег после строки к которой относится комментарий.\n"
+            )
+    except FileExistsError:
+        pass
 
 
 class DocumentGenerator:
+    @staticmethod
+    def make_client(api_key: str, base_url: str = OPENROUTER_BASE_URL) -> AsyncOpenAI:
+        """
+        AsyncOpenAI поверх настроенного httpx-пула с keep-alive (HTTP/2, если
+        установлен h2). Один клиент на (api_key, base_url) на процесс -
+        все вызовы делят соединения. Транспорт httpx сам не повторяет запросы -
+        повторы остаются в llm_json (backoff, hedge) и в SDK.
+        """
+        key = (api_key, base_url)
+        client = _CLIENTS.get(key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=64,
+                                    keepalive_expiry=60.0),
+                timeout=httpx.Timeout(120.0, connect=5.0),
+                follow_redirects=True,
+            )
+            client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+            _CLIENTS[key] = client
+        return client
+
+    @staticmethod
+    async def close_clients() -> None:
+        """Закрывает общие клиенты и их пулы соединений (при остановке сервера)."""
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+        for client in clients:
+            await client.close()
+
     def __init__(self, config: PipelineConfig = None):
         self.config = config or PipelineConfig()
+        # Одинаковые промпты, запрошенные одновременно, ждут один общий вызов
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Ограничение одновременных запросов к провайдеру (лимиты тарифа OpenRouter)
+        self._llm_sem = asyncio.Semaphore(max(1, self.config.max_concurrency))
+        rpm = self.config.llm_rpm
+        self._limiter = _LIMITERS.setdefault(rpm, _RateLimiter(rpm)) if rpm > 0 else None
+        # docs_dir -> сколько шагов лога уже дописано в поток execution_log.steps.yaml
+        self._log_persisted: Dict[str, int] = {}
+        self._known_dirs: set = set()
 
     # ── LLM вызовы для генерации документов ──
 
     async def parse_request(self, client_request: str, project_digest: str,
                             client: AsyncOpenAI, model: str) -> Dict[str, Any]:
-        prompt = PROMPT_PARSE_REQUEST.format(
+        prompt = PROMPT_PARSE_REQUEST_FN(
             client_request=client_request,
             project_digest=project_digest or "не доступен",
         )
@@ -69,7 +293,7 @@ class DocumentGenerator:
     async def generate_digest(self, file_tree: str, file_contents: str,
                               parsed_request: str, client: AsyncOpenAI,
                               model: str) -> Dict[str, Any]:
-        prompt = PROMPT_PROJECT_DIGEST.format(
+        prompt = PROMPT_PROJECT_DIGEST_FN(
             file_tree=file_tree,
             file_contents=file_contents,
             parsed_request=parsed_request,
@@ -78,7 +302,7 @@ class DocumentGenerator:
 
     async def generate_checklist(self, project_digest: str, parsed_request: str,
                                  client: AsyncOpenAI, model: str) -> Dict[str, Any]:
-        prompt = PROMPT_CHECKLIST.format(
+        prompt = PROMPT_CHECKLIST_FN(
             project_digest=project_digest,
             parsed_request=parsed_request,
         )
@@ -87,7 +311,7 @@ class DocumentGenerator:
     async def generate_walkthrough(self, project_digest: str, parsed_request: str,
                                    checklist: str, client: AsyncOpenAI,
                                    model: str) -> Dict[str, Any]:
-        prompt = PROMPT_WALKTHROUGH.format(
+        prompt = PROMPT_WALKTHROUGH_FN(
             project_digest=project_digest,
             parsed_request=parsed_request,
             checklist=checklist,
@@ -97,7 +321,7 @@ class DocumentGenerator:
     async def generate_plan(self, project_digest: str, parsed_request: str,
                             checklist: str, walkthrough: str,
                             client: AsyncOpenAI, model: str) -> Dict[str, Any]:
-        prompt = PROMPT_IMPLEMENTATION_PLAN.format(
+        prompt = PROMPT_IMPLEMENTATION_PLAN_FN(
             project_digest=project_digest,
             parsed_request=parsed_request,
             checklist=checklist,
@@ -108,7 +332,7 @@ class DocumentGenerator:
     async def parse_review_comments(self, comments: str, checklist: str,
                                     walkthrough: str, plan: str,
                                     client: AsyncOpenAI, model: str) -> Dict[str, Any]:
-        prompt = PROMPT_REVIEW_COMMENTS.format(
+        prompt = PROMPT_REVIEW_COMMENTS_FN(
             client_comments=comments,
             checklist=checklist,
             walkthrough=walkthrough,
@@ -116,26 +340,36 @@ class DocumentGenerator:
         )
         return await self.llm_json(prompt, client, model, self.config.temperature_analysis)
 
+    async def parse_requests_batched(self, items: List[Dict[str, str]],
+                                     client: AsyncOpenAI, model: str) -> List[Dict[str, Any]]:
+        """
+        parse_request для нескольких независимых запросов одним обращением к LLM.
+        items: [{"client_request": ..., "project_digest": ...}, ...]
+        """
+        prompts = [
+            PROMPT_PARSE_REQUEST_FN(
+                client_request=it["client_request"],
+                project_digest=it.get("project_digest") or "не доступен",
+            )
+            for it in items
+        ]
+        return await self.llm_json_batch(prompts, client, model, self.config.temperature_analysis)
+
     # ── Валидация ──
 
     def validate_documents(self, checklist: Dict, walkthrough: Dict,
                            plan: Dict) -> Tuple[bool, List[str]]:
         issues = []
-        checklist_ids = {t["id"] for t in checklist.get("checklist", [])}
+        checklist_ids = {t["id"] for t in checklist.get("checklist", ())}
 
         wt_covered = set()
-        for block in walkthrough.get("blocks", []):
-            for cid in block.get("checklist_ids", []):
-                wt_covered.add(cid)
+        for block in walkthrough.get("blocks", ()):
+            wt_covered.update(block.get("checklist_ids", ()))
         uncovered = checklist_ids - wt_covered
         if uncovered:
             issues.append(f"checklist ids not covered by walkthrough: {uncovered}")
 
-        plan_covered = set()
-        for step in plan.get("steps", []):
-            cid = step.get("checklist_id")
-            if cid:
-                plan_covered.add(cid)
+        plan_covered = {cid for step in plan.get("steps", ()) if (cid := step.get("checklist_id"))}
         plan_uncovered = checklist_ids - plan_covered
         if plan_uncovered:
             issues.append(f"checklist ids not covered by plan: {plan_uncovered}")
@@ -146,16 +380,17 @@ class DocumentGenerator:
 
     def extract_inline_comments(self, docs_dir: str) -> str:
         comments = []
-        for fname in ("checklist.md", "walkthrough.md", "implementation_plan.md"):
+        for fname in MD_FILES.values():
             fpath = os.path.join(docs_dir, fname)
-            if not os.path.exists(fpath):
-                continue
             try:
                 with open(fpath, "r", encoding="utf-8") as fh:
                     content = fh.read()
-                found = re.findall(r"<!--\s*COMMENT:\s*(.*?)\s*-->", content, re.DOTALL)
-                for c in found:
-                    comments.append(f"[{fname}] {c.strip()}")
+                if "<!--" not in content:
+                    continue
+                for m in _COMMENT_RE.finditer(content):
+                    comments.append(f"[{fname}] {m.group(1).strip()}")
+            except FileNotFoundError:
+                continue
             except Exception as e:
                 log.warning(f"error reading {fpath}: {e}")
         return "\n".join(comments)
@@ -164,91 +399,321 @@ class DocumentGenerator:
 
     def mark_step_completed(self, docs_dir: str, checklist_id: str,
                             step_number: Any):
-        cl_path = os.path.join(docs_dir, "checklist.md")
-        if not os.path.exists(cl_path):
-            cl_path = os.path.join(docs_dir, "artifacts", "checklist.md")
-        if not os.path.exists(cl_path):
-            return
-        try:
-            with open(cl_path, "r", encoding="utf-8") as fh:
-                content = fh.read()
-            pattern = rf"(\- \[) \](\s*{re.escape(str(checklist_id))})"
-            updated = re.sub(pattern, r"\1x]\2", content, count=1)
-            if updated != content:
-                with open(cl_path, "w", encoding="utf-8") as fh:
-                    fh.write(updated)
-        except Exception as e:
-            log.warning(f"mark_step_completed error: {e}")
+        targets = (
+            ("checklist.md", checklist_id,
+             rf"^- \[ \](?= {re.escape(str(checklist_id))}(?:\s|$))"),
+            ("implementation_plan.md", step_number,
+             rf"^- \[ \](?= Шаг {re.escape(str(step_number))}:)"),
+        )
+        for fname, key, pattern in targets:
+            if key is None or key == "":
+                continue
+            content = None
+            for path in (os.path.join(docs_dir, fname),
+                         os.path.join(docs_dir, "artifacts", fname)):
+                try:
+                    with open(path, "r", encoding="utf-8") as fh:
+                        content = fh.read()
+                    break
+                except FileNotFoundError:
+                    continue
+            if content is None:
+                continue
+            try:
+                updated = re.compile(pattern, re.M).sub("- [x]", content, count=1)
+                if updated != content:
+                    atomic_write_text(path, updated)
+            except Exception as e:
+                log.warning(f"mark_step_completed error: {e}")
 
     # ── Сохранение ──
 
+    def _save_jobs(self, docs_dir: str, docs: Dict[str, Any],
+                   manifest: Dict[str, Any]) -> List[Callable[[], Any]]:
+        """Независимые операции записи документов - можно выполнять в любом порядке."""
+        renderers = {
+            "checklist": self._save_checklist_md,
+            "walkthrough": self._save_walkthrough_md,
+            "plan": self._save_plan_md,
+        }
+        jobs: List[Callable[[], Any]] = []
+        for key in ("parsed_request", "digest", "checklist", "walkthrough", "plan"):
+            if key not in docs:
+                continue
+            data = docs[key]
+            if self._doc_unchanged(docs_dir, key, data, manifest):
+                continue
+            if key in renderers:
+                jobs.append(partial(renderers[key], docs_dir, data, manifest))
+            jobs.append(lambda key=key, data=data: self._write_doc(
+                docs_dir, DOCS_FILES[key], dump_yaml(data), manifest))
+        jobs.append(partial(_create_review_file, os.path.join(docs_dir, "review_comments.md")))
+        return jobs
+
+    def _doc_unchanged(self, docs_dir: str, key: str, data: Any,
+                       manifest: Dict[str, Any]) -> bool:
+        """
+        Сравнивает отпечаток исходных данных документа с сохранённым в manifest.
+        Совпал и файлы на диске не трогали - рендер yaml/md можно пропустить.
+        Иначе запоминает новый отпечаток.
+        """
+        try:
+            fp = hashlib.sha256(json_dumps(data).encode("utf-8")).hexdigest()
+        except (TypeError, ValueError):
+            return False
+        mark = "@" + key
+        if manifest.get(mark) == fp:
+            fnames = [DOCS_FILES[key]]
+            if key in MD_FILES:
+                fnames.append(MD_FILES[key])
+            try:
+                if all(fname in manifest and os.stat(os.path.join(docs_dir, fname)).st_mtime_ns
+                       == manifest[fname][1] for fname in fnames):
+                    return True
+            except OSError:
+                pass
+        manifest[mark] = fp
+        return False
+
     def save_to_project(self, docs_dir: str, docs: Dict[str, Any]) -> str:
-        os.makedirs(docs_dir, exist_ok=True)
-        if "parsed_request" in docs:
-            save_yaml(os.path.join(docs_dir, DOCS_FILES["parsed_request"]),
-                      docs["parsed_request"])
-        if "digest" in docs:
-            save_yaml(os.path.join(docs_dir, DOCS_FILES["digest"]),
-                      docs["digest"])
-        if "checklist" in docs:
-            self._save_checklist_md(docs_dir, docs["checklist"])
-            save_yaml(os.path.join(docs_dir, DOCS_FILES["checklist"]),
-                      docs["checklist"])
-        if "walkthrough" in docs:
-            self._save_walkthrough_md(docs_dir, docs["walkthrough"])
-            save_yaml(os.path.join(docs_dir, DOCS_FILES["walkthrough"]),
-                      docs["walkthrough"])
-        if "plan" in docs:
-            self._save_plan_md(docs_dir, docs["plan"])
-            save_yaml(os.path.join(docs_dir, DOCS_FILES["plan"]),
-                      docs["plan"])
-        review_path = os.path.join(docs_dir, "review_comments.md")
-        if not os.path.exists(review_path):
-            with open(review_path, "w", encoding="utf-8") as fh:
-                fh.write("# Review Comments\n\n")
-                fh.write("Оставляйте комментарии в markdown файлах:\n\n")
-                fh.write("```\n<!-- COMMENT: текст комментария -->\n```\n\n")
-                fh.write("Размещайте тег после строки к которой относится комментарий.\n")
+        self._ensure_dir(docs_dir)
+        manifest_path = os.path.join(docs_dir, MANIFEST_FILE)
+        manifest = load_json(manifest_path, {})
+        before = dict(manifest)
+        for job in self._save_jobs(docs_dir, docs, manifest):
+            job()
+        if manifest != before:
+            save_json(manifest_path, manifest)
         log.info(f"docs saved to {docs_dir}")
         return docs_dir
 
+    async def asave_to_project(self, docs_dir: str, docs: Dict[str, Any]) -> str:
+        """save_to_project с параллельной записью файлов в потоках."""
+        self._ensure_dir(docs_dir)
+        manifest_path = os.path.join(docs_dir, MANIFEST_FILE)
+        manifest = await asyncio.to_thread(load_json, manifest_path, {})
+        before = dict(manifest)
+        await asyncio.gather(*(asyncio.to_thread(job)
+                               for job in self._save_jobs(docs_dir, docs, manifest)))
+        if manifest != before:
+            await asyncio.to_thread(save_json, manifest_path, manifest)
+        log.info(f"docs saved to {docs_dir}")
+        return docs_dir
+
+    def _ensure_dir(self, docs_dir: str):
+        if docs_dir not in self._known_dirs:
+            os.makedirs(docs_dir, exist_ok=True)
+            self._known_dirs.add(docs_dir)
+
+    def _write_doc(self, docs_dir: str, fname: str, text: str,
+                   manifest: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Пишет файл документа. С manifest пропускает запись, если содержимое
+        не изменилось и файл не трогали с прошлого сохранения (mtime совпадает).
+        """
+        path = os.path.join(docs_dir, fname)
+        if manifest is None:
+            atomic_write_text(path, text)
+            return True
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        prev = manifest.get(fname)
+        if prev and prev[0] == digest:
+            try:
+                if os.stat(path).st_mtime_ns == prev[1]:
+                    return False
+            except OSError:
+                pass
+        atomic_write_text(path, text)
+        manifest[fname] = [digest, os.stat(path).st_mtime_ns]
+        return True
+
     def save_execution_log(self, docs_dir: str, log_entries: List[Dict],
                            meta: Dict[str, Any] = None) -> str:
-        os.makedirs(docs_dir, exist_ok=True)
-        stats = {"completed": 0, "failed": 0, "blocked": 0, "skipped": 0}
-        for e in log_entries:
-            s = e.get("status", "unknown")
-            if s in stats:
-                stats[s] += 1
-        data = {"meta": meta or {}, "stats": stats, "steps": log_entries}
+        self._ensure_dir(docs_dir)
         yaml_path = os.path.join(docs_dir, DOCS_FILES["execution_log"])
-        save_yaml(yaml_path, data)
-        self._save_execution_log_md(docs_dir, log_entries, stats)
+        meta = meta or {}
+        stats = None
+        if meta.get("status") != "running":
+            # markdown - человекочитаемая копия, во время выполнения не перерисовывается
+            stats = empty_log_stats()
+            self._save_execution_log_md(docs_dir, log_entries, stats)  # заполняет stats
+        _, self._log_persisted[docs_dir] = write_execution_log(
+            yaml_path, log_entries, meta, self._log_persisted.get(docs_dir, 0), stats,
+        )
         log.info(f"execution log saved: {yaml_path}")
         return yaml_path
 
     def load_execution_log(self, docs_dir: str) -> Optional[Dict[str, Any]]:
-        return _load_doc(docs_dir, "execution_log")
+        data = read_execution_log(os.path.join(docs_dir, DOCS_FILES["execution_log"]))
+        return data if data is not None else _load_doc(docs_dir, "execution_log")
 
     def load_plan(self, docs_dir: str) -> Optional[Dict[str, Any]]:
         return _load_doc(docs_dir, "plan")
 
+    def load_checklist(self, docs_dir: str) -> Optional[Dict[str, Any]]:
+        return _load_doc(docs_dir, "checklist")
+
     # ── Публичный LLM JSON метод ──
 
     async def llm_json(self, prompt: str, client: AsyncOpenAI, model: str,
                        temperature: float = 0.2) -> Dict[str, Any]:
+        key = hashlib.sha256(f"{model}\0{temperature}\0{prompt}".encode("utf-8")).hexdigest()
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        while (pending := self._inflight.get(key)) is not None:
+            shared = await wait_shared(pending)
+            if shared is not None:
+                # Каждому ждущему - своя копия: результат - изменяемый dict
+                return copy.deepcopy(shared)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await self._llm_json_call(prompt, client, model, temperature)
+            # В future - снимок: вызывающий может изменить result до того, как проснутся ждущие
+            fut.set_result(copy.deepcopy(result))
+            if result:
+                self._cache_put(key, result)
+            return result
+        except BaseException:
+            fut.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    # ── Дисковый кэш ответов (model, temperature, prompt) ──
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(os.path.expanduser(self.config.cache_dir), key[:2], f"{key}.json")
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.config.cache_enabled:
+            return None
+        path = self._cache_path(key)
         try:
+            if time.time() - os.stat(path).st_mtime > self.config.cache_ttl_s:
+                # Просроченная запись удаляется сразу - каталог кэша не растёт бесконечно
+                os.remove(path)
+                return None
+        except OSError:
+            return None
+        data = load_json(path)
+        if data is not None:
+            log.debug(f"llm cache hit {key[:12]}")
+        return data
+
+    def _cache_put(self, key: str, data: Dict[str, Any]):
+        if not self.config.cache_enabled:
+            return
+        try:
+            save_json(self._cache_path(key), data)
+        except OSError as e:
+            log.warning(f"llm cache write error: {e}")
+
+    def retry_delay(self, e: Exception, attempt: int) -> float:
+        delay = self.config.llm_backoff_base_s * (2 ** attempt)
+        response = getattr(e, "response", None)
+        if isinstance(e, RateLimitError) and response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except (TypeError, ValueError):
+                pass
+        return delay + random.random() * 0.3
+
+    async def _create_completion(self, prompt: str, client: AsyncOpenAI, model: str,
+                                 temperature: float) -> str:
+        async with self._llm_sem:
+            if self._limiter:
+                await self._limiter.acquire()
+            if self.config.stream_responses:
+                return await self._stream_until_json_end(prompt, client, model, temperature)
             r = await client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=temperature,
             )
-            raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            if not js:
+        return r.choices[0].message.content or ""
+
+    @staticmethod
+    async def _stream_until_json_end(prompt: str, client: AsyncOpenAI, model: str,
+                                     temperature: float) -> str:
+        """
+        Потоковый ответ на JSON-промпт. Как только внешний объект закрылся,
+        поток закрывается: хвост после JSON (пояснения, повторы выродившегося
+        ответа) не генерируется и не оплачивается.
+        """
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+        )
+        parts: List[str] = []
+        end = _JsonEnd()
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    parts.append(text)
+                    if end.feed(text):
+                        break
+        finally:
+            await stream.close()
+        return "".join(parts)
+
+    async def _create_hedged(self, prompt: str, client: AsyncOpenAI, model: str,
+                             temperature: float):
+        """
+        Если ответ не пришёл за config.hedge_after_s, отправляет дублирующий
+        запрос и берёт первый успешный; второй отменяется.
+        """
+        hedge = self.config.hedge_after_s
+        if hedge <= 0:
+            return await self._create_completion(prompt, client, model, temperature)
+        first = asyncio.create_task(self._create_completion(prompt, client, model, temperature))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge)
+            if not done:
+                log.info(f"llm call slower than {hedge}s, sending hedged request")
+                pending.add(asyncio.create_task(
+                    self._create_completion(prompt, client, model, temperature)))
+            error = None
+            while True:
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    error = t.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for t in pending:
+                t.cancel()
+
+    async def _llm_json_call(self, prompt: str, client: AsyncOpenAI, model: str,
+                             temperature: float) -> Dict[str, Any]:
+        try:
+            attempt = 0
+            while True:
+                try:
+                    raw = await self._create_hedged(prompt, client, model, temperature)
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.config.llm_max_retries:
+                        raise
+                    delay = self.retry_delay(e, attempt)
+                    log.warning(f"llm call failed ({type(e).__name__}), retry in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+            data = extract_json(raw)
+            if data is None:
                 log.warning(f"llm returned no json, raw: {raw[:300]}")
                 return {}
-            return json.loads(js)
+            return data
         except Exception as e:
             log.error(f"llm_json error: {e}")
             return {}
@@ -256,74 +721,172 @@ class DocumentGenerator:
     # Обратная совместимость
     _llm_json = llm_json
 
+    async def llm_json_batch(self, prompts: List[str], client: AsyncOpenAI, model: str,
+                             temperature: float = 0.2) -> List[Dict[str, Any]]:
+        """
+        Упаковывает до config.llm_batch_size промптов (не более
+        config.llm_batch_max_chars символов) в один запрос.
+        Результаты возвращаются в порядке prompts; слишком длинные промпты и
+        элементы, которые модель пропустила, добираются одиночными вызовами llm_json.
+        """
+        if len(prompts) <= 1:
+            return [await self.llm_json(p, client, model, temperature) for p in prompts]
+
+        size = max(1, self.config.llm_batch_size)
+        max_chars = self.config.llm_batch_max_chars
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        single: List[int] = []
+        chunks: List[List[int]] = [[]]
+        chunk_chars = 0
+        for i, p in enumerate(prompts):
+            if len(p) > max_chars:
+                single.append(i)
+                continue
+            if len(chunks[-1]) >= size or chunk_chars + len(p) > max_chars:
+                chunks.append([])
+                chunk_chars = 0
+            chunks[-1].append(i)
+            chunk_chars += len(p)
+
+        async def run_chunk(idxs: List[int]):
+            if len(idxs) == 1:
+                single.append(idxs[0])
+                return
+            items = "\n\n".join(f"### id={n}\n{prompts[i]}" for n, i in enumerate(idxs))
+            prompt = (
+                f"Ниже {len(idxs)} независимых заданий. Выполни каждое отдельно.\n"
+                'Верни ТОЛЬКО JSON: {"results": [{"id": 0, "data": {...}}, ...]}\n'
+                "где data - JSON-ответ на задание с соответствующим id.\n\n"
+                f"{items}"
+            )
+            reply = await self.llm_json(prompt, client, model, temperature)
+            by_id = {}
+            for entry in reply.get("results", []):
+                if isinstance(entry, dict) and isinstance(entry.get("data"), dict):
+                    by_id[str(entry.get("id"))] = entry["data"]
+            for n, i in enumerate(idxs):
+                data = by_id.get(str(n))
+                if data is None:
+                    log.warning(f"batch reply missing id={n}, falling back to single call")
+                    single.append(i)
+                else:
+                    results[i] = data
+
+        await asyncio.gather(*(run_chunk(c) for c in chunks if c))
+
+        async def run_single(i: int):
+            results[i] = await self.llm_json(prompts[i], client, model, temperature)
+
+        await asyncio.gather(*(run_single(i) for i in single))
+        return results
+
+    _llm_json_batch = llm_json_batch
+
+    async def llm_json_batched(self, prompts: List[str], client: AsyncOpenAI, model: str,
+                               temperature: float = 0.2) -> List[Dict[str, Any]]:
+        """
+        Прогон не срочных промптов через Batch API провайдера (дешевле, но ответ
+        приходит с задержкой). Батч идёт, только если включён config.use_batch_api
+        и у провайдера клиента есть Batch API; иначе (и для ответов, которых
+        батч не вернул) - обычный llm_json_batch.
+        """
+        if not prompts:
+            return []
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        if self.config.use_batch_api and _has_batch_api(client):
+            try:
+                results = await self._run_provider_batch(prompts, client, model, temperature)
+            except Exception as e:
+                log.error(f"batch api error, falling back to sync calls: {e}")
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            # Недостающие - обычным путём: упаковка и параллельные вызовы под общим семафором
+            fallback = await self.llm_json_batch([prompts[i] for i in missing], client, model, temperature)
+            for i, r in zip(missing, fallback):
+                results[i] = r
+        return results
+
+    async def _run_provider_batch(self, prompts: List[str], client: AsyncOpenAI, model: str,
+                                  temperature: float) -> List[Optional[Dict[str, Any]]]:
+        payload = b"".join(json_dumpb({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": p}],
+                "temperature": temperature,
+            },
+        }) + b"\n" for i, p in enumerate(prompts))
+
+        batch_file = await client.files.create(file=("batch.jsonl", payload), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        log.info(f"batch {batch.id} submitted: {len(prompts)} requests")
+
+        deadline = time.monotonic() + self.config.batch_timeout_s
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"batch {batch.id} not finished in {self.config.batch_timeout_s}s")
+            await asyncio.sleep(self.config.batch_poll_interval_s)
+            batch = await client.batches.retrieve(batch.id)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        if batch.status != "completed" or not batch.output_file_id:
+            log.warning(f"batch {batch.id} finished with status {batch.status}")
+            return results
+
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                row = json_loads(line)
+                idx = int(row["custom_id"])
+                raw = row["response"]["body"]["choices"][0]["message"]["content"] or ""
+                data = extract_json(raw)
+                if data is not None:
+                    results[idx] = data
+            except Exception as e:
+                log.warning(f"batch output line skipped: {e}")
+        return results
+
     # ── MD генераторы ──
 
-    def _save_checklist_md(self, docs_dir: str, checklist: Dict):
-        lines = ["# Чеклист задач\n"]
-        for task in checklist.get("checklist", []):
-            tid = task.get("id", "?")
-            title = task.get("title", "")
-            cat = task.get("category", "")
-            deps = task.get("depends_on", [])
-            lines.append(f"- [ ] {tid} [{cat}] {title}")
-            if deps:
-                lines.append(f"  Зависит от: {', '.join(str(d) for d in deps)}")
-        path = os.path.join(docs_dir, "checklist.md")
-        with open(path, "w", encoding="utf-8") as fh:
-            fh.write("\n".join(lines))
-
-    def _save_walkthrough_md(self, docs_dir: str, walkthrough: Dict):
-        lines = [f"# {walkthrough.get('title', 'Walkthrough')}\n"]
-        lines.append(f"{walkthrough.get('summary', '')}\n")
-        for block in walkthrough.get("blocks", []):
-            lines.append(f"\n## {block.get('name', '')}")
-            lines.append(f"Цель: {block.get('purpose', '')}")
-            for fi in block.get("files", []):
-                lines.append(
-                    f"- [{fi.get('operation', '?')}] {fi.get('path', '')} "
-                    f"- {fi.get('changes_description', '')}"
-                )
-            ids = block.get("checklist_ids", [])
-            if ids:
-                lines.append(f"Чеклист: {', '.join(str(i) for i in ids)}")
-            risks = block.get("risks", [])
-            if risks:
-                lines.append(f"Риски: {', '.join(risks)}")
-        path = os.path.join(docs_dir, "walkthrough.md")
-        with open(path, "w", encoding="utf-8") as fh:
-            fh.write("\n".join(lines))
-
-    def _save_plan_md(self, docs_dir: str, plan: Dict):
-        lines = ["# План имплементации\n"]
-        for step in plan.get("steps", []):
-            sn = step.get("step_number", "?")
-            desc = step.get("description", "")
-            target = step.get("target", "")
-            lines.append(f"- [ ] Шаг {sn}: {desc}")
-            if target:
-                lines.append(f"  Файл: {target}")
-        path = os.path.join(docs_dir, "implementation_plan.md")
-        with open(path, "w", encoding="utf-8") as fh:
-            fh.write("\n".join(lines))
+    def _save_checklist_md(self, docs_dir: str, checklist: Dict,
+                           manifest: Optional[Dict[str, Any]] = None):
+        text = "\n".join(["# Чеклист задач\n", *map(_checklist_row, checklist.get("checklist", []))])
+        self._write_doc(docs_dir, MD_FILES["checklist"], text, manifest)
+
+    def _save_walkthrough_md(self, docs_dir: str, walkthrough: Dict,
+                             manifest: Optional[Dict[str, Any]] = None):
+        text = "\n".join([
+            f"# {walkthrough.get('title', 'Walkthrough')}\n",
+            f"{walkthrough.get('summary', '')}\n",
+            *map(_walkthrough_block, walkthrough.get("blocks", [])),
+        ])
+        self._write_doc(docs_dir, MD_FILES["walkthrough"], text, manifest)
+
+    def _save_plan_md(self, docs_dir: str, plan: Dict,
+                      manifest: Optional[Dict[str, Any]] = None):
+        text = "\n".join(["# План имплементации\n", *map(_plan_row, plan.get("steps", []))])
+        self._write_doc(docs_dir, MD_FILES["plan"], text, manifest)
 
     def _save_execution_log_md(self, docs_dir: str, log_entries: List[Dict],
-                               stats: Dict):
-        lines = ["# Лог выполнения\n"]
-        for entry in log_entries:
-            status = entry.get("status", "unknown")
-            step = entry.get("step_number", "?")
-            desc = entry.get("description", "")
-            elapsed = entry.get("elapsed", 0)
-            error = entry.get("error", "")
-            marker = "x" if status == "completed" else " "
-            lines.append(
-                f"- [{marker}] Шаг {step}: {desc} [{status}] ({elapsed:.1f}s)"
-            )
-            if error:
-                lines.append(f"  Ошибка: {error}")
-        lines.append("\n## Статистика\n")
-        for k, v in stats.items():
-            lines.append(f"- {k}: {v}")
-        path = os.path.join(docs_dir, "execution_log.md")
-        with open(path, "w", encoding="utf-8") as fh:
-            fh.write("\n".join(lines))
+                               stats: Dict[str, int]):
+        """Рендерит лог и по ходу считает stats (передаётся обнулённым)."""
+        def lines():
+            yield "# Лог выполнения\n"
+            for entry in log_entries:
+                status = entry.get("status", "unknown")
+                if status in stats:
+                    stats[status] += 1
+                yield _log_row(entry)
+            yield "\n## Статистика\n"
+            for k, v in stats.items():
+                yield f"- {k}: {v}"
+
+        atomic_write_lines(os.path.join(docs_dir, "execution_log.md"), lines())
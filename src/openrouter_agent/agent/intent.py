@@ -1,10 +1,11 @@
 import re
-import json
+import asyncio
 import logging
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional
 from difflib import get_close_matches
 from openai import AsyncOpenAI
-from openrouter_agent.utils import find_balanced_json
+from openrouter_agent.utils import extract_json, prompt_key, TTLCache
 
 log = logging.getLogger(__name__)
 
@@ -18,8 +19,55 @@ INTENT_KEYWORDS = {
     "optimize": ["optimize", "improve", "refactor", "оптимизируй", "улучши"],
 }
 
+_INTENT_ORDER = list(INTENT_KEYWORDS)
+
+# ключевое слово -> индекс первого намерения, в котором оно встречается
+KEYWORD_TO_RANK = {}
+for _rank, _kws in enumerate(INTENT_KEYWORDS.values()):
+    for _kw in _kws:
+        KEYWORD_TO_RANK.setdefault(_kw, _rank)
+
+INTENT_BATCH_LIMIT = 20
+
+_WORD_RE = re.compile(r"[a-zA-Z0-9_]+")
+
+
+@lru_cache(maxsize=4096)
+def _word_rank(word: str, cutoff: float) -> Optional[int]:
+    """Лучший (наименьший) индекс намерения, ключевое слово которого похоже на word."""
+    best = KEYWORD_TO_RANK.get(word)
+    # точное совпадение с первым намерением лучше уже не станет
+    for rank, keywords in enumerate(INTENT_KEYWORDS.values()):
+        if best is not None and rank >= best:
+            break
+        if get_close_matches(word, keywords, n=1, cutoff=cutoff):
+            return rank
+    return best
+
 
 class IntentClassifier:
+    def __init__(self, max_concurrency: int = 4, cache_size: int = 1024, cache_ttl_s: float = 3600.0):
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        self._cache = TTLCache(cache_size, cache_ttl_s)
+
+    async def _complete(self, client: AsyncOpenAI, model: str, prompt: str) -> str:
+        key = prompt_key(model, prompt)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        async with self._sem:
+            r = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+            )
+        return r.choices[0].message.content or ""
+
+    def _remember(self, model: str, prompt: str, raw: str) -> None:
+        # Кэшируется только разобранный и проверенный ответ - битый или
+        # обрезанный ответ не должен повторяться весь TTL вместо нового запроса
+        self._cache.put(prompt_key(model, prompt), raw)
+
     def classify(self, goal: str) -> str:
         intent = self._fuzzy_match(goal)
         if intent:
@@ -39,13 +87,42 @@ class IntentClassifier:
         result = await self._llm_fallback(goal, client, model)
         return result or "create"
 
+    async def classify_many_with_llm(self, goals: List[str], client: AsyncOpenAI,
+                                     model: str) -> List[str]:
+        """
+        classify_with_llm для списка целей: то, что не решили ключевые слова,
+        уходит в LLM одним запросом на пачку до INTENT_BATCH_LIMIT целей.
+        """
+        intents: List[Optional[str]] = []
+        pending: List[int] = []
+        for i, goal in enumerate(goals):
+            intent = self._fuzzy_match(goal)
+            if not intent:
+                low = goal.lower()
+                if "what does" in low or "explain" in low:
+                    intent = "explain"
+                else:
+                    pending.append(i)
+            intents.append(intent)
+
+        chunks = [pending[i:i + INTENT_BATCH_LIMIT] for i in range(0, len(pending), INTENT_BATCH_LIMIT)]
+        results = await asyncio.gather(
+            *(self._llm_fallback_many([goals[i] for i in chunk], client, model) for chunk in chunks)
+        )
+        for chunk, chunk_intents in zip(chunks, results):
+            for i, intent in zip(chunk, chunk_intents):
+                intents[i] = intent or "create"
+        return intents
+
     def _fuzzy_match(self, text: str, cutoff: float = 0.75) -> Optional[str]:
-        words = re.findall(r"[a-zA-Z0-9_]+", text.lower())
-        for intent, keywords in INTENT_KEYWORDS.items():
-            for w in words:
-                if get_close_matches(w, keywords, n=1, cutoff=cutoff):
-                    return intent
-        return None
+        best = None
+        for w in set(_WORD_RE.findall(text.lower())):
+            rank = _word_rank(w, cutoff)
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        return _INTENT_ORDER[best] if best is not None else None
 
     async def _llm_fallback(self, goal: str, client: AsyncOpenAI, model: str) -> Optional[str]:
         prompt = (
@@ -56,16 +133,46 @@ class IntentClassifier:
             f"User text: {goal}"
         )
         try:
-            r = await client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-            )
-            raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            if not js:
+            raw = await self._complete(client, model, prompt)
+            data = extract_json(raw)
+            if data is None:
                 return None
-            return json.loads(js).get("intent")
+            intent = data.get("intent")
+            if intent in INTENT_KEYWORDS:
+                self._remember(model, prompt, raw)
+            return intent
         except Exception as e:
             log.warning(f"intent llm fallback error: {e}")
             return None
+
+    async def _llm_fallback_many(self, goals: List[str], client: AsyncOpenAI,
+                                 model: str) -> List[Optional[str]]:
+        if len(goals) == 1:
+            return [await self._llm_fallback(goals[0], client, model)]
+        inputs = "\n".join(f"{i}. {g}" for i, g in enumerate(goals, 1))
+        prompt = (
+            "You are a strict JSON responder. Classify the intent of EACH numbered user text into one of: "
+            "pipeline, create, edit, run, explain, test, optimize.\n"
+            "Use 'pipeline' if the user wants to start a new project, application, or large system.\n"
+            'Return ONLY JSON like: {"intents":[{"index":1,"intent":"create"},{"index":2,"intent":"run"}]}\n'
+            f"User texts:\n{inputs}"
+        )
+        try:
+            raw = await self._complete(client, model, prompt)
+            data = extract_json(raw)
+            by_index = {
+                item.get("index"): item.get("intent")
+                for item in (data or {}).get("intents", [])
+                if isinstance(item, dict)
+            }
+            result = [by_index.get(i) for i in range(1, len(goals) + 1)]
+            result = [x if x in INTENT_KEYWORDS else None for x in result]
+            if any(x is not None for x in result):
+                self._remember(model, prompt, raw)
+        except Exception as e:
+            log.warning(f"intent llm batch error: {e}")
+            result = [None] * len(goals)
+        if all(x is None for x in result):
+            # Пачка не разобралась - по одному запросу на цель
+            return list(await asyncio.gather(*(self._llm_fallback(g, client, model) for g in goals)))
+        return result
@@ -1,39 +1,96 @@
+import os
 import re
 import logging
 from typing import Optional, Dict, Any, List
-from openrouter_agent.utils import load_json, save_json
+from openrouter_agent.utils import load_json, save_json, append_json_lines, load_json_lines
 
 log = logging.getLogger(__name__)
 
 DEFAULT_MEMORY_PATH = "memory/episodes.json"
 
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9]+")
+
+
+def _goal_tokens(goal: str) -> frozenset:
+    return frozenset(_TOKEN_RE.findall(goal.lower()))
+
+
+def _ends_torn(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if not f.tell():
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except FileNotFoundError:
+        return False
+
 
 class EpisodeMemory:
     def __init__(self, path: str = DEFAULT_MEMORY_PATH):
         self.path = path
+        # episodes.json - сжатый снимок, episodes.jsonl - журнал добавленных после него эпизодов
+        self.journal_path = os.path.splitext(self.path)[0] + ".jsonl"
         self.episodes: List[Dict[str, Any]] = load_json(self.path, [])
+        # Журнал только дочитывается: загрузка ничего не пишет, снимок
+        # пересобирается при следующем save()
+        self.episodes.extend(load_json_lines(self.journal_path))
+        # Оборванная последняя строка склеилась бы с первой дозаписью - тогда
+        # первый add() пересобирает снимок вместо дозаписи
+        self._journal_torn = _ends_torn(self.journal_path)
+        self._reindex()
         log.info(f"memory loaded: {len(self.episodes)} episodes from {self.path}")
 
+    def _reindex(self) -> None:
+        # Токены целей считаются один раз на эпизод, а не на каждый find_similar;
+        # инвертированный индекс токен -> номера эпизодов отсекает эпизоды без общих токенов
+        self._token_sets: List[frozenset] = []
+        self._index: Dict[str, List[int]] = {}
+        for ep in self.episodes:
+            self._index_episode(ep)
+
+    def _index_episode(self, episode: Dict[str, Any]) -> None:
+        i = len(self._token_sets)
+        tokens = _goal_tokens(episode.get("goal", ""))
+        self._token_sets.append(tokens)
+        for t in tokens:
+            self._index.setdefault(t, []).append(i)
+
     def save(self) -> None:
+        """Полная перезапись снимка (сжатие журнала); журнал после этого не нужен."""
         save_json(self.path, self.episodes)
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
 
     def add(self, episode: Dict[str, Any]) -> None:
         self.episodes.append(episode)
-        self.save()
+        self._index_episode(episode)
+        if self._journal_torn:
+            self.save()
+            self._journal_torn = False
+        else:
+            append_json_lines(self.journal_path, [episode])
         log.info(f"episode saved, total: {len(self.episodes)}")
 
     def recent(self, n: int = 5) -> List[Dict[str, Any]]:
         return self.episodes[-n:]
 
     def find_similar(self, goal: str, cutoff: float = 0.6) -> Optional[Dict[str, Any]]:
-        goal_tokens = set(re.findall(r"[a-zA-Z0-9]+", goal.lower()))
+        if len(self._token_sets) != len(self.episodes):
+            self._reindex()
+        goal_tokens = _goal_tokens(goal)
+        candidates = set()
+        for t in goal_tokens:
+            candidates.update(self._index.get(t, ()))
         best, best_score = None, 0.0
-        for ep in self.episodes:
-            tokens2 = set(re.findall(r"[a-zA-Z0-9]+", ep.get("goal", "").lower()))
-            if not tokens2:
-                continue
-            score = len(goal_tokens & tokens2) / max(1, len(goal_tokens | tokens2))
+        # По возрастанию номера - при равенстве счёта выигрывает более ранний эпизод
+        for i in sorted(candidates):
+            tokens2 = self._token_sets[i]
+            score = len(goal_tokens & tokens2) / len(goal_tokens | tokens2)
             if score > best_score:
                 best_score = score
-                best = ep
+                best = self.episodes[i]
         return best if best_score >= cutoff else None
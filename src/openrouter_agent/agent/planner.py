@@ -1,58 +1,114 @@
+import re
 import json
+import asyncio
 import logging
 from typing import Dict, Any, List, Tuple, Optional
 from openai import AsyncOpenAI
-from openrouter_agent.utils import find_balanced_json
+from openrouter_agent.utils import extract_json, json_dumps, prompt_key, TTLCache
 
 log = logging.getLogger(__name__)
 
 ALLOWED_ACTIONS = {"write_file", "run_file", "read_file", "print", "explain", "test"}
 PLAN_STEP_LIMIT = 12
 
+_NEEDS_FILENAME = frozenset({"write_file", "run_file", "read_file", "explain", "test"})
+_UNSAFE_FILENAME_RE = re.compile(r"^/|\.\.|\\")
+
+
+def _safe_filename(fn: Any) -> bool:
+    return bool(fn) and isinstance(fn, str) and not _UNSAFE_FILENAME_RE.search(fn)
+
+# Постоянные части промптов собираются один раз при импорте
+_PLAN_SAMPLE = {
+    "plan": [
+        {"action": "write_file", "filename": "sum.py", "content": "def add(a,b):\\n    return a+b\\n\\nprint(add(2,3))"},
+        {"action": "run_file", "filename": "sum.py", "args": []},
+    ]
+}
+_PLAN_PROMPT_HEAD = (
+    "You are a planning assistant. Output ONLY a single VALID JSON object (no explanations).\n"
+    "Schema:\n"
+    '{ "plan": [ step1, step2, ... ] }\n'
+    "Each step must be an object with:\n"
+    '- action: one of "write_file", "run_file", "read_file", "print", "explain", "test"\n'
+    "- write_file: include filename and content (full file text)\n"
+    "- run_file: include filename and optional args (list)\n"
+    "- read_file: include filename\n"
+    "- print: include text\n"
+    "- explain: include filename\n"
+    "- test: include filename and tests list (optional)\n\n"
+    "Keep steps minimal & deterministic. Use filenames only (no absolute paths).\n"
+    f"Example:\n{json.dumps(_PLAN_SAMPLE, indent=2)}\n\n"
+)
+_FIX_PROMPT_HEAD = (
+    "You are a helpful assistant that FIXES a single step when it failed.\n"
+    "Output ONLY a single valid JSON object.\n\n"
+    "Input:\n"
+)
+_FIX_PROMPT_RULES = (
+    "Rules:\n"
+    '- Return JSON like: { "fixed_step": { ... } } where fixed_step follows the step schema.\n'
+    '- If you cannot fix it, return: { "action": "abort", "reason": "..." }\n'
+    "- Do NOT include any explanation text.\n"
+    "- Allowed actions: write_file (full content), run_file (args), read_file, print, explain, test.\n"
+    "- Do NOT return shell commands or absolute paths.\n\n"
+)
+_EVAL_PROMPT_HEAD = (
+    "You are an evaluator. Return ONLY JSON:\n"
+    '{"ok": true, "score": 0.9, "notes": "..."}\n\n'
+    "Input:\n"
+)
+_EVAL_PROMPT_TAIL = "Assess whether the plan + results achieved the goal. Give a score 0.0-1.0 and short notes."
+
 
 class Planner:
-    async def generate_plan(
-        self, goal: str, memory: List[Dict[str, Any]], client: AsyncOpenAI, model: str
-    ) -> Tuple[bool, List[Dict[str, Any]], str]:
-        sample = {
-            "plan": [
-                {"action": "write_file", "filename": "sum.py", "content": "def add(a,b):\\n    return a+b\\n\\nprint(add(2,3))"},
-                {"action": "run_file", "filename": "sum.py", "args": []},
-            ]
-        }
-        prompt = (
-            "You are a planning assistant. Output ONLY a single VALID JSON object (no explanations).\n"
-            "Schema:\n"
-            '{ "plan": [ step1, step2, ... ] }\n'
-            "Each step must be an object with:\n"
-            '- action: one of "write_file", "run_file", "read_file", "print", "explain", "test"\n'
-            "- write_file: include filename and content (full file text)\n"
-            "- run_file: include filename and optional args (list)\n"
-            "- read_file: include filename\n"
-            "- print: include text\n"
-            "- explain: include filename\n"
-            "- test: include filename and tests list (optional)\n\n"
-            "Keep steps minimal & deterministic. Use filenames only (no absolute paths).\n"
-            f"Example:\n{json.dumps(sample, indent=2)}\n\n"
-            f"Goal: {goal}\n"
-            f"Recent memory: {json.dumps(memory[-5:], ensure_ascii=False)}"
-        )
-        try:
+    def __init__(self, max_concurrency: int = 4, cache_size: int = 1024, cache_ttl_s: float = 3600.0):
+        # Ограничивает число одновременных запросов к LLM (в том числе из generate_plans_batch)
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        # Ответы на одинаковые промпты (temperature 0.2 - почти детерминированно)
+        self._cache = TTLCache(cache_size, cache_ttl_s)
+
+    async def _complete(self, client: AsyncOpenAI, model: str, prompt: str) -> str:
+        key = prompt_key(model, prompt)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        async with self._sem:
             r = await client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2,
             )
-            raw = r.choices[0].message.content or ""
+        return r.choices[0].message.content or ""
+
+    def _remember(self, model: str, prompt: str, raw: str) -> None:
+        # Кэшируется только разобранный и проверенный ответ - битый или
+        # обрезанный ответ не должен повторяться весь TTL вместо нового запроса
+        self._cache.put(prompt_key(model, prompt), raw)
+
+    async def generate_plans_batch(
+        self, goals: List[str], memory: List[Dict[str, Any]], client: AsyncOpenAI, model: str
+    ) -> List[Tuple[bool, List[Dict[str, Any]], str]]:
+        """generate_plan для нескольких целей параллельно; результаты в порядке goals."""
+        return list(await asyncio.gather(
+            *(self.generate_plan(g, memory, client, model) for g in goals)
+        ))
+
+    async def generate_plan(
+        self, goal: str, memory: List[Dict[str, Any]], client: AsyncOpenAI, model: str
+    ) -> Tuple[bool, List[Dict[str, Any]], str]:
+        prompt = f"{_PLAN_PROMPT_HEAD}Goal: {goal}\nRecent memory: {json_dumps(memory[-5:])}"
+        try:
+            raw = await self._complete(client, model, prompt)
             log.info(f"raw plan response: {raw[:200]}")
-            js = find_balanced_json(raw)
-            if not js:
+            plan_obj = extract_json(raw)
+            if plan_obj is None:
                 return False, [], f"llm did not return json plan. raw: {raw[:200]}"
-            plan_obj = json.loads(js)
             steps = plan_obj.get("plan", [])
             ok, msg = self.validate(steps)
             if not ok:
                 return False, steps, msg
+            self._remember(model, prompt, raw)
             return True, steps, "ok"
         except Exception as e:
             log.error(f"generate_plan error: {e}")
@@ -68,31 +124,20 @@ class Planner:
         model: str,
     ) -> Dict[str, Any]:
         prompt = (
-            "You are a helpful assistant that FIXES a single step when it failed.\n"
-            "Output ONLY a single valid JSON object.\n\n"
-            f"Input:\n"
+            f"{_FIX_PROMPT_HEAD}"
             f"- Goal: {goal}\n"
-            f"- Failed step: {json.dumps(step, ensure_ascii=False)}\n"
+            f"- Failed step: {json_dumps(step)}\n"
             f"- Observed output / error: {observed_output}\n\n"
-            "Rules:\n"
-            '- Return JSON like: { "fixed_step": { ... } } where fixed_step follows the step schema.\n'
-            '- If you cannot fix it, return: { "action": "abort", "reason": "..." }\n'
-            "- Do NOT include any explanation text.\n"
-            "- Allowed actions: write_file (full content), run_file (args), read_file, print, explain, test.\n"
-            "- Do NOT return shell commands or absolute paths.\n\n"
-            f"Recent memory: {json.dumps(memory[-5:], ensure_ascii=False)}"
+            f"{_FIX_PROMPT_RULES}"
+            f"Recent memory: {json_dumps(memory[-5:])}"
         )
         try:
-            r = await client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-            )
-            raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            if not js:
+            raw = await self._complete(client, model, prompt)
+            data = extract_json(raw)
+            if data is None:
                 return {}
-            return json.loads(js)
+            self._remember(model, prompt, raw)
+            return data
         except Exception as e:
             log.error(f"suggest_fix error: {e}")
             return {}
@@ -106,25 +151,19 @@ class Planner:
         model: str,
     ) -> Dict[str, Any]:
         prompt = (
-            "You are an evaluator. Return ONLY JSON:\n"
-            '{"ok": true, "score": 0.9, "notes": "..."}\n\n'
-            f"Input:\n"
+            f"{_EVAL_PROMPT_HEAD}"
             f"- Goal: {goal}\n"
-            f"- Plan: {json.dumps(plan, ensure_ascii=False)}\n"
-            f"- Results: {json.dumps(results, ensure_ascii=False)}\n\n"
-            "Assess whether the plan + results achieved the goal. Give a score 0.0-1.0 and short notes."
+            f"- Plan: {json_dumps(plan)}\n"
+            f"- Results: {json_dumps(results)}\n\n"
+            f"{_EVAL_PROMPT_TAIL}"
         )
         try:
-            r = await client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-            )
-            raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            if not js:
+            raw = await self._complete(client, model, prompt)
+            data = extract_json(raw)
+            if data is None:
                 return {"ok": False, "score": 0.0, "notes": "no_json_from_llm"}
-            return json.loads(js)
+            self._remember(model, prompt, raw)
+            return data
         except Exception as e:
             log.error(f"evaluate error: {e}")
             return {"ok": False, "score": 0.0, "notes": str(e)}
@@ -141,14 +180,10 @@ class Planner:
             action = step.get("action")
             if action not in ALLOWED_ACTIONS:
                 return False, f"action not allowed: {action}"
-            if action == "write_file":
+            if action in _NEEDS_FILENAME:
                 fn = step.get("filename")
-                if not fn or ".." in fn or fn.startswith("/") or "\\" in fn:
+                if not _safe_filename(fn):
                     return False, f"unsafe filename: {fn}"
-                if step.get("content") is None:
+                if action == "write_file" and step.get("content") is None:
                     return False, "write_file missing content"
-            if action in ("run_file", "read_file", "explain", "test"):
-                fn = step.get("filename")
-                if not fn or ".." in fn or fn.startswith("/") or "\\" in fn:
-                    return False, f"unsafe filename: {fn}"
         return True, "ok"
@@ -1,13 +1,17 @@
 import os
 import logging
 from pathlib import Path
+from functools import lru_cache
+from string import Formatter
+from typing import Callable
 
 log = logging.getLogger(__name__)
 
 # Assuming structure: Ergodeon/src/openrouter_agent/agent/prompts.py
 # Target: Ergodeon/promt
-PROMPTS_DIR = Path(__file__).parent.parent.parent.parent / "promt"
+PROMPTS_DIR = Path(__file__).resolve().parents[3] / "promt"
 
+@lru_cache(maxsize=None)
 def _load_prompt(name: str) -> str:
     path = PROMPTS_DIR / f"{name}.md"
     try:
@@ -16,6 +20,36 @@ def _load_prompt(name: str) -> str:
         log.error(f"Prompt file not found: {path}")
         return ""
 
+
+def compile_prompt(template: str) -> Callable[..., str]:
+    """
+    Разбирает шаблон один раз при импорте и возвращает функцию-рендер
+    с тем же контрактом, что и template.format(**kwargs). Шаблоны с
+    format_spec/conversion отдаются в обычный str.format.
+    """
+    parts = list(Formatter().parse(template))
+    for _, field, spec, conv in parts:
+        if field is not None and (spec or conv or not field.isidentifier()):
+            return template.format
+    parts = [(lit, field) for lit, field, _, _ in parts]
+
+    def render(**kwargs) -> str:
+        out = []
+        for lit, field in parts:
+            out.append(lit)
+            if field is not None:
+                value = kwargs[field]
+                out.append(value if isinstance(value, str) else format(value))
+        return "".join(out)
+
+    return render
+
+
+@lru_cache(maxsize=None)
+def prompt_fn(name: str) -> Callable[..., str]:
+    """Скомпилированный рендер для promt/<name>.md; файл читается один раз на процесс."""
+    return compile_prompt(_load_prompt(name))
+
 PROMPT_PARSE_REQUEST = _load_prompt('prompt_parse_request')
 PROMPT_PROJECT_DIGEST = _load_prompt('prompt_project_digest')
 PROMPT_CHECKLIST = _load_prompt('prompt_checklist')
@@ -23,3 +57,11 @@ PROMPT_WALKTHROUGH = _load_prompt('prompt_walkthrough')
 PROMPT_IMPLEMENTATION_PLAN = _load_prompt('prompt_implementation_plan')
 PROMPT_REVIEW_COMMENTS = _load_prompt('prompt_review_comments')
 PROMPT_EXECUTE_STEP = _load_prompt('prompt_execute_step')
+
+PROMPT_PARSE_REQUEST_FN = compile_prompt(PROMPT_PARSE_REQUEST)
+PROMPT_PROJECT_DIGEST_FN = compile_prompt(PROMPT_PROJECT_DIGEST)
+PROMPT_CHECKLIST_FN = compile_prompt(PROMPT_CHECKLIST)
+PROMPT_WALKTHROUGH_FN = compile_prompt(PROMPT_WALKTHROUGH)
+PROMPT_IMPLEMENTATION_PLAN_FN = compile_prompt(PROMPT_IMPLEMENTATION_PLAN)
+PROMPT_REVIEW_COMMENTS_FN = compile_prompt(PROMPT_REVIEW_COMMENTS)
+PROMPT_EXECUTE_STEP_FN = compile_prompt(PROMPT_EXECUTE_STEP)
@@ -1,5 +1,8 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 from typing import Dict, List, Tuple
 from openrouter_agent.agent.config import PipelineConfig
 
@@ -16,38 +19,77 @@ FILE_CATEGORIES = {
     "test": ["test_", "_test.", ".test.", ".spec.", "tests/"],
 }
 
+CATEGORY_SCORES = {"config": 90, "entry_point": 80, "routing": 70, "model": 60, "test": 20}
+
+_CATEGORY_PATTERNS = tuple((cat, tuple(patterns)) for cat, patterns in FILE_CATEGORIES.items())
+_PATH_WORDS_TABLE = str.maketrans("/_.", "   ")
+
+
+@lru_cache(maxsize=65536)
+def _classify_path(path: str) -> str:
+    # name == p влечёт p in path (имя - хвост пути), поэтому хватает подстроки
+    for cat, patterns in _CATEGORY_PATTERNS:
+        for p in patterns:
+            if p in path:
+                return cat
+    return "other"
+
+
+@lru_cache(maxsize=65536)
+def _path_words(path: str) -> frozenset:
+    return frozenset(path.lower().translate(_PATH_WORDS_TABLE).split())
+
 
 class ProjectScanner:
     def __init__(self, config: PipelineConfig = None):
         self.config = config or PipelineConfig()
 
     def scan(self, project_dir: str) -> List[Dict]:
-        files = []
-        for root, dirs, filenames in os.walk(project_dir):
-            dirs[:] = [d for d in dirs if d not in self.config.ignored_directories
-                       and not d.endswith(".egg-info")]
-            for f in filenames:
-                ext = os.path.splitext(f)[1].lower()
-                if ext in self.config.ignored_extensions:
-                    continue
-                full = os.path.join(root, f)
-                rel = os.path.relpath(full, project_dir)
-                try:
-                    size = os.path.getsize(full)
-                except OSError:
-                    size = 0
-                files.append({"path": rel, "full_path": full, "size": size, "ext": ext, "name": f})
+        files: List[Dict] = []
+        self._scan_dir(project_dir, "", files,
+                       frozenset(self.config.ignored_directories),
+                       frozenset(self.config.ignored_extensions))
         log.info(f"scanned {len(files)} files in {project_dir}")
         return files
 
+    def _scan_dir(self, path: str, rel: str, files: List[Dict],
+                  ignored_dirs: frozenset, ignored_exts: frozenset) -> None:
+        """Обход в порядке os.walk: сначала файлы каталога, затем подкаталоги."""
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # как os.walk(followlinks=False): симлинки на каталоги не обходим
+                if (name not in ignored_dirs and not name.endswith(".egg-info")
+                        and not entry.is_symlink()):
+                    subdirs.append(entry)
+                continue
+            ext = os.path.splitext(name)[1].lower()
+            if ext in ignored_exts:
+                continue
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                size = 0
+            path = rel + name
+            files.append({"path": path, "full_path": entry.path, "size": size, "ext": ext, "name": name,
+                          "category": _classify_path(path.lower())})
+        for entry in subdirs:
+            self._scan_dir(entry.path, rel + entry.name + os.sep, files, ignored_dirs, ignored_exts)
+
     def classify_file(self, file_info: Dict) -> str:
-        name = file_info["name"].lower()
-        path = file_info["path"].lower()
-        for cat, patterns in FILE_CATEGORIES.items():
-            for p in patterns:
-                if name == p or p in path:
-                    return cat
-        return "other"
+        # scan() кладёт категорию в словарь файла; вычисляем только для чужих словарей
+        cat = file_info.get("category")
+        return cat if cat is not None else _classify_path(file_info["path"].lower())
 
     def prioritize(self, files: List[Dict], parsed_request: str = "") -> List[Dict]:
         priority_names = {p.lower() for p in self.config.priority_files}
@@ -57,38 +99,57 @@ class ProjectScanner:
             s = 0
             if f["name"].lower() in priority_names:
                 s += 100
-            cat = self.classify_file(f)
-            cat_scores = {"config": 90, "entry_point": 80, "routing": 70, "model": 60, "test": 20}
-            s += cat_scores.get(cat, 10)
+            s += CATEGORY_SCORES.get(self.classify_file(f), 10)
             if req_words:
-                path_words = set(f["path"].lower().replace("/", " ").replace("_", " ").replace(".", " ").split())
-                overlap = len(req_words & path_words)
-                s += overlap * 15
+                s += len(req_words & _path_words(f["path"])) * 15
             return s
 
         return sorted(files, key=score, reverse=True)
 
     def read_files(self, files: List[Dict], max_count: int = None) -> Dict[str, str]:
         limit = max_count or self.config.max_files_to_read
+        batch = files[:limit]
         contents = {}
-        for f in files[:limit]:
-            try:
-                if f["size"] > self.config.max_file_size_bytes:
-                    with open(f["full_path"], "r", encoding="utf-8", errors="replace") as fh:
-                        text = fh.read(self.config.max_file_size_bytes)
-                    contents[f["path"]] = text + "\n... (truncated)"
-                else:
-                    with open(f["full_path"], "r", encoding="utf-8", errors="replace") as fh:
-                        contents[f["path"]] = fh.read()
-            except Exception as e:
-                log.warning(f"cannot read {f['path']}: {e}")
-                contents[f["path"]] = f"[error reading file: {e}]"
+        # Чтение упирается в диск - GIL на время read отпускается, порядок ключей сохраняет map
+        with ThreadPoolExecutor(max_workers=min(16, len(batch) or 1)) as ex:
+            for f, text in zip(batch, ex.map(self._read_one, batch)):
+                contents[f["path"]] = text
         log.info(f"read {len(contents)} files")
         return contents
 
+    @staticmethod
+    def format_contents(contents: Dict[str, str]) -> str:
+        """
+        Склеивает прочитанные файлы в блок "--- path ---" для промпта.
+        Один join по плоскому списку кусков: содержимое файла копируется
+        один раз, без промежуточной f-строки на каждый файл.
+        """
+        parts = []
+        extend = parts.extend
+        for path, text in contents.items():
+            extend(("\n\n--- ", path, " ---\n", text))
+        if parts:
+            parts[0] = "--- "
+        return "".join(parts)
+
+    def _read_one(self, f: Dict) -> str:
+        max_size = self.config.max_file_size_bytes
+        truncated = f["size"] > max_size
+        try:
+            # Текстовый режим: read() дочитывает до EOF/лимита (короткие чтения на
+            # pipe/NFS/FUSE не обрезают файл) и переводит \r\n и \r в \n
+            with open(f["full_path"], "r", encoding="utf-8", errors="replace") as fh:
+                text = fh.read(max_size) if truncated else fh.read()
+        except Exception as e:
+            log.warning(f"cannot read {f['path']}: {e}")
+            return f"[error reading file: {e}]"
+        if truncated:
+            return text + "\n... (truncated)"
+        return text
+
     def get_file_tree(self, files: List[Dict]) -> str:
-        lines = []
-        for f in sorted(files, key=lambda x: x["path"]):
-            cat = self.classify_file(f)
-            lines.append(f"{f['path']} [{cat}] ({f['size']}b)")
-        return "\n".join(lines)
+        classify = self.classify_file
+        return "\n".join(
+            f"{f['path']} [{classify(f)}] ({f['size']}b)"
+            for f in sorted(files, key=itemgetter("path"))
+        )
@@ -3,32 +3,121 @@ StageManager - управление стейджами в папке flow/ пр
 
 Каждый запрос пользователя (кроме chat) создаёт новый stage-N/.
 Внутри хранятся meta.yaml, plan.yaml, execution_log.yaml и artifacts/.
+Горячее машинное состояние (meta, шапка лога во время выполнения) пишется в
+msgpack; YAML-копия meta обновляется, когда стейдж выходит из running.
 """
 
 import os
 import logging
+from collections import Counter
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, List
-from openrouter_agent.utils import save_yaml, load_yaml
+from typing import Dict, Any, Optional, List, Tuple
+from openrouter_agent.utils import (
+    save_yaml, load_yaml, load_yaml_cached, dump_yaml, atomic_write_lines,
+    atomic_write_text, append_yaml_stream, load_yaml_stream, write_if_changed,
+    save_msgpack, load_msgpack,
+)
 
 log = logging.getLogger(__name__)
 
 FLOW_DIR = "flow"
+LATEST_FILE = ".latest"
+
+_MARKER = {"completed": "x"}
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
+def _steps_stream_path(yaml_path: str) -> str:
+    return yaml_path[:-len(".yaml")] + ".steps.yaml"
+
+
+def _header_path(yaml_path: str) -> str:
+    return yaml_path[:-len(".yaml")] + ".msgpack"
+
+
+def empty_log_stats() -> Dict[str, int]:
+    return {"completed": 0, "failed": 0, "blocked": 0, "skipped": 0}
+
+
+def write_execution_log(yaml_path: str, entries: List[Dict], meta: Dict[str, Any],
+                        persisted: int, stats: Dict[str, int] = None) -> Tuple[Dict[str, int], int]:
+    """
+    Сохраняет лог выполнения. Пока meta.status == "running", шаги дописываются
+    в execution_log.steps.yaml (только новые, начиная с persisted), а meta и
+    stats лежат в execution_log.msgpack. Финальное сохранение сворачивает всё
+    в один YAML-документ и удаляет msgpack и поток. stats можно передать уже посчитанными
+    (рендер markdown считает их в том же проходе). Возвращает (stats, persisted).
+    """
+    if stats is None:
+        counts = Counter(e.get("status", "unknown") for e in entries)
+        stats = {k: counts[k] for k in empty_log_stats()}
+
+    stream_path = _steps_stream_path(yaml_path)
+    if meta.get("status") == "running":
+        if persisted <= 0 or persisted > len(entries):
+            # Состояние потока неизвестно (новый процесс/resume) - пишем заново
+            if os.path.exists(stream_path):
+                os.remove(stream_path)
+            persisted = 0
+        append_yaml_stream(stream_path, entries[persisted:])
+        save_msgpack(_header_path(yaml_path), {"meta": meta, "stats": stats})
+        return stats, len(entries)
+
+    save_yaml(yaml_path, {"meta": meta, "stats": stats, "steps": entries})
+    # msgpack удаляется раньше потока: при сбое читатель не увидит шапку без шагов
+    for path in (_header_path(yaml_path), stream_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return stats, 0
+
+
+def read_execution_log(yaml_path: str) -> Optional[Dict[str, Any]]:
+    # Шапка в msgpack есть только у незавершённого лога - она новее YAML
+    data = load_msgpack(_header_path(yaml_path))
+    if data is None:
+        data = load_yaml_cached(yaml_path)
+    if data is not None and "steps" not in data:
+        data["steps"] = load_yaml_stream(_steps_stream_path(yaml_path))
+    return data
+
+
 class StageManager:
     def __init__(self, project_dir: str):
         self.project_dir = os.path.abspath(project_dir)
         self.flow_dir = os.path.join(self.project_dir, FLOW_DIR)
+        self._latest_num: Optional[int] = None
 
     def _stage_dir(self, stage_num: int) -> str:
         return os.path.join(self.flow_dir, f"stage-{stage_num}")
 
     def get_latest_stage_num(self) -> int:
+        """
+        Номер последнего стейджа. Берётся из кэша экземпляра или flow/.latest и
+        сверяется с диском за пару stat: stage-N на месте, stage-(N+1) ещё нет
+        (его мог создать другой процесс). Полный листинг flow/ - только если
+        указатель отсутствует или не сходится.
+        """
+        num = self._latest_num
+        if num is None:
+            num = self._read_latest_file()
+        if num is None or (num > 0 and not os.path.isdir(self._stage_dir(num))):
+            num = self._scan_latest_stage_num()
+        while os.path.isdir(self._stage_dir(num + 1)):
+            num += 1
+        self._latest_num = num
+        return num
+
+    def _read_latest_file(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.flow_dir, LATEST_FILE), "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _scan_latest_stage_num(self) -> int:
         if not os.path.isdir(self.flow_dir):
             return 0
         nums = []
@@ -45,6 +134,8 @@ class StageManager:
         stage_dir = self._stage_dir(num)
         os.makedirs(stage_dir, exist_ok=True)
         os.makedirs(os.path.join(stage_dir, "artifacts"), exist_ok=True)
+        self._latest_num = num
+        atomic_write_text(os.path.join(self.flow_dir, LATEST_FILE), f"{num}\n")
 
         meta = {
             "stage": num,
@@ -55,16 +146,20 @@ class StageManager:
             "finished_at": None,
             "previous_stages_read": [],
         }
-        save_yaml(os.path.join(stage_dir, "meta.yaml"), meta)
+        stage = Stage(stage_dir, meta)
+        stage._save_meta()
         log.info(f"created stage-{num} [{workflow}]")
-        return Stage(stage_dir, meta)
+        return stage
 
     def load_stage(self, stage_num: int) -> Optional["Stage"]:
         stage_dir = self._stage_dir(stage_num)
-        meta_path = os.path.join(stage_dir, "meta.yaml")
-        if not os.path.exists(meta_path):
-            return None
-        meta = load_yaml(meta_path) or {}
+        meta = load_msgpack(os.path.join(stage_dir, "meta.msgpack"))
+        if meta is None:
+            # Стейджи, созданные до msgpack, хранят только meta.yaml
+            meta_path = os.path.join(stage_dir, "meta.yaml")
+            if not os.path.exists(meta_path):
+                return None
+            meta = load_yaml(meta_path) or {}
         return Stage(stage_dir, meta)
 
     def load_latest_stage(self) -> Optional["Stage"]:
@@ -98,6 +193,7 @@ class Stage:
         self.stage_dir = stage_dir
         self.meta = meta
         self.artifacts_dir = os.path.join(stage_dir, "artifacts")
+        self._log_persisted = 0
 
     @property
     def num(self) -> int:
@@ -118,46 +214,51 @@ class Stage:
         self._save_meta()
 
     def _save_meta(self):
-        save_yaml(os.path.join(self.stage_dir, "meta.yaml"), self.meta)
+        save_msgpack(os.path.join(self.stage_dir, "meta.msgpack"), self.meta)
+        if self.meta.get("status") != "running":
+            save_yaml(os.path.join(self.stage_dir, "meta.yaml"), self.meta)
 
     def save_plan(self, plan: Dict[str, Any]):
-        save_yaml(os.path.join(self.stage_dir, "plan.yaml"), plan)
-        self._save_plan_md(plan)
+        changed = write_if_changed(os.path.join(self.stage_dir, "plan.yaml"), dump_yaml(plan))
+        if changed or not os.path.exists(os.path.join(self.stage_dir, "plan.md")):
+            self._save_plan_md(plan)
 
     def load_plan(self) -> Optional[Dict[str, Any]]:
-        return load_yaml(os.path.join(self.stage_dir, "plan.yaml"))
+        return load_yaml_cached(os.path.join(self.stage_dir, "plan.yaml"))
 
     def save_artifact(self, name: str, data: Any):
         path = os.path.join(self.artifacts_dir, name)
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        if isinstance(data, str):
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(data)
-        else:
-            save_yaml(path, data)
+        # Артефакты пересохраняются при ревью/resume - неизменённые не трогаем
+        write_if_changed(path, data if isinstance(data, str) else dump_yaml(data))
 
     def load_artifact(self, name: str) -> Any:
         path = os.path.join(self.artifacts_dir, name)
         if not os.path.exists(path):
             return None
         if name.endswith((".yaml", ".yml")):
-            return load_yaml(path)
+            return load_yaml_cached(path)
         with open(path, "r", encoding="utf-8") as f:
             return f.read()
 
     def save_execution_log(self, entries: List[Dict], log_meta: Dict[str, Any] = None):
-        stats = {"completed": 0, "failed": 0, "blocked": 0, "skipped": 0}
-        for e in entries:
-            s = e.get("status", "unknown")
-            if s in stats:
-                stats[s] += 1
-
-        data = {"meta": log_meta or {}, "stats": stats, "steps": entries}
-        save_yaml(os.path.join(self.stage_dir, "execution_log.yaml"), data)
-        self._save_execution_log_md(entries, stats)
+        """
+        Пока лог в статусе running, на диск дописываются только новые шаги
+        (см. write_execution_log); execution_log.md целиком перерисовывается
+        лишь при финальном сохранении, а не после каждого шага.
+        """
+        log_meta = log_meta or {}
+        stats = None
+        if log_meta.get("status") != "running":
+            stats = empty_log_stats()
+            self._save_execution_log_md(entries, stats)  # заполняет stats за тот же проход
+        _, self._log_persisted = write_execution_log(
+            os.path.join(self.stage_dir, "execution_log.yaml"),
+            entries, log_meta, self._log_persisted, stats,
+        )
 
     def load_execution_log(self) -> Optional[Dict[str, Any]]:
-        return load_yaml(os.path.join(self.stage_dir, "execution_log.yaml"))
+        return read_execution_log(os.path.join(self.stage_dir, "execution_log.yaml"))
 
     def mark_previous_read(self, stage_nums: List[int]):
         self.meta.setdefault("previous_stages_read", [])
@@ -167,35 +268,39 @@ class Stage:
         self._save_meta()
 
     def _save_plan_md(self, plan: Dict[str, Any]):
-        lines = [f"# План выполнения [{self.workflow}]\n"]
-        for phase in plan.get("phases", []):
-            lines.append(f"\n## {phase.get('name', '')}")
-            lines.append(f"Статус: {phase.get('status', 'pending')}\n")
-            for step in phase.get("steps", []):
-                marker = "x" if step.get("status") == "completed" else " "
-                lines.append(f"- [{marker}] {step.get('id', '')}: {step.get('description', '')}")
-                deps = step.get("depends_on", [])
-                if deps:
-                    lines.append(f"  Зависит от: {', '.join(deps)}")
-        path = os.path.join(self.stage_dir, "plan.md")
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("\n".join(lines))
-
-    def _save_execution_log_md(self, entries: List[Dict], stats: Dict):
-        lines = ["# Лог выполнения\n"]
-        for entry in entries:
-            status = entry.get("status", "unknown")
-            step = entry.get("step_number", entry.get("id", "?"))
-            desc = entry.get("description", "")
-            elapsed = entry.get("elapsed", 0)
-            error = entry.get("error", "")
-            marker = "x" if status == "completed" else " "
-            lines.append(f"- [{marker}] Шаг {step}: {desc} [{status}] ({elapsed:.1f}s)")
-            if error:
-                lines.append(f"  Ошибка: {error}")
-        lines.append("\n## Статистика\n")
-        for k, v in stats.items():
-            lines.append(f"- {k}: {v}")
-        path = os.path.join(self.stage_dir, "execution_log.md")
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("\n".join(lines))
+        def lines():
+            yield f"# План выполнения [{self.workflow}]\n"
+            for phase in plan.get("phases", []):
+                yield f"\n## {phase.get('name', '')}"
+                yield f"Статус: {phase.get('status', 'pending')}\n"
+                for step in phase.get("steps", []):
+                    g = step.get
+                    marker = _MARKER.get(g("status"), " ")
+                    yield f"- [{marker}] {g('id', '')}: {g('description', '')}"
+                    deps = g("depends_on", ())
+                    if deps:
+                        yield f"  Зависит от: {', '.join(deps)}"
+
+        atomic_write_lines(os.path.join(self.stage_dir, "plan.md"), lines())
+
+    def _save_execution_log_md(self, entries: List[Dict], stats: Dict[str, int]):
+        """Рендерит лог и по ходу считает stats (передаётся обнулённым)."""
+        def lines():
+            yield "# Лог выполнения\n"
+            for entry in entries:
+                g = entry.get
+                status = g("status", "unknown")
+                if status in stats:
+                    stats[status] += 1
+                step = g("step_number", g("id", "?"))
+                elapsed = g("elapsed", 0)
+                error = g("error", "")
+                marker = _MARKER.get(status, " ")
+                yield f"- [{marker}] Шаг {step}: {g('description', '')} [{status}] ({elapsed:.1f}s)"
+                if error:
+                    yield f"  Ошибка: {error}"
+            yield "\n## Статистика\n"
+            for k, v in stats.items():
+                yield f"- {k}: {v}"
+
+        atomic_write_lines(os.path.join(self.stage_dir, "execution_log.md"), lines())
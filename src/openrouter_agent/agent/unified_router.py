@@ -9,39 +9,48 @@ UnifiedRouter - единая точка входа для обработки з
 import os
 import json
 import time
+import asyncio
 import logging
-from typing import Dict, Any, Optional, Callable, Awaitable, List
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Dict, Any, Optional, Callable, Awaitable, List, Tuple
 from openai import AsyncOpenAI
 from openrouter_agent.agent.stage_manager import StageManager, Stage
 from openrouter_agent.agent.context_manager import ContextManager
 from openrouter_agent.agent.workflow_registry import WorkflowRegistry, WorkflowDef
 from openrouter_agent.agent.workflow_classifier import WorkflowClassifier, ClassificationResult
 from openrouter_agent.agent.scanner import ProjectScanner
-from openrouter_agent.agent.doc_generator import DocumentGenerator
+from openrouter_agent.agent.doc_generator import DocumentGenerator, RETRYABLE_ERRORS
 from openrouter_agent.agent.config import PipelineConfig
 from openrouter_agent.agent.memory import EpisodeMemory
 from openrouter_agent.tools.registry import ToolRegistry
 from openrouter_agent.agent.prompts import (
     PROMPT_PARSE_REQUEST, PROMPT_PROJECT_DIGEST, PROMPT_CHECKLIST,
     PROMPT_WALKTHROUGH, PROMPT_IMPLEMENTATION_PLAN, PROMPT_REVIEW_COMMENTS,
-    PROMPT_EXECUTE_STEP,
+    PROMPT_EXECUTE_STEP, PROMPT_EXECUTE_STEP_FN, prompt_fn,
 )
-from openrouter_agent.utils import find_balanced_json, load_yaml
+from openrouter_agent.utils import extract_json, load_yaml, json_dumps, json_loads
 from pathlib import Path
 from datetime import datetime, timezone
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
 
 log = logging.getLogger(__name__)
 
-DANGEROUS_TOOLS = {
+DANGEROUS_TOOLS = frozenset({
     "write_file", "delete_file", "edit_file", "edit_file_by_lines",
     "move_file", "execute_command", "multi_edit_file",
-}
-PATH_ARGS = {"path", "directory", "source", "destination", "cwd"}
+})
+PATH_ARGS = frozenset({"path", "directory", "source", "destination", "cwd"})
+# Только читают - соседние вызовы таких инструментов в одном ответе идут параллельно
+READ_ONLY_TOOLS = frozenset({
+    "read_file", "list_directory", "get_file_info", "search_files",
+    "get_current_directory", "web_fetch", "analyze_code",
+})
 
-PROMPTS_DIR = Path(__file__).parent.parent.parent.parent / "promt"
+PROMPTS_DIR = Path(__file__).resolve().parents[3] / "promt"
 
 
+@lru_cache(maxsize=None)
 def _load_prompt(name: str) -> str:
     path = PROMPTS_DIR / f"{name}.md"
     try:
@@ -55,8 +64,14 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
+@lru_cache(maxsize=8)
+def _project_root(project_dir: str) -> Path:
+    return Path(project_dir).resolve()
+
+
 def _resolve_and_guard(raw_path: str, project_dir: str) -> str:
-    project_root = Path(project_dir).resolve()
+    project_root = _project_root(project_dir)
+    # Путь внутри проекта резолвится полностью: симлинк может вести наружу
     resolved = (project_root / raw_path).resolve() if not os.path.isabs(raw_path) else Path(raw_path).resolve()
     try:
         resolved.relative_to(project_root)
@@ -65,6 +80,30 @@ def _resolve_and_guard(raw_path: str, project_dir: str) -> str:
     return str(resolved)
 
 
+def _step_key(step: Dict) -> str:
+    """Идентификатор шага плана, под которым он попадает в лог выполнения."""
+    return str(step.get("checklist_id", step.get("id", "")))
+
+
+def _step_levels(steps: List[Dict]) -> List[List[Dict]]:
+    """
+    Группирует шаги плана по уровням зависимостей: шаг попадает на уровень
+    после самой поздней из зависимостей, стоящих в плане раньше него (как и
+    при последовательном выполнении, ссылки вперёд не учитываются). Внутри
+    уровня сохраняется порядок плана.
+    """
+    level_of: Dict[str, int] = {}
+    levels: List[List[Dict]] = []
+    for step in steps:
+        deps = (str(d) for d in step.get("depends_on", []))
+        level = max((level_of[d] + 1 for d in deps if d in level_of), default=0)
+        level_of.setdefault(_step_key(step), level)
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(step)
+    return levels
+
+
 class RequestResult:
     def __init__(self, workflow: str, status: str, message: str = "",
                  stage_num: int = 0, data: Dict[str, Any] = None):
@@ -103,15 +142,18 @@ class UnifiedRouter:
         memory_path: str = "memory/episodes.json",
         progress: ProgressCallback = None,
     ):
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
+        self.client = DocumentGenerator.make_client(api_key)
         self.model = model
         self.api_key = api_key
         self.tools_registry = ToolRegistry()
         self.history: List[ChatCompletionMessageParam] = []
+        # Режимные system-промпты (chat_mode, research_mode) не вытесняются окном
+        # history и всегда идут в начале запроса; по одному на режим, номер в списке
+        self.system_messages: List[ChatCompletionMessageParam] = []
+        self._mode_prompt_idx: Dict[str, int] = {}
+        self._mode_prompt_project: Optional[str] = None  # проект, для которого они собраны
         self.confirmation_callback = confirmation_callback
+        self._confirm_lock = asyncio.Lock()
         self.config = pipeline_config or PipelineConfig()
         self.memory = EpisodeMemory(memory_path)
         self.scanner = ProjectScanner(self.config)
@@ -121,6 +163,9 @@ class UnifiedRouter:
         self.progress = progress or ProgressCallback()
 
         self.active_project_dir: Optional[str] = None
+        # project_dir -> менеджеры проекта; оба сверяются с диском сами
+        # (указатель .latest, кэш context.yaml по stat), поэтому TTL не нужен
+        self._project_mgrs: Dict[str, Tuple[StageManager, ContextManager]] = {}
 
         system_base = _load_prompt("system_base")
         self.system_prompt = (
@@ -128,6 +173,7 @@ class UnifiedRouter:
             "You can read and write files, execute commands, and more.\n\n"
             f"{system_base}"
         )
+        self._system_message = self._build_system_message()
         log.info(f"unified router initialized, model={model}")
 
     async def handle_request(self, text: str) -> RequestResult:
@@ -141,6 +187,8 @@ class UnifiedRouter:
         if heuristic and heuristic.workflow == "reset":
             self.active_project_dir = None
             self.history.clear()
+            self.system_messages.clear()
+            self._mode_prompt_idx.clear()
             return RequestResult("reset", "completed", "Контекст сброшен")
 
         if heuristic and heuristic.workflow == "resume":
@@ -157,7 +205,7 @@ class UnifiedRouter:
         # 2. Загрузить контекст
         project_context = ""
         if self.active_project_dir:
-            ctx_mgr = ContextManager(self.active_project_dir)
+            _, ctx_mgr = self._managers(self.active_project_dir)
             project_context = ctx_mgr.get_for_llm()
 
         # 3. Классификация через LLM
@@ -187,13 +235,77 @@ class UnifiedRouter:
         # 6. Создать стейдж и выполнить
         return await self._execute_workflow(classification.workflow, text)
 
+    def _build_system_message(self) -> ChatCompletionMessageParam:
+        """
+        System-промпт одинаков во всех запросах сессии. С config.prompt_cache он
+        помечается cache_control: провайдеры с явным кэшем (Anthropic, Gemini через
+        OpenRouter) переиспользуют префикс tools + system вместо повторной обработки.
+        OpenAI кэширует префиксы сам, метка им не мешает.
+        """
+        if not self.config.prompt_cache:
+            return {"role": "system", "content": self.system_prompt}
+        return {"role": "system", "content": [{
+            "type": "text", "text": self.system_prompt,
+            "cache_control": {"type": "ephemeral"},
+        }]}
+
+    def _managers(self, project_dir: str) -> Tuple[StageManager, ContextManager]:
+        mgrs = self._project_mgrs.get(project_dir)
+        if mgrs is None:
+            mgrs = (StageManager(project_dir), ContextManager(project_dir))
+            self._project_mgrs[project_dir] = mgrs
+        return mgrs
+
+    def _set_mode_prompt(self, mode: str, prompt: str):
+        """
+        Режимный system-промпт: один на режим. Промпт того же режима для
+        другого проекта заменяет прежний, а не копится рядом с ним.
+        """
+        if not prompt:
+            return
+        self._drop_stale_mode_prompts()
+        i = self._mode_prompt_idx.get(mode)
+        if i is None:
+            self._mode_prompt_idx[mode] = len(self.system_messages)
+            self.system_messages.append({"role": "system", "content": prompt})
+        elif self.system_messages[i]["content"] != prompt:
+            self.system_messages[i] = {"role": "system", "content": prompt}
+
+    def _drop_stale_mode_prompts(self):
+        """Сменился активный проект - режимные промпты прежнего проекта больше не нужны."""
+        if self._mode_prompt_project != self.active_project_dir:
+            self.system_messages.clear()
+            self._mode_prompt_idx.clear()
+            self._mode_prompt_project = self.active_project_dir
+
+    def _window_start(self, history: List[ChatCompletionMessageParam]) -> int:
+        """
+        Индекс, с которого history попадает в запрос: последние
+        config.history_window сообщений. Если граница режет группу ответов
+        инструментов, окно расширяется назад до их assistant.tool_calls -
+        API не принимает tool-сообщения без него. Последний user-запрос
+        (и system-инструкция прямо перед ним) всегда остаётся в окне - иначе
+        длинный цикл инструментов вытесняет саму задачу.
+        """
+        window = self.config.history_window
+        if window <= 0 or len(history) <= window:
+            return 0
+        start = len(history) - window
+        while start > 0 and history[start].get("role") == "tool":
+            start -= 1
+        last_user = len(history) - 1
+        while last_user >= 0 and history[last_user].get("role") != "user":
+            last_user -= 1
+        if 0 <= last_user < start:
+            start = last_user
+            if start > 0 and history[start - 1].get("role") == "system":
+                start -= 1
+        return start
+
     async def _handle_chat(self, text: str) -> RequestResult:
         if self.active_project_dir:
-            mode_prompt = _load_prompt("chat_mode")
-            if mode_prompt:
-                mode_prompt = mode_prompt.format(active_project_dir=self.active_project_dir)
-                if not any(mode_prompt in str(m.get("content", "")) for m in self.history[-3:]):
-                    self.history.append({"role": "system", "content": mode_prompt})
+            mode_prompt = prompt_fn("chat_mode")(active_project_dir=self.active_project_dir)
+            self._set_mode_prompt("chat_mode", mode_prompt)
 
         self.history.append({"role": "user", "content": text})
         response = await self._step(project_dir=self.active_project_dir)
@@ -210,8 +322,8 @@ class UnifiedRouter:
             return RequestResult("resume", "failed", "Укажите путь к проекту")
 
         self.active_project_dir = path
-        stage_mgr = StageManager(path)
-        stage = stage_mgr.find_resumable_stage()
+        stage_mgr, _ = self._managers(path)
+        stage = await asyncio.to_thread(stage_mgr.find_resumable_stage)
         if not stage:
             return RequestResult("resume", "failed", "Нет прерванных стейджей для продолжения")
 
@@ -222,8 +334,7 @@ class UnifiedRouter:
         if not wf_def:
             return RequestResult(workflow_name, "failed", f"Воркфлоу {workflow_name} не найден")
 
-        stage_mgr = StageManager(self.active_project_dir)
-        ctx_mgr = ContextManager(self.active_project_dir)
+        stage_mgr, ctx_mgr = self._managers(self.active_project_dir)
 
         # Читаем контекст предыдущих стейджей
         prev_context = ctx_mgr.get_for_llm()
@@ -273,14 +384,53 @@ class UnifiedRouter:
                           query: str, prev_context: str) -> Dict[str, Any]:
         result = {"status": "completed", "phases": {}}
         project_dir = self.active_project_dir
+        scan_data = {"file_tree": "", "file_contents": ""}
+
+        # Сканирование не зависит от LLM-фаз: запускаем его в потоке сразу,
+        # чтобы диск читался параллельно с parse_request
+        scan_task = None
+        scan_phase = next((p.name for p in wf_def.phases
+                           if p.name in ("scan_project", "scan_affected")), None)
+        if scan_phase == "scan_project" and project_dir and os.path.isdir(project_dir):
+            scan_task = asyncio.create_task(
+                asyncio.to_thread(self._collect_scan, project_dir, query, False))
+        elif scan_phase == "scan_affected" and project_dir:
+            scan_task = asyncio.create_task(
+                asyncio.to_thread(self._collect_scan, project_dir, query, True))
+
+        try:
+            return await self._run_phase_loop(
+                wf_def, stage, query, prev_context, result, scan_data, scan_task,
+            )
+        finally:
+            if scan_task and not scan_task.done():
+                scan_task.cancel()
+
+    def _collect_scan(self, project_dir: str, query: str, affected: bool) -> Dict[str, Any]:
+        files = self.scanner.scan(project_dir)
+        prioritized = self.scanner.prioritize(files, query)
+        if affected:
+            prioritized = prioritized[:20]
+        return {
+            "files": files,
+            "prioritized": prioritized,
+            "file_tree": self.scanner.get_file_tree(prioritized if affected else files),
+            "file_contents": self.scanner.format_contents(self.scanner.read_files(prioritized)),
+        }
 
-        # Общие данные которые накапливаются между фазами
+    async def _run_phase_loop(self, wf_def: WorkflowDef, stage: Stage, query: str,
+                              prev_context: str, result: Dict[str, Any],
+                              scan_data: Dict[str, str], scan_task) -> Dict[str, Any]:
+        project_dir = self.active_project_dir
+
+        # Общие данные которые накапливаются между фазами. JSON-строки для
+        # промптов сериализуются один раз - сразу после получения документа
         parsed_request = {}
         digest = {}
         checklist = {}
         walkthrough = {}
         plan = {}
-        scan_data = {"file_tree": "", "file_contents": ""}
+        parsed_str = digest_str = checklist_str = walkthrough_str = "{}"
 
         for phase_def in wf_def.phases:
             phase_name = phase_def.name
@@ -294,6 +444,7 @@ class UnifiedRouter:
                 parsed_request = await self.doc_generator.parse_request(
                     goal_with_ctx, "", self.client, self.model
                 )
+                parsed_str = json_dumps(parsed_request)
                 stage.save_artifact("parsed_request.yaml", parsed_request)
                 if parsed_request.get("clarification_needed"):
                     result["status"] = "needs_clarification"
@@ -301,63 +452,47 @@ class UnifiedRouter:
                     return result
 
             elif phase_name == "scan_project":
-                if project_dir and os.path.isdir(project_dir):
-                    files = self.scanner.scan(project_dir)
-                    prioritized = self.scanner.prioritize(files, query)
-                    scan_data["file_tree"] = self.scanner.get_file_tree(files)
-                    scan_data["file_contents"] = "\n\n".join(
-                        f"--- {k} ---\n{v}"
-                        for k, v in self.scanner.read_files(prioritized).items()
-                    )
+                if scan_task:
+                    scanned = await scan_task
+                    scan_data["file_tree"] = scanned["file_tree"]
+                    scan_data["file_contents"] = scanned["file_contents"]
                     stage.save_artifact("scan_results.yaml", {
-                        "files_count": len(files),
+                        "files_count": len(scanned["files"]),
                         "file_tree": scan_data["file_tree"],
                     })
 
             elif phase_name == "scan_affected":
-                if project_dir:
-                    files = self.scanner.scan(project_dir)
-                    prioritized = self.scanner.prioritize(files, query)[:20]
-                    scan_data["file_tree"] = self.scanner.get_file_tree(prioritized)
-                    scan_data["file_contents"] = "\n\n".join(
-                        f"--- {k} ---\n{v}"
-                        for k, v in self.scanner.read_files(prioritized).items()
-                    )
+                if scan_task:
+                    scanned = await scan_task
+                    scan_data["file_tree"] = scanned["file_tree"]
+                    scan_data["file_contents"] = scanned["file_contents"]
                     stage.save_artifact("affected_files.yaml", {
-                        "files": [f["path"] for f in prioritized],
+                        "files": [f["path"] for f in scanned["prioritized"]],
                     })
 
             elif phase_name == "generate_digest":
-                parsed_str = json.dumps(parsed_request, ensure_ascii=False)
                 digest = await self.doc_generator.generate_digest(
                     scan_data["file_tree"], scan_data["file_contents"],
                     parsed_str, self.client, self.model,
                 )
+                digest_str = json_dumps(digest or {})
                 stage.save_artifact("project_digest.yaml", digest)
 
             elif phase_name == "generate_checklist":
-                digest_str = json.dumps(digest, ensure_ascii=False)
-                parsed_str = json.dumps(parsed_request, ensure_ascii=False)
                 checklist = await self.doc_generator.generate_checklist(
                     digest_str, parsed_str, self.client, self.model,
                 )
+                checklist_str = json_dumps(checklist or {})
                 stage.save_artifact("checklist.yaml", checklist)
 
             elif phase_name == "generate_walkthrough":
-                digest_str = json.dumps(digest, ensure_ascii=False)
-                parsed_str = json.dumps(parsed_request, ensure_ascii=False)
-                checklist_str = json.dumps(checklist, ensure_ascii=False)
                 walkthrough = await self.doc_generator.generate_walkthrough(
                     digest_str, parsed_str, checklist_str, self.client, self.model,
                 )
+                walkthrough_str = json_dumps(walkthrough or {})
                 stage.save_artifact("walkthrough.yaml", walkthrough)
 
             elif phase_name == "generate_plan":
-                digest_str = json.dumps(digest or {}, ensure_ascii=False)
-                parsed_str = json.dumps(parsed_request, ensure_ascii=False)
-                checklist_str = json.dumps(checklist or {}, ensure_ascii=False)
-                walkthrough_str = json.dumps(walkthrough or {}, ensure_ascii=False)
-
                 if wf_def.name == "build":
                     plan_data = await self.doc_generator.generate_plan(
                         digest_str, parsed_str, checklist_str,
@@ -365,7 +500,7 @@ class UnifiedRouter:
                     )
                 else:
                     plan_data = await self._generate_light_plan(
-                        wf_def.name, query, parsed_request,
+                        wf_def.name, query, parsed_str,
                         scan_data, prev_context,
                     )
 
@@ -393,8 +528,8 @@ class UnifiedRouter:
                     combined = "\n".join(all_comments)
                     if combined:
                         await self._handle_review(
-                            combined, stage, checklist, walkthrough, plan,
-                            digest, parsed_request,
+                            combined, stage, checklist_str, walkthrough_str, plan,
+                            digest_str, parsed_str,
                         )
 
             elif phase_name == "implement":
@@ -411,13 +546,13 @@ class UnifiedRouter:
                 pass
 
             elif phase_name == "investigate":
-                investigation = await self._run_investigation(query, scan_data, parsed_request)
+                investigation = await self._run_investigation(query, scan_data, parsed_str)
                 stage.save_artifact("investigation.yaml", investigation)
                 stage.save_artifact("investigation.md", investigation.get("report", ""))
 
             elif phase_name in ("analyze", "research", "synthesize", "generate_report"):
                 report = await self._run_llm_phase(
-                    phase_name, wf_def.name, query, parsed_request,
+                    phase_name, wf_def.name, query, parsed_str,
                     scan_data, prev_context,
                 )
                 artifact_name = {
@@ -428,7 +563,7 @@ class UnifiedRouter:
                 }.get(phase_name, f"{phase_name}.md")
                 stage.save_artifact(artifact_name, report)
                 if phase_name == "generate_report":
-                    result["message"] = report if isinstance(report, str) else json.dumps(report, ensure_ascii=False)
+                    result["message"] = report if isinstance(report, str) else json_dumps(report)
 
             elif phase_name == "respond":
                 pass
@@ -438,12 +573,12 @@ class UnifiedRouter:
         return result
 
     async def _generate_light_plan(self, workflow: str, query: str,
-                                   parsed_request: Dict,
+                                   parsed_str: str,
                                    scan_data: Dict, prev_context: str) -> Dict:
         prompt = (
             f"Создай короткий план для задачи типа '{workflow}'.\n\n"
             f"Запрос: {query}\n"
-            f"Разбор запроса: {json.dumps(parsed_request, ensure_ascii=False)}\n"
+            f"Разбор запроса: {parsed_str}\n"
             f"Файлы проекта:\n{scan_data.get('file_tree', 'не доступны')[:2000]}\n"
             f"{'Контекст: ' + prev_context if prev_context else ''}\n\n"
             "Верни JSON с полем 'steps' - массив шагов.\n"
@@ -453,32 +588,31 @@ class UnifiedRouter:
         return await self.doc_generator.llm_json(prompt, self.client, self.model, 0.2)
 
     async def _run_investigation(self, query: str, scan_data: Dict,
-                                 parsed_request: Dict) -> Dict:
+                                 parsed_str: str) -> Dict:
         prompt = (
             "Проведи расследование проблемы.\n\n"
             f"Описание: {query}\n"
-            f"Разбор: {json.dumps(parsed_request, ensure_ascii=False)}\n"
+            f"Разбор: {parsed_str}\n"
             f"Структура проекта:\n{scan_data.get('file_tree', '')[:3000]}\n\n"
             "Верни JSON: {root_cause, affected_files, fix_strategy, report}"
         )
         return await self.doc_generator.llm_json(prompt, self.client, self.model, 0.1)
 
     async def _run_llm_phase(self, phase_name: str, workflow: str, query: str,
-                             parsed_request: Dict, scan_data: Dict,
+                             parsed_str: str, scan_data: Dict,
                              prev_context: str) -> Any:
-        research_prompt = _load_prompt("research_mode")
         if workflow == "analyze" and phase_name == "analyze":
             prompt = (
                 f"Проведи глубокий анализ проекта.\nЗапрос: {query}\n"
                 f"Структура проекта:\n{scan_data.get('file_tree', '')[:4000]}\n"
                 f"Содержимое ключевых файлов:\n{scan_data.get('file_contents', '')[:8000]}\n"
-                f"Разбор запроса: {json.dumps(parsed_request, ensure_ascii=False)}\n\n"
+                f"Разбор запроса: {parsed_str}\n\n"
                 "Включи: стек, архитектура, точки входа, потоки данных, технический долг, рекомендации."
             )
         elif workflow == "research" and phase_name == "research":
             prompt = (
                 f"Исследуй тему и собери информацию.\nЗапрос: {query}\n"
-                f"Разбор: {json.dumps(parsed_request, ensure_ascii=False)}\n"
+                f"Разбор: {parsed_str}\n"
                 f"{('Контекст проекта: ' + prev_context) if prev_context else ''}\n\n"
                 "Используй web_fetch и web_api для сбора данных.\n"
                 "Для каждого источника укажи URL и краткую выжимку."
@@ -486,7 +620,7 @@ class UnifiedRouter:
         elif phase_name == "generate_report":
             prompt = (
                 f"Сформируй финальный отчёт по результатам {workflow}.\nЗапрос: {query}\n"
-                f"Разбор: {json.dumps(parsed_request, ensure_ascii=False)}\n"
+                f"Разбор: {parsed_str}\n"
                 f"Структура:\n{scan_data.get('file_tree', '')[:3000]}\n"
                 f"{('Контекст: ' + prev_context) if prev_context else ''}\n\n"
                 "Формат: markdown отчёт с секциями, выводами и рекомендациями."
@@ -495,26 +629,31 @@ class UnifiedRouter:
             prompt = (
                 f"Выполни фазу '{phase_name}' воркфлоу '{workflow}'.\n\n"
                 f"Запрос: {query}\n"
-                f"Разбор: {json.dumps(parsed_request, ensure_ascii=False)}\n"
+                f"Разбор: {parsed_str}\n"
                 f"Структура:\n{scan_data.get('file_tree', '')[:3000]}\n"
                 f"{'Контекст: ' + prev_context if prev_context else ''}\n\n"
                 "Выполни задачу и верни результат."
             )
         if self.active_project_dir and workflow in ("analyze", "research"):
-            sys_prompt = (research_prompt or "").format(active_project_dir=self.active_project_dir or "")
-            if sys_prompt and not any(sys_prompt in str(m.get("content", "")) for m in self.history[-3:]):
-                self.history.append({"role": "system", "content": sys_prompt})
+            sys_prompt = prompt_fn("research_mode")(active_project_dir=self.active_project_dir or "")
+            self._set_mode_prompt("research_mode", sys_prompt)
         self.history.append({"role": "user", "content": prompt})
         return await self._step(project_dir=self.active_project_dir)
 
     async def _execute_implementation(self, stage: Stage, plan: Dict,
-                                      digest: Dict, project_dir: str) -> Dict:
+                                      digest: Dict, project_dir: str,
+                                      previous_entries: Optional[List[Dict]] = None) -> Dict:
         steps = plan.get("steps", [])
         if not steps:
             return {"total": 0, "completed": 0, "failed": 0, "blocked": 0, "failed_percent": 0}
 
-        digest_str = json.dumps(digest, ensure_ascii=False)
-        execution_log: List[Dict] = []
+        digest_str = json_dumps(digest)
+        # При resume лог продолжает историю прошлого запуска: save_execution_log
+        # перезаписывает файл целиком, и без неё выполненные шаги пропали бы
+        execution_log: List[Dict] = list(previous_entries or [])
+        first_new = len(execution_log)
+        # Последние 10 записей лога для промпта, каждая сериализуется один раз
+        recent_log: deque = deque((json_dumps(e) for e in execution_log[-10:]), maxlen=10)
         completed_ids: set = set()
         failed_ids: set = set()
         log_meta = {
@@ -524,71 +663,109 @@ class UnifiedRouter:
             "status": "running",
         }
 
-        for step in steps:
+        system_instruction = (
+            f"You are executing a step in the implementation plan.\n"
+            f"CRITICAL: The absolute root directory is {project_dir}\n"
+            f"ALL file paths MUST point inside {project_dir}."
+        )
+
+        async def run_step(step: Dict, history: List[ChatCompletionMessageParam],
+                           prev_log: str) -> Dict:
             step_num = step.get("step_number", "?")
-            cid = str(step.get("checklist_id", step.get("id", "")))
+            cid = _step_key(step)
             desc = step.get("description", "")
-
-            deps = set(str(d) for d in step.get("depends_on", []))
-            if deps & failed_ids:
-                log.warning(f"step {step_num} blocked by failed dependency")
-                execution_log.append({
-                    "step_number": step_num, "checklist_id": cid,
-                    "description": desc, "status": "blocked",
-                    "elapsed": 0, "error": "dependency failed",
-                })
-                stage.save_execution_log(execution_log, {**log_meta, "status": "running"})
-                continue
-
-            await self.progress.on_step_start(step_num, len(steps), desc)
-            log.info(f"step {step_num}: {desc}")
-            start = time.time()
-            status = "completed"
-            error = ""
-
-            for attempt in range(self.config.max_retry_per_step):
-                try:
-                    step_prompt = json.dumps(step, ensure_ascii=False)
-                    prompt = PROMPT_EXECUTE_STEP.format(
-                        step=step_prompt,
-                        project_digest=digest_str,
-                        current_file_content="Определи сам в процессе",
-                        previous_steps_log=json.dumps(execution_log[-10:], ensure_ascii=False),
-                    )
-                    system_instruction = (
-                        f"You are executing a step in the implementation plan.\n"
-                        f"CRITICAL: The absolute root directory is {project_dir}\n"
-                        f"ALL file paths MUST point inside {project_dir}."
-                    )
-                    self.history.append({"role": "system", "content": system_instruction})
-                    self.history.append({"role": "user", "content": prompt})
-                    await self._step(project_dir=project_dir)
-                    status = "completed"
-                    completed_ids.add(cid)
-                    self.doc_generator.mark_step_completed(stage.artifacts_dir, cid, step_num)
-                    error = ""
-                    break
-                except Exception as e:
-                    log.error(f"step {step_num} attempt {attempt + 1} error: {e}")
-                    error = str(e)
-                    status = "failed"
-
-            if status == "failed":
-                failed_ids.add(cid)
-
-            elapsed = time.time() - start
-            execution_log.append({
+            async with step_sem:
+                await self.progress.on_step_start(step_num, len(steps), desc)
+                log.info(f"step {step_num}: {desc}")
+                start = time.time()
+                status = "completed"
+                error = ""
+
+                attempts = self.config.max_retry_per_step
+                for attempt in range(attempts):
+                    try:
+                        prompt = PROMPT_EXECUTE_STEP_FN(
+                            step=json_dumps(step),
+                            project_digest=digest_str,
+                            current_file_content="Определи сам в процессе",
+                            previous_steps_log=prev_log,
+                        )
+                        history.append({"role": "system", "content": system_instruction})
+                        history.append({"role": "user", "content": prompt})
+                        await self._step(project_dir=project_dir, history=history)
+                        status = "completed"
+                        self.doc_generator.mark_step_completed(stage.artifacts_dir, cid, step_num)
+                        error = ""
+                        break
+                    except Exception as e:
+                        log.error(f"step {step_num} attempt {attempt + 1} error: {e}")
+                        error = str(e)
+                        status = "failed"
+                        # Сбой провайдера (429/5xx/сеть) - ждём с backoff и jitter, а не
+                        # повторяем сразу; ошибки самого шага повторяются без паузы
+                        if isinstance(e, RETRYABLE_ERRORS) and attempt + 1 < attempts:
+                            await asyncio.sleep(self.doc_generator.retry_delay(e, attempt))
+
+            return {
                 "step_number": step_num, "checklist_id": cid,
                 "description": desc, "status": status,
-                "elapsed": round(elapsed, 2), "error": error,
-            })
+                "elapsed": round(time.time() - start, 2), "error": error,
+            }
+
+        parallel = max(1, self.config.max_parallel_steps)
+        step_sem = asyncio.Semaphore(parallel)
+        levels = _step_levels(steps) if parallel > 1 else [[s] for s in steps]
+
+        for level in levels:
+            # Записи лога уровня собираются в порядке плана: заблокированные сразу,
+            # выполненные - после gather
+            entries: List[Optional[Dict]] = [None] * len(level)
+            runnable = []
+            for i, step in enumerate(level):
+                deps = set(str(d) for d in step.get("depends_on", []))
+                if deps & failed_ids:
+                    step_num = step.get("step_number", "?")
+                    log.warning(f"step {step_num} blocked by failed dependency")
+                    entries[i] = {
+                        "step_number": step_num,
+                        "checklist_id": _step_key(step),
+                        "description": step.get("description", ""), "status": "blocked",
+                        "elapsed": 0, "error": "dependency failed",
+                    }
+                else:
+                    runnable.append(i)
+
+            if runnable:
+                prev_log = f"[{','.join(recent_log)}]"
+                if len(runnable) == 1:
+                    histories = [self.history]
+                else:
+                    # Каждый шаг уровня ведёт свою копию диалога; после уровня
+                    # новые сообщения дописываются в общую историю в порядке плана
+                    base = len(self.history)
+                    histories = [list(self.history) for _ in runnable]
+                done = await asyncio.gather(
+                    *(run_step(level[i], h, prev_log) for i, h in zip(runnable, histories))
+                )
+                if len(runnable) > 1:
+                    for h in histories:
+                        self.history.extend(h[base:])
+                for i, entry in zip(runnable, done):
+                    entries[i] = entry
+                    if entry["status"] == "completed":
+                        completed_ids.add(entry["checklist_id"])
+                    else:
+                        failed_ids.add(entry["checklist_id"])
+
+            execution_log.extend(entries)
+            recent_log.extend(json_dumps(e) for e in entries)
             stage.save_execution_log(execution_log, {**log_meta, "status": "running"})
-            await self.progress.on_step_done(step_num, status)
+            for i in runnable:
+                await self.progress.on_step_done(entries[i]["step_number"], entries[i]["status"])
 
         total = len(steps)
-        completed = sum(1 for e in execution_log if e["status"] == "completed")
-        failed = sum(1 for e in execution_log if e["status"] == "failed")
-        blocked = sum(1 for e in execution_log if e["status"] == "blocked")
+        counts = Counter(e["status"] for e in execution_log[first_new:])
+        completed, failed, blocked = counts["completed"], counts["failed"], counts["blocked"]
         failed_pct = (failed / max(total, 1)) * 100
 
         log_meta["status"] = "completed"
@@ -602,63 +779,64 @@ class UnifiedRouter:
         }
 
     async def _handle_review(self, comments: str, stage: Stage,
-                             checklist: Dict, walkthrough: Dict, plan: Dict,
-                             digest: Dict, parsed_request: Dict):
+                             checklist_str: str, walkthrough_str: str, plan: Dict,
+                             digest_str: str, parsed_str: str):
+        """Документы приходят уже сериализованными (как их видел LLM в фазах)."""
         review_result = await self.doc_generator.parse_review_comments(
-            comments,
-            json.dumps(checklist, ensure_ascii=False),
-            json.dumps(walkthrough, ensure_ascii=False),
-            json.dumps(plan, ensure_ascii=False),
+            comments, checklist_str, walkthrough_str,
+            json_dumps(plan),
             self.client, self.model,
         )
         to_regen = review_result.get("documents_to_regenerate", [])
         if to_regen:
-            digest_str = json.dumps(digest, ensure_ascii=False)
-            parsed_str = json.dumps(parsed_request, ensure_ascii=False) + f"\nКомментарии: {comments}"
+            parsed_str = f"{parsed_str}\nКомментарии: {comments}"
             if "checklist" in to_regen:
                 checklist = await self.doc_generator.generate_checklist(
                     digest_str, parsed_str, self.client, self.model,
                 )
                 stage.save_artifact("checklist.yaml", checklist)
+                checklist_str = json_dumps(checklist)
             if "walkthrough" in to_regen or "checklist" in to_regen:
                 walkthrough = await self.doc_generator.generate_walkthrough(
-                    digest_str, parsed_str,
-                    json.dumps(checklist, ensure_ascii=False),
+                    digest_str, parsed_str, checklist_str,
                     self.client, self.model,
                 )
                 stage.save_artifact("walkthrough.yaml", walkthrough)
+                walkthrough_str = json_dumps(walkthrough)
             plan = await self.doc_generator.generate_plan(
-                digest_str, parsed_str,
-                json.dumps(checklist, ensure_ascii=False),
-                json.dumps(walkthrough, ensure_ascii=False),
+                digest_str, parsed_str, checklist_str, walkthrough_str,
                 self.client, self.model,
             )
             stage.save_artifact("implementation_plan.yaml", plan)
 
-    async def _resume_stage(self, stage: Stage, stage_mgr: StageManager) -> RequestResult:
-        execution_log_data = stage.load_execution_log()
+    @staticmethod
+    def _load_resume_plan(stage: Stage) -> Optional[Dict]:
         plan = stage.load_plan()
         if not plan:
-            artifact_plan = stage.load_artifact("implementation_plan.yaml")
-            if not artifact_plan:
-                artifact_plan = stage.load_artifact(f"{stage.workflow}_plan.yaml")
-            plan = artifact_plan
+            plan = stage.load_artifact("implementation_plan.yaml")
+            if not plan:
+                plan = stage.load_artifact(f"{stage.workflow}_plan.yaml")
+        return plan
 
+    async def _resume_stage(self, stage: Stage, stage_mgr: StageManager) -> RequestResult:
+        # Чтение и разбор YAML стейджа - в потоках, чтобы не стопорить event loop
+        execution_log_data, plan, digest = await asyncio.gather(
+            asyncio.to_thread(stage.load_execution_log),
+            asyncio.to_thread(self._load_resume_plan, stage),
+            asyncio.to_thread(stage.load_artifact, "project_digest.yaml"),
+        )
         if not plan:
             return RequestResult("resume", "failed", "План не найден для возобновления")
 
-        digest = stage.load_artifact("project_digest.yaml") or {}
+        digest = digest or {}
 
-        completed_ids = set()
-        prev_entries = []
-        if execution_log_data:
-            for entry in execution_log_data.get("steps", []):
-                if entry.get("status") == "completed":
-                    completed_ids.add(str(entry.get("checklist_id", "")))
-            prev_entries = execution_log_data.get("steps", [])
+        prev_entries = execution_log_data.get("steps", []) if execution_log_data else []
+        completed_ids = {
+            str(e.get("checklist_id", "")) for e in prev_entries if e.get("status") == "completed"
+        }
 
         steps = plan.get("steps", [])
-        pending = [s for s in steps if str(s.get("checklist_id", s.get("id", ""))) not in completed_ids]
+        pending = [s for s in steps if _step_key(s) not in completed_ids]
 
         if not pending:
             stage.update_status("completed")
@@ -669,7 +847,7 @@ class UnifiedRouter:
         # Выполняем оставшиеся шаги
         temp_plan = {"steps": pending}
         exec_result = await self._execute_implementation(
-            stage, temp_plan, digest, self.active_project_dir,
+            stage, temp_plan, digest, self.active_project_dir, prev_entries,
         )
 
         status = "completed"
@@ -711,75 +889,169 @@ class UnifiedRouter:
             phases.append(phase)
         return {"workflow": wf_def.name, "phases": phases}
 
-    async def _step(self, project_dir: str = None) -> str:
-        messages = [{"role": "system", "content": self.system_prompt}] + self.history
+    async def _step(self, project_dir: str = None,
+                    history: Optional[List[ChatCompletionMessageParam]] = None) -> str:
+        """
+        Один ход диалога с инструментами: запросы к модели повторяются в цикле,
+        пока она вызывает инструменты. history - по умолчанию self.history.
+        """
+        if history is None:
+            history = self.history
+        self._drop_stale_mode_prompts()
         tools = self.tools_registry.get_openai_schemas()
+        messages: List[ChatCompletionMessageParam] = []
+        win_start = sent = -1
+
+        while True:
+            # Пока начало окна не сдвинулось, список запроса дополняется новыми
+            # сообщениями, а не собирается заново на каждом раунде инструментов
+            start = self._window_start(history)
+            if start != win_start:
+                messages = [self._system_message, *self.system_messages, *history[start:]]
+                win_start = start
+            else:
+                messages.extend(history[sent:])
+            sent = len(history)
+            if self.config.stream_responses:
+                msg_dict = await self._complete_streaming(messages, tools)
+            else:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    tools=tools if tools else None,
+                    tool_choice="auto" if tools else None,
+                )
+                message = response.choices[0].message
+                msg_dict = message.model_dump(exclude_none=True)
+            history.append(msg_dict)
+
+            tool_calls = msg_dict.get("tool_calls")
+            if not tool_calls:
+                return msg_dict.get("content") or ""
+
+            results = await self._run_tool_calls(tool_calls, project_dir)
+            for tool_call, result in zip(tool_calls, results):
+                history.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "content": result,
+                })
+
+    async def _run_tool_calls(self, tool_calls: List[Dict[str, Any]],
+                              project_dir: Optional[str]) -> List[str]:
+        """
+        Подряд идущие read-only вызовы выполняются через gather, остальные -
+        по одному в исходном порядке. Результаты - в порядке tool_calls.
+        """
+        results: List[str] = []
+        i = 0
+        while i < len(tool_calls):
+            j = i + 1
+            if tool_calls[i]["function"]["name"] in READ_ONLY_TOOLS:
+                while j < len(tool_calls) and tool_calls[j]["function"]["name"] in READ_ONLY_TOOLS:
+                    j += 1
+            if j - i > 1:
+                results.extend(await asyncio.gather(
+                    *(self._run_tool_call(tc, project_dir) for tc in tool_calls[i:j])))
+            else:
+                results.append(await self._run_tool_call(tool_calls[i], project_dir))
+            i = j
+        return results
+
+    async def _run_tool_call(self, tool_call: Dict[str, Any], project_dir: Optional[str]) -> str:
+        """Выполняет один вызов инструмента из ответа модели, ошибки - текстом результата."""
+        tool_name = tool_call["function"]["name"]
+        arguments_str = tool_call["function"]["arguments"]
+        result = None
 
-        response = await self.client.chat.completions.create(
+        try:
+            tool_args = json_loads(arguments_str)
+
+            if project_dir:
+                path_error = None
+                for k in tool_args:  # меняются только значения - копия ключей не нужна
+                    if k in PATH_ARGS and isinstance(tool_args[k], str):
+                        try:
+                            tool_args[k] = _resolve_and_guard(tool_args[k], project_dir)
+                        except ValueError as e:
+                            path_error = str(e)
+                            break
+                if path_error:
+                    result = f"ERROR: {path_error}"
+                else:
+                    if tool_name == "execute_command" and "cwd" not in tool_args:
+                        tool_args["cwd"] = project_dir
+
+            if result is None:
+                tool = self.tools_registry.get(tool_name)
+                if not tool:
+                    result = f"Error: Tool {tool_name} not found"
+                else:
+                    if tool_name in DANGEROUS_TOOLS and self.confirmation_callback:
+                        # Шаги одного уровня идут параллельно - подтверждения по одному
+                        async with self._confirm_lock:
+                            confirmed = await self.confirmation_callback(tool_name, tool_args)
+                        if not confirmed:
+                            result = "Tool execution cancelled by user."
+                        else:
+                            result = await tool.run(tool.validate_args(tool_args))
+                    else:
+                        result = await tool.run(tool.validate_args(tool_args))
+
+        except json.JSONDecodeError:
+            result = f"Error: Invalid JSON arguments for {tool_name}"
+        except Exception as e:
+            log.error(f"tool {tool_name} error: {e}")
+            result = f"Error executing tool {tool_name}: {e}"
+
+        return str(result)
+
+    async def _complete_streaming(self, messages: List[Dict[str, Any]],
+                                  tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Потоковый вариант запроса из _step: текст уходит в progress.on_message
+        (msg_type "stream") по мере генерации, дельты tool_calls склеиваются
+        по index. Возвращает сообщение в том же виде, что model_dump(exclude_none=True).
+        """
+        stream = await self.client.chat.completions.create(
             model=self.model,
             messages=messages,
             tools=tools if tools else None,
             tool_choice="auto" if tools else None,
+            stream=True,
         )
-
-        message = response.choices[0].message
-        msg_dict = {k: v for k, v in message.model_dump().items() if v is not None}
-        self.history.append(msg_dict)
-
-        if message.tool_calls:
-            for tool_call in message.tool_calls:
-                tool_name = tool_call.function.name
-                arguments_str = tool_call.function.arguments
-                result = None
-
-                try:
-                    tool_args = json.loads(arguments_str)
-
-                    if project_dir:
-                        path_error = None
-                        for k in list(tool_args.keys()):
-                            if k in PATH_ARGS and isinstance(tool_args[k], str):
-                                try:
-                                    tool_args[k] = _resolve_and_guard(tool_args[k], project_dir)
-                                except ValueError as e:
-                                    path_error = str(e)
-                                    break
-                        if path_error:
-                            result = f"ERROR: {path_error}"
-                        else:
-                            if tool_name == "execute_command" and "cwd" not in tool_args:
-                                tool_args["cwd"] = project_dir
-
-                    if result is None:
-                        tool = self.tools_registry.get(tool_name)
-                        if not tool:
-                            result = f"Error: Tool {tool_name} not found"
-                        else:
-                            if tool_name in DANGEROUS_TOOLS and self.confirmation_callback:
-                                confirmed = await self.confirmation_callback(tool_name, tool_args)
-                                if not confirmed:
-                                    result = "Tool execution cancelled by user."
-                                else:
-                                    result = await tool.run(tool.validate_args(tool_args))
-                            else:
-                                result = await tool.run(tool.validate_args(tool_args))
-
-                except json.JSONDecodeError:
-                    result = f"Error: Invalid JSON arguments for {tool_name}"
-                except Exception as e:
-                    log.error(f"tool {tool_name} error: {e}")
-                    result = f"Error executing tool {tool_name}: {e}"
-
-                self.history.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": tool_name,
-                    "content": str(result),
+        parts: List[str] = []
+        calls: Dict[int, Dict[str, Any]] = {}
+        # Куски arguments копятся списком и склеиваются один раз в конце:
+        # += по строке в словаре копирует весь накопленный JSON на каждой дельте
+        arg_parts: Dict[int, List[str]] = {}
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                parts.append(delta.content)
+                await self.progress.on_message(delta.content, "stream")
+            for tc in delta.tool_calls or ():
+                call = calls.setdefault(tc.index, {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""},
                 })
-
-            return await self._step(project_dir=project_dir)
-
-        return message.content or ""
+                if tc.id:
+                    call["id"] = tc.id
+                if tc.function:
+                    if tc.function.name:
+                        call["function"]["name"] += tc.function.name
+                    if tc.function.arguments:
+                        arg_parts.setdefault(tc.index, []).append(tc.function.arguments)
+        for i, chunks in arg_parts.items():
+            calls[i]["function"]["arguments"] = "".join(chunks)
+        msg_dict: Dict[str, Any] = {"role": "assistant"}
+        if parts or not calls:
+            msg_dict["content"] = "".join(parts)
+        if calls:
+            msg_dict["tool_calls"] = [calls[i] for i in sorted(calls)]
+        return msg_dict
 
     async def create_project_dir(self, goal: str) -> str:
         prompt = (
@@ -794,8 +1066,8 @@ class UnifiedRouter:
                 temperature=0.2,
             )
             raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            name = json.loads(js).get("dir_name", "new-project") if js else "new-project"
+            data = extract_json(raw)
+            name = data.get("dir_name", "new-project") if data else "new-project"
         except Exception:
             name = "new-project"
 
@@ -6,11 +6,12 @@ WorkflowClassifier - двухэтапная классификация запр
 """
 
 import os
-import json
+import re
+import asyncio
 import logging
-from typing import Optional, Tuple
+from typing import Dict, FrozenSet, Optional, Tuple
 from openai import AsyncOpenAI
-from openrouter_agent.utils import find_balanced_json
+from openrouter_agent.utils import extract_json, prompt_key, wait_shared, TTLCache
 from openrouter_agent.agent.workflow_registry import WorkflowRegistry
 
 log = logging.getLogger(__name__)
@@ -45,6 +46,59 @@ _BUILD_KW = (
 )
 
 
+# Порядок важен: при нескольких совпадениях побеждает более ранняя категория
+_KEYWORD_GROUPS = (
+    ("reset", _RESET_KW),
+    ("resume", _RESUME_KW),
+    ("fix", _FIX_KW),
+    ("analyze", _ANALYZE_KW),
+    ("research", _RESEARCH_KW),
+    ("build", _BUILD_KW),
+)
+
+
+def _build_keyword_matcher() -> Tuple["re.Pattern", Dict[str, FrozenSet[str]]]:
+    """
+    Один регэксп на все ключевые слова вместо any(kw in lower ...) по каждой
+    группе. Совпадение ищется lookahead'ом в каждой позиции (ловит и
+    перекрывающиеся слова), а фразе сопоставляются категории всех ключевых
+    слов, входящих в неё подстрокой ("изучи тему" - это и research, и analyze).
+    """
+    kw_cats: Dict[str, set] = {}
+    for cat, kws in _KEYWORD_GROUPS:
+        for kw in kws:
+            kw_cats.setdefault(kw, set()).add(cat)
+    phrase_cats = {
+        kw: frozenset(c for other, cats in kw_cats.items() if other in kw for c in cats)
+        for kw in kw_cats
+    }
+    alternation = "|".join(re.escape(kw) for kw in sorted(kw_cats, key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))"), phrase_cats
+
+
+_KEYWORD_RE, _PHRASE_CATS = _build_keyword_matcher()
+
+
+def _keyword_categories(lower: str) -> FrozenSet[str]:
+    found = set()
+    for m in _KEYWORD_RE.finditer(lower):
+        found |= _PHRASE_CATS[m.group(1)]
+    return frozenset(found)
+
+
+_PROMPT_TAIL = (
+    "\n\n"
+    "Верни ТОЛЬКО JSON:\n"
+    '{"workflow": "build|modify|fix|analyze|research|chat", '
+    '"confidence": 0.0-1.0, '
+    '"reasoning": "краткое обоснование"}'
+)
+
+# Ключ классификации -> идущий LLM-вызов. Общий для всех сессий процесса:
+# одинаковые запросы от разных клиентов ждут один ответ
+_INFLIGHT: Dict[bytes, asyncio.Future] = {}
+
+
 class ClassificationResult:
     def __init__(self, workflow: str, confidence: float, reasoning: str = ""):
         self.workflow = workflow
@@ -53,31 +107,42 @@ class ClassificationResult:
 
 
 class WorkflowClassifier:
-    def __init__(self):
+    def __init__(self, cache_size: int = 256, cache_ttl_s: float = 3600.0):
         self.registry = WorkflowRegistry()
+        # Статичная часть промпта LLM-классификации (набор воркфлоу фиксирован)
+        self._prompt_head = (
+            "Ты классификатор запросов. Определи какой workflow подходит для запроса пользователя.\n\n"
+            f"Доступные workflow:\n{self.registry.get_descriptions_for_llm()}\n"
+            "- chat: простой вопрос/ответ, не требующий инструментов или изменений в файлах\n"
+        )
+        # Уверенные ответы LLM по (model, запрос, контекст проекта): повтор того же
+        # запроса (переотправка из UI, переподключение) обходится без вызова
+        self._cache = TTLCache(cache_size, cache_ttl_s)
 
     def classify_heuristic(self, text: str) -> Optional[ClassificationResult]:
         lower = text.lower().strip()
+        cats = _keyword_categories(lower)
 
-        if any(kw in lower for kw in _RESET_KW) and len(lower.split()) <= 3:
+        if "reset" in cats and len(lower.split()) <= 3:
             return ClassificationResult("reset", 1.0, "команда сброса")
 
-        if any(kw in lower for kw in _RESUME_KW):
+        if "resume" in cats:
             return ClassificationResult("resume", 0.95, "ключевое слово resume")
 
-        if self._extract_path(text) and len(text.split()) <= 4:
+        # Сначала дешёвая проверка длины - stat по токенам только для коротких запросов
+        if len(text.split()) <= 4 and self._extract_path(text):
             return ClassificationResult("serve_project", 0.85, "путь к директории")
 
-        if any(kw in lower for kw in _FIX_KW):
+        if "fix" in cats:
             return ClassificationResult("fix", 0.8, "ключевые слова fix/bug")
 
-        if any(kw in lower for kw in _ANALYZE_KW):
+        if "analyze" in cats:
             return ClassificationResult("analyze", 0.8, "ключевые слова анализа")
 
-        if any(kw in lower for kw in _RESEARCH_KW):
+        if "research" in cats:
             return ClassificationResult("research", 0.8, "ключевые слова исследования")
 
-        if any(kw in lower for kw in _BUILD_KW):
+        if "build" in cats:
             return ClassificationResult("build", 0.75, "ключевые слова создания")
 
         return None
@@ -89,30 +154,44 @@ class WorkflowClassifier:
             log.info(f"heuristic classification: {heuristic.workflow} ({heuristic.confidence})")
             return heuristic
 
-        llm_result = await self._classify_llm(text, project_context, client, model)
+        key = prompt_key(model, f"{' '.join(text.lower().split())}\0{project_context}")
+        llm_result = self._cache.get(key)
+        if llm_result is None:
+            while llm_result is None:
+                pending = _INFLIGHT.get(key)
+                if pending is None:
+                    llm_result = await self._classify_llm_once(key, text, project_context, client, model)
+                else:
+                    # None - владелец вызова отменён; повторяем (или ждём нового владельца)
+                    llm_result = await wait_shared(pending)
+            if llm_result.confidence >= 0.7:
+                self._cache.put(key, llm_result)
 
         if heuristic and llm_result.confidence < heuristic.confidence:
             return heuristic
 
         return llm_result
 
+    async def _classify_llm_once(self, key: bytes, text: str, project_context: str,
+                                 client: AsyncOpenAI, model: str) -> ClassificationResult:
+        fut = asyncio.get_running_loop().create_future()
+        _INFLIGHT[key] = fut
+        try:
+            result = await self._classify_llm(text, project_context, client, model)
+            fut.set_result(result)
+            return result
+        except BaseException:
+            # Ждущие не наследуют отмену/ошибку владельца - wait_shared вернёт им None
+            fut.cancel()
+            raise
+        finally:
+            if _INFLIGHT.get(key) is fut:
+                del _INFLIGHT[key]
+
     async def _classify_llm(self, text: str, project_context: str,
                             client: AsyncOpenAI, model: str) -> ClassificationResult:
-        workflows_desc = self.registry.get_descriptions_for_llm()
-
         ctx_block = f"\nКонтекст проекта:\n{project_context}\n" if project_context else ""
-
-        prompt = (
-            "Ты классификатор запросов. Определи какой workflow подходит для запроса пользователя.\n\n"
-            f"Доступные workflow:\n{workflows_desc}\n"
-            "- chat: простой вопрос/ответ, не требующий инструментов или изменений в файлах\n"
-            f"{ctx_block}\n"
-            f"Запрос пользователя: {text}\n\n"
-            "Верни ТОЛЬКО JSON:\n"
-            '{"workflow": "build|modify|fix|analyze|research|chat", '
-            '"confidence": 0.0-1.0, '
-            '"reasoning": "краткое обоснование"}'
-        )
+        prompt = f"{self._prompt_head}{ctx_block}\nЗапрос пользователя: {text}{_PROMPT_TAIL}"
 
         try:
             r = await client.chat.completions.create(
@@ -121,17 +200,16 @@ class WorkflowClassifier:
                 temperature=0.1,
             )
             raw = r.choices[0].message.content or ""
-            js = find_balanced_json(raw)
-            if not js:
+            data = extract_json(raw)
+            if data is None:
                 log.warning(f"llm classifier returned no json: {raw[:200]}")
                 return ClassificationResult("chat", 0.5, "llm не вернул json")
 
-            data = json.loads(js)
             workflow = data.get("workflow", "chat")
             confidence = float(data.get("confidence", 0.5))
             reasoning = data.get("reasoning", "")
 
-            if workflow not in self.registry.list_names():
+            if workflow not in self.registry:
                 log.warning(f"llm returned unknown workflow: {workflow}")
                 workflow = "chat"
                 confidence = 0.4
@@ -145,10 +223,11 @@ class WorkflowClassifier:
 
     @staticmethod
     def _extract_path(text: str) -> Optional[str]:
+        """Первый токен-путь к существующей директории (проект - всегда директория)."""
         for token in text.split():
-            if token.startswith(("/", "./", "~/")):
+            if token != "/" and token.startswith(("/", "./", "~/")):
                 expanded = os.path.expanduser(token)
-                if os.path.exists(expanded):
+                if os.path.isdir(expanded):
                     return os.path.abspath(expanded)
         return None
 
@@ -7,7 +7,8 @@ WorkflowRegistry - реестр воркфлоу.
 
 import logging
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 
 log = logging.getLogger(__name__)
 
@@ -146,20 +147,29 @@ RESUME = WorkflowDef(
 
 class WorkflowRegistry:
     def __init__(self):
-        self._workflows: Dict[str, WorkflowDef] = {}
+        workflows: Dict[str, WorkflowDef] = {}
         for wf in (BUILD, MODIFY, FIX, ANALYZE, RESEARCH, CHAT, RESUME):
-            self._workflows[wf.name] = wf
+            workflows[wf.name] = wf
+        # Реестр неизменяем после создания - производные представления считаются один раз
+        self._workflows: Mapping[str, WorkflowDef] = MappingProxyType(workflows)
+        self._names: Tuple[str, ...] = tuple(workflows)
+        self._llm_descriptions: Optional[str] = None
 
     def get(self, name: str) -> Optional[WorkflowDef]:
         return self._workflows.get(name)
 
-    def list_names(self) -> List[str]:
-        return list(self._workflows.keys())
+    def list_names(self) -> Tuple[str, ...]:
+        return self._names
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._workflows
 
     def get_descriptions_for_llm(self) -> str:
-        lines = []
-        for name, wf in self._workflows.items():
-            if name in ("chat", "resume"):
-                continue
-            lines.append(f"- {name}: {wf.description}")
-        return "\n".join(lines)
+        # Набор воркфлоу фиксирован при создании реестра
+        if self._llm_descriptions is None:
+            self._llm_descriptions = "\n".join(
+                f"- {name}: {wf.description}"
+                for name, wf in self._workflows.items()
+                if name not in ("chat", "resume")
+            )
+        return self._llm_descriptions
@@ -1,7 +1,6 @@
 """AgentSession - WebSocket сессия через UnifiedRouter."""
 
 import os
-import json
 import asyncio
 import logging
 from typing import Optional, Dict, Any
@@ -9,6 +8,7 @@ from typing import Optional, Dict, Any
 from openrouter_agent.agent.unified_router import UnifiedRouter, ProgressCallback, RequestResult
 from openrouter_agent.agent.config import PipelineConfig
 from openrouter_agent.server.events import *
+from openrouter_agent.utils import json_dumps
 
 log = logging.getLogger(__name__)
 
@@ -55,21 +55,78 @@ class WebProgress(ProgressCallback):
 
 
 class SocketIOLogHandler(logging.Handler):
+    """
+    Логи уходят клиенту пачками через одну фоновую задачу, а не отдельной
+    задачей на каждую запись. Очередь ограничена: при переполнении
+    отбрасываются самые старые записи. Записи из рабочих потоков
+    (asyncio.to_thread) передаются в цикл событий через call_soon_threadsafe.
+    """
+    QUEUE_SIZE = 1000
+    BATCH_SIZE = 64
+
     def __init__(self, sio, sid: str):
         super().__init__()
         self._sio = sio
         self._sid = sid
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._drainer = self._loop.create_task(self._drain())
 
     def emit(self, record):
         try:
-            msg = self.format(record)
-            asyncio.ensure_future(
-                self._sio.emit(EVT_LOG, {"message": msg, "level": record.levelname},
-                               to=self._sid)
-            )
+            item = {"message": self.format(record), "level": record.levelname}
+            if self._loop.is_closed():
+                return
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._loop:
+                self._enqueue(item)
+            else:
+                self._loop.call_soon_threadsafe(self._enqueue, item)
         except Exception:
             pass
 
+    def _enqueue(self, item: Dict[str, str]):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(item)
+
+    async def _drain(self):
+        while True:
+            items = [await self._queue.get()]
+            while not self._queue.empty() and len(items) < self.BATCH_SIZE:
+                items.append(self._queue.get_nowait())
+            try:
+                await self._sio.emit(EVT_LOG, {"batch": items}, to=self._sid)
+            except Exception:
+                pass
+
+    def close(self):
+        self._drainer.cancel()
+        super().close()
+
+
+class _EmitWrapper:
+    """Подменяет tool.run: шлёт клиенту вызов и результат инструмента."""
+    __slots__ = ("_orig", "_name", "_sio", "_sid")
+
+    def __init__(self, orig, name: str, sio, sid: str):
+        self._orig = orig
+        self._name = name
+        self._sio = sio
+        self._sid = sid
+
+    async def __call__(self, args):
+        await self._sio.emit(EVT_TOOL_CALL, {"tool": self._name, "args": str(args)},
+                             to=self._sid)
+        result = await self._orig(args)
+        await self._sio.emit(EVT_TOOL_RESULT, {
+            "tool": self._name, "result": str(result)[:2000],
+        }, to=self._sid)
+        return result
+
 
 class AgentSession:
     def __init__(self, sio, sid: str):
@@ -97,18 +154,7 @@ class AgentSession:
 
     def _patch_tools_once(self):
         for name, tool in self.router.tools_registry._tools.items():
-            original_run = tool.run
-
-            async def _wrapped(args, _name=name, _orig=original_run):
-                await self.sio.emit(EVT_TOOL_CALL, {"tool": _name, "args": str(args)},
-                                    to=self.sid)
-                result = await _orig(args)
-                await self.sio.emit(EVT_TOOL_RESULT, {
-                    "tool": _name, "result": str(result)[:2000],
-                }, to=self.sid)
-                return result
-
-            tool.run = _wrapped
+            tool.run = _EmitWrapper(tool.run, name, self.sio, self.sid)
 
     async def _confirm_tool(self, tool_name: str, args: Any) -> bool:
         self._tool_confirm_future = asyncio.get_event_loop().create_future()
@@ -163,7 +209,8 @@ class AgentSession:
         elif command == "reset":
             await self.handle_input("reset")
         else:
-            await self.handle_input(f"{command} {json.dumps(data)}")
+            await self.handle_input(f"{command} {json_dumps(data)}")
 
     def cleanup(self):
         logging.getLogger("openrouter_agent").removeHandler(self._log_handler)
+        self._log_handler.close()
@@ -7,6 +7,8 @@ from pathlib import Path
 import socketio
 from litestar import Litestar, get
 
+from openrouter_agent.agent.doc_generator import DocumentGenerator
+from openrouter_agent.tools import web as web_tools
 from openrouter_agent.server.agent_session import AgentSession
 from openrouter_agent.server.events import (
     EVT_INPUT, EVT_CONFIRM_RESP, EVT_COMMAND,
@@ -70,7 +72,7 @@ async def health() -> dict:
     return {"status": "ok", "sessions": len(sessions)}
 
 
-_litestar = Litestar(route_handlers=[health])
+_litestar = Litestar(route_handlers=[health], on_shutdown=[DocumentGenerator.close_clients, web_tools.close_client])
 
 # uvicorn openrouter_agent.server.app:app подхватывает этот объект
 app = socketio.ASGIApp(sio, other_asgi_app=_litestar)
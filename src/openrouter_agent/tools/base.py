@@ -1,10 +1,70 @@
+import os
+import time
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Type, Union, Generic, TypeVar
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Type, Union, Generic, TypeVar
 import msgspec
-from litestar.types import Empty
 
 T = TypeVar("T", bound=msgspec.Struct)
 
+# Аргументы инструмента без args_schema. Свой маркер вместо litestar.types.Empty:
+# импорт litestar ради одной константы стоил ~0.2 с при загрузке инструментов
+Empty = msgspec.UNSET
+
+
+# Время жизни закэшированного resolve: симлинки может поменять execute_command
+# (ln -sfn, mv), поэтому результат живёт пару секунд, а не всю сессию
+_RESOLVE_TTL_S = 2.0
+
+
+@lru_cache(maxsize=256)
+def _resolve_at(cwd: str, path: str, epoch: int) -> Path:
+    return Path(cwd, path).resolve()
+
+
+def resolve_path(path: str) -> Path:
+    """
+    Path(path).resolve() с коротким кэшем: агент раз за разом трогает одни
+    и те же файлы (read -> edit -> read), realpath по каждому компоненту пути
+    не повторяется. Относительные пути кэшируются вместе с текущим каталогом.
+    """
+    epoch = int(time.monotonic() // _RESOLVE_TTL_S)
+    return _resolve_at("" if os.path.isabs(path) else os.getcwd(), path, epoch)
+
+
+@lru_cache(maxsize=64)
+def _args_decoder(args_schema: type) -> msgspec.json.Decoder:
+    return msgspec.json.Decoder(args_schema)
+
+
+@lru_cache(maxsize=16)
+def _empty_args(args_schema: type) -> msgspec.Struct:
+    return args_schema()
+
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    # OpenAI ждёт объект параметров на верхнем уровне - $ref на $defs подставляем на место
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if ref is not None:
+            return _inline_refs(defs[ref.rsplit("/", 1)[-1]], defs)
+        return {k: _inline_refs(v, defs) for k, v in node.items() if k != "title"}
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+@lru_cache(maxsize=64)
+def _args_json_schema(args_schema: Optional[type]) -> Dict[str, Any]:
+    """JSON Schema параметров инструмента из msgspec.Struct - один раз на тип."""
+    if args_schema is None:
+        return {"type": "object", "properties": {}}
+    schema = msgspec.json.schema(args_schema)
+    return _inline_refs(schema, schema.get("$defs", {}))
+
+
 class BaseTool(ABC, Generic[T]):
     """
     Abstract base class for all tools.
@@ -26,34 +86,47 @@ class BaseTool(ABC, Generic[T]):
         """
         pass
 
-    def validate_args(self, args: Dict[str, Any]) -> T:
+    def validate_args(self, args: Union[Dict[str, Any], str, bytes]) -> T:
         """
         Validate arguments using msgspec based on defined schema.
+        Сырой JSON аргументов (str/bytes) разбирается сразу в схему кэшированным Decoder.
         """
         if self.args_schema is None:
             return Empty # type: ignore
+        if not self.args_schema.__struct_fields__:
+            # Инструмент без аргументов: лишние ключи всё равно отбрасываются - общий экземпляр
+            return _empty_args(self.args_schema)
 
         try:
+            if isinstance(args, (str, bytes)):
+                return _args_decoder(self.args_schema).decode(args)
             return msgspec.convert(args, self.args_schema)
-        except msgspec.ValidationError as e:
+        except msgspec.DecodeError as e:  # ValidationError - его подкласс
             raise ValueError(f"Invalid arguments for tool {self.name}: {e}")
 
     def to_schema(self) -> Dict[str, Any]:
         """
         Convert tool definition to OpenAI function schema.
         """
-        # This is a simplified schema generation. 
-        # For production use, a more robust generation based on msgspec or pydantic is needed.
-        # For now, we will assume args_schema is a msgspec.Struct and inspect it lightly or manual define.
-        # In a real implementation with msgspec, we'd inspect the struct definition.
-        
-        # NOTE: For simplicity in this demo, we might rely on manual schema definition or basic introspection.
-        # We will implement a basic introspection helper later.
         return {
             "type": "function",
             "function": {
                 "name": self.name,
                 "description": self.description,
-                # "parameters": ... # To be implemented via introspection
+                "parameters": _args_json_schema(self.args_schema),
             }
         }
+
+class ThreadedTool(BaseTool[T]):
+    """
+    Инструмент с блокирующим телом (файловый ввод-вывод): _run_sync
+    выполняется в пуле потоков, параллельные вызовы инструментов не
+    выстраиваются в очередь на цикле событий.
+    """
+
+    async def run(self, args: T) -> Any:
+        return await asyncio.to_thread(self._run_sync, args)
+
+    @abstractmethod
+    def _run_sync(self, args: T) -> Any:
+        pass
@@ -1,80 +1,104 @@
 import re
 import ast
-from pathlib import Path
+from collections import deque
+from functools import lru_cache
 import msgspec
 from typing import Dict, Any, List
-from .base import BaseTool
+from .base import ThreadedTool, resolve_path
+
+# Проходы по всему файлу в режиме MULTILINE вместо цикла по строкам. Каждый
+# шаблон берёт первое совпадение в строке, lookahead'ы повторяют прежние
+# проверки подстрок ("class ", "const " + "=>"), [^\S\n] - пробел без перевода строки
+_JS_IMPORT_RE = re.compile(r'^[^\S\n]*((?:import |const (?=.*require\()).*?)[^\S\n]*$', re.M)
+_JS_CLASS_RE = re.compile(r'^(?=.*class ).*?class[^\S\n]+(\w+)', re.M)
+_JS_FUNCTION_RE = re.compile(r'^(?=.*function ).*?function[^\S\n]+(\w+)', re.M)
+_JS_ARROW_RE = re.compile(r'^(?=.*const )(?=.*=>).*?const[^\S\n]+(\w+)[^\S\n]*=', re.M)
+
+_STMT_NODES = (ast.stmt, ast.excepthandler, ast.match_case)
+
+
+def _format_import(node: ast.AST) -> str:
+    """Строка импорта как у ast.unparse, без генерации кода по дереву."""
+    names = ", ".join(f"{a.name} as {a.asname}" if a.asname else a.name for a in node.names)
+    if isinstance(node, ast.Import):
+        return f"import {names}"
+    return f"from {'.' * node.level}{node.module or ''} import {names}"
+
+
+def _analyze_python(content: str) -> Dict[str, Any]:
+    analysis = {'functions': [], 'classes': [], 'imports': []}
+    try:
+        tree = ast.parse(content)
+        # Обход в ширину, как ast.walk, но только по операторам: определения и
+        # импорты бывают лишь там, в выражения (основная масса узлов) не спускаемся
+        queue = deque(tree.body)
+        while queue:
+            node = queue.popleft()
+            if isinstance(node, ast.FunctionDef):
+                analysis['functions'].append(node.name)
+            elif isinstance(node, ast.ClassDef):
+                analysis['classes'].append(node.name)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                analysis['imports'].append(_format_import(node))
+                continue
+            queue.extend(child for child in ast.iter_child_nodes(node) if isinstance(child, _STMT_NODES))
+    except Exception:
+        # Fallback to regex if AST fails
+        pass
+    return analysis
+
+
+def _analyze_js(content: str) -> Dict[str, Any]:
+    # Basic regex, not perfect
+    functions = [(m.start(), 0, m.group(1)) for m in _JS_FUNCTION_RE.finditer(content)]
+    functions += [(m.start(), 1, m.group(1)) for m in _JS_ARROW_RE.finditer(content)]
+    functions.sort()  # порядок строк; в одной строке function раньше стрелочной
+    return {
+        'functions': [name for _, _, name in functions],
+        'classes': [m.group(1) for m in _JS_CLASS_RE.finditer(content)],
+        'imports': [m.group(1) for m in _JS_IMPORT_RE.finditer(content)],
+    }
+
+
+_ANALYZERS = {'.py': _analyze_python, '.js': _analyze_js, '.jsx': _analyze_js, '.ts': _analyze_js, '.tsx': _analyze_js}
+
+
+@lru_cache(maxsize=128)
+def _analyze_file(path: str, ext: str, mtime_ns: int, size: int, ino: int) -> Dict[str, Any]:
+    """
+    Разбор файла с кэшем по (path, mtime_ns, size, inode): повторный анализ
+    неизменённого файла не читает его и не строит AST заново.
+    """
+    with open(path, encoding='utf-8') as f:
+        return _ANALYZERS[ext](f.read())
+
 
 # --- Schemas ---
 
-class CodeAnalysisArgs(msgspec.Struct):
+class CodeAnalysisArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
 
 # --- Tools ---
 
-class CodeAnalysisTool(BaseTool[CodeAnalysisArgs]):
+class CodeAnalysisTool(ThreadedTool[CodeAnalysisArgs]):
     name = "analyze_code"
     description = "Analyze code file structure (functions, classes, imports). Supports Python, JS/TS."
     args_schema = CodeAnalysisArgs
 
-    async def run(self, args: CodeAnalysisArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: File {path} does not exist."
-        
+    def _run_sync(self, args: CodeAnalysisArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            content = path.read_text(encoding='utf-8')
+            st = path.stat()
             ext = path.suffix.lower()
-            
-            analysis = {}
-            if ext == '.py':
-                analysis = self._analyze_python(content)
-            elif ext in ['.js', '.jsx', '.ts', '.tsx']:
-                analysis = self._analyze_js(content)
-            else:
+            if ext not in _ANALYZERS:
                 return f"Analysis not supported for extension {ext}. Supported: .py, .js, .ts"
+            analysis = _analyze_file(str(path), ext, st.st_mtime_ns, st.st_size, st.st_ino)
 
             return f"Code Analysis for {path.name}:\n" + \
                    f"Functions: {len(analysis.get('functions', []))}\n" + \
                    f"Classes: {len(analysis.get('classes', []))}\n" + \
                    f"Imports: {len(analysis.get('imports', []))}\n\nDetails:\n{analysis}"
+        except FileNotFoundError:
+            return f"Error: File {path} does not exist."
         except Exception as e:
             return f"Error analyzing code: {e}"
-
-    def _analyze_python(self, content: str) -> Dict[str, Any]:
-        analysis = {'functions': [], 'classes': [], 'imports': []}
-        try:
-            tree = ast.parse(content)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef):
-                    analysis['functions'].append(node.name)
-                elif isinstance(node, ast.ClassDef):
-                    analysis['classes'].append(node.name)
-                elif isinstance(node, (ast.Import, ast.ImportFrom)):
-                    analysis['imports'].append(ast.unparse(node))
-        except Exception:
-            # Fallback to regex if AST fails
-            pass
-        return analysis
-
-    def _analyze_js(self, content: str) -> Dict[str, Any]:
-        analysis = {'functions': [], 'classes': [], 'imports': []}
-        lines = content.splitlines()
-        for line in lines:
-            line = line.strip()
-            # Basic regex, not perfect
-            if line.startswith('import ') or line.startswith('const ') and 'require(' in line:
-                analysis['imports'].append(line)
-            if 'class ' in line:
-                match = re.search(r'class\s+(\w+)', line)
-                if match:
-                    analysis['classes'].append(match.group(1))
-            if 'function ' in line:
-                match = re.search(r'function\s+(\w+)', line)
-                if match:
-                    analysis['functions'].append(match.group(1))
-            if 'const ' in line and '=>' in line:
-                 match = re.search(r'const\s+(\w+)\s*=', line)
-                 if match:
-                    analysis['functions'].append(match.group(1))
-        return analysis
@@ -1,54 +1,58 @@
 import os
+import re
+import stat
 import shutil
-from typing import List, Optional
+from functools import lru_cache
+from itertools import chain, islice
+from typing import List, Optional, Tuple
 import msgspec
 from pathlib import Path
-from .base import BaseTool
+from .base import ThreadedTool, resolve_path
 
 # --- Schemas ---
 
-class ReadFileArgs(msgspec.Struct):
+class ReadFileArgs(msgspec.Struct, gc=False, frozen=True):
 
     path: str
     start_line: Optional[int] = None
     end_line: Optional[int] = None
     show_line_numbers: bool = False
 
-class WriteFileArgs(msgspec.Struct):
+class WriteFileArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
     content: str
 
-class ListDirectoryArgs(msgspec.Struct):
+class ListDirectoryArgs(msgspec.Struct, gc=False, frozen=True):
     directory: str
     recursive: bool = False
 
-class DeleteFileArgs(msgspec.Struct):
+class DeleteFileArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
     recursive: bool = False
 
-class EditFileArgs(msgspec.Struct):
+class EditFileArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
     old_text: str
     new_text: str
 
-class EditFileByLinesArgs(msgspec.Struct):
+class EditFileByLinesArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
     start_line: int
     end_line: int
     new_content: str
 
-class MultiEditArgs(msgspec.Struct):
+class MultiEditArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
     edits: List[EditFileArgs] # Reuse EditFileArgs structure for simple replacements
 
-class MoveFileArgs(msgspec.Struct):
+class MoveFileArgs(msgspec.Struct, gc=False, frozen=True):
     source: str
     destination: str
 
-class GetFileInfoArgs(msgspec.Struct):
+class GetFileInfoArgs(msgspec.Struct, gc=False, frozen=True):
     path: str
 
-class SearchFilesArgs(msgspec.Struct):
+class SearchFilesArgs(msgspec.Struct, gc=False, frozen=True):
     directory: str
     pattern: str
     recursive: bool = True
@@ -57,39 +61,127 @@ class SearchFilesArgs(msgspec.Struct):
 
 # --- Tools ---
 
-class ReadFileTool(BaseTool[ReadFileArgs]):
+# Common ignored directories
+IGNORED_DIRS = frozenset({".git", ".venv", "venv", "__pycache__", "node_modules", ".mypy_cache", ".pytest_cache", ".idea", ".vscode"})
+
+_SEARCH_LIMIT = 50
+
+# Разделители строк str.splitlines, кроме \n и \r\n, в UTF-8. С ними байтовая
+# склейка edit_file_by_lines разошлась бы с нумерацией строк read_file
+_EXOTIC_EOL_RE = re.compile(rb"\r(?!\n)|[\x0b\x0c\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+
+
+@lru_cache(maxsize=128)
+def _edits_pattern(old_texts: tuple) -> re.Pattern:
+    return re.compile(b"|".join(map(re.escape, old_texts)))
+
+
+def _overlaps(a: bytes, b: bytes) -> bool:
+    """b входит в a или конец a совпадает с началом b."""
+    if b in a:
+        return True
+    p = a.find(b[0], 1)
+    while p != -1:
+        if b.startswith(a[p:]):
+            return True
+        p = a.find(b[0], p + 1)
+    return False
+
+
+def _independent_edits(edits: List[Tuple[bytes, bytes]]) -> bool:
+    """
+    Замены не влияют друг на друга: ни одна не создаёт и не разрушает
+    вхождения другой old_text. Тогда последовательные replace равны
+    одному проходу по исходному тексту. Удаление (пустой new_text) склеивает
+    соседний текст файла - такие правки не считаются независимыми.
+    """
+    olds = [old for old, _ in edits]
+    if not all(olds) or not all(new for _, new in edits) or len(set(olds)) != len(olds):
+        return False
+    for i, (old_i, new_i) in enumerate(edits):
+        for j, old in enumerate(olds):
+            if i != j and (_overlaps(old_i, old) or _overlaps(old, old_i)
+                           or _overlaps(new_i, old) or _overlaps(old, new_i)):
+                return False
+    return True
+
+
+def _apply_edits(data: bytes, edits: List[Tuple[bytes, bytes]]) -> Tuple[bytes, Optional[int]]:
+    """
+    Последовательные замены (old, new) над байтами файла - без декодирования
+    UTF-8 туда и обратно. Возвращает (результат, номер первой не найденной правки).
+    """
+    if len(edits) > 1 and _independent_edits(edits):
+        # Один проход альтернацией по всем old_text вместо N проверок и N replace
+        mapping = dict(edits)
+        found = set()
+
+        def _sub(m: re.Match) -> bytes:
+            found.add(m.group(0))
+            return mapping[m.group(0)]
+
+        data = _edits_pattern(tuple(mapping)).sub(_sub, data)
+        for i, (old, _) in enumerate(edits):
+            if old not in found:
+                return data, i
+        return data, None
+    for i, (old, new) in enumerate(edits):
+        if old not in data:
+            return data, i
+        data = data.replace(old, new)
+    return data, None
+
+
+def _apply_text_edits(path: Path, edits: List[EditFileArgs]) -> Tuple[str, str, Optional[int]]:
+    """
+    Прежний путь через текстовый режим: универсальные переводы строк, old_text
+    с \n находит CRLF в файле. Для файлов с \r и пустого old_text (в байтах
+    он разрезал бы многобайтные символы).
+    """
+    content = original = path.read_text(encoding="utf-8")
+    for i, edit in enumerate(edits):
+        if edit.old_text not in content:
+            return original, content, i
+        content = content.replace(edit.old_text, edit.new_text)
+    return original, content, None
+
+
+class ReadFileTool(ThreadedTool[ReadFileArgs]):
     name = "read_file"
     description = "Read content from a file. Can read specific lines."
     args_schema = ReadFileArgs
 
-    async def run(self, args: ReadFileArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: File {path} does not exist."
-        
+    def _run_sync(self, args: ReadFileArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            content = path.read_text(encoding="utf-8")
-            lines = content.splitlines()
-            
             start = (args.start_line - 1) if args.start_line else 0
-            end = args.end_line if args.end_line else len(lines)
-            
-            selected_lines = lines[start:end]
+            end = args.end_line
+            if (args.start_line or end) and start >= 0 and (end is None or end >= 0):
+                # Диапазон строк читается потоком - без загрузки всего файла в память
+                # (строки - по тем же правилам, что str.splitlines у полного чтения)
+                with path.open("r", encoding="utf-8") as f:
+                    selected_lines = list(islice(chain.from_iterable(map(str.splitlines, f)),
+                                                 start, end or None))
+            else:
+                lines = path.read_text(encoding="utf-8").splitlines()
+                selected_lines = lines[start:end if end else len(lines)]
             
             if args.show_line_numbers:
                 return "\n".join([f"{i+1+start} | {line}" for i, line in enumerate(selected_lines)])
             
             return "\n".join(selected_lines)
+        except FileNotFoundError:
+            return f"Error: File {path} does not exist."
         except Exception as e:
             return f"Error reading file: {e}"
 
-class WriteFileTool(BaseTool[WriteFileArgs]):
+class WriteFileTool(ThreadedTool[WriteFileArgs]):
     name = "write_file"
     description = "Write content to a file. Creates directories if needed."
     args_schema = WriteFileArgs
 
-    async def run(self, args: WriteFileArgs) -> str:
-        path = Path(args.path).resolve()
+    def _run_sync(self, args: WriteFileArgs) -> str:
+        path = resolve_path(args.path)
         try:
             path.parent.mkdir(parents=True, exist_ok=True)
             path.write_text(args.content, encoding="utf-8")
@@ -97,66 +189,55 @@ class WriteFileTool(BaseTool[WriteFileArgs]):
         except Exception as e:
             return f"Error writing file: {e}"
 
-class ListDirectoryTool(BaseTool[ListDirectoryArgs]):
+class ListDirectoryTool(ThreadedTool[ListDirectoryArgs]):
     name = "list_directory"
     description = "List files and directories."
     args_schema = ListDirectoryArgs
 
-    async def run(self, args: ListDirectoryArgs) -> str:
-        root = Path(args.directory).resolve()
+    def _run_sync(self, args: ListDirectoryArgs) -> str:
+        root = resolve_path(args.directory)
         if not root.exists():
             return f"Error: Directory {root} does not exist."
         
         try:
             entries = []
             
-            # Common ignored directories
-            IGNORED_DIRS = {".git", ".venv", "venv", "__pycache__", "node_modules", ".mypy_cache", ".pytest_cache", ".idea", ".vscode"}
-            
             if args.recursive:
-                count = 0
-                for path in root.rglob("*"):
-                    try:
-                        rel_path = path.relative_to(root)
-                        if any(part in IGNORED_DIRS for part in rel_path.parts):
-                            continue
-                    except ValueError:
-                        continue 
-
-                    prefix = "📁 " if path.is_dir() else "📄 "
-                    indent = "    " * (len(rel_path.parts) - 1)
-                    entries.append(f"{indent}{prefix}{path.name}")
-                    
-                    count += 1
-                    if count > 1000:
+                # os.walk с отсечением игнорируемых каталогов - в node_modules/.git даже не заходим
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+                    depth = 0 if dirpath == str(root) else os.path.relpath(dirpath, root).count(os.sep) + 1
+                    indent = "    " * depth
+                    entries.extend(f"{indent}📁 {name}" for name in dirnames)
+                    entries.extend(f"{indent}📄 {name}" for name in filenames)
+                    if len(entries) > 1000:
+                        del entries[1001:]
                         entries.append("... (truncated: too many files)")
                         break
             else:
-                for path in sorted(root.iterdir()):
-                    if path.name in IGNORED_DIRS:
-                        continue
-                    prefix = "📁 " if path.is_dir() else "📄 "
-                    entries.append(f"{prefix}{path.name}")
+                # DirEntry.is_dir() берёт тип из readdir - без Path и stat на каждый элемент
+                with os.scandir(root) as it:
+                    listed = sorted((e for e in it if e.name not in IGNORED_DIRS), key=lambda e: e.name)
+                entries = [f"{'📁 ' if e.is_dir() else '📄 '}{e.name}" for e in listed]
             
             return "\n".join(entries)
         except Exception as e:
             return f"Error listing directory: {e}"
 
-class DeleteFileTool(BaseTool[DeleteFileArgs]):
+class DeleteFileTool(ThreadedTool[DeleteFileArgs]):
     name = "delete_file"
     description = "Delete a file or directory."
     args_schema = DeleteFileArgs
 
-    async def run(self, args: DeleteFileArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: Path {path} does not exist."
-        
+    def _run_sync(self, args: DeleteFileArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            if path.is_file():
+            # Один stat вместо exists() + is_file() + is_dir()
+            mode = path.stat().st_mode
+            if stat.S_ISREG(mode):
                 path.unlink()
                 return f"Successfully deleted file: {path}"
-            elif path.is_dir():
+            elif stat.S_ISDIR(mode):
                 if args.recursive:
                     shutil.rmtree(path)
                     return f"Successfully deleted directory: {path}"
@@ -164,72 +245,104 @@ class DeleteFileTool(BaseTool[DeleteFileArgs]):
                     path.rmdir()
                     return f"Successfully deleted directory: {path}"
             return "Error: Unknown path type"
+        except FileNotFoundError:
+            return f"Error: Path {path} does not exist."
         except Exception as e:
             return f"Error deleting: {e}"
 
-class EditFileTool(BaseTool[EditFileArgs]):
+class EditFileTool(ThreadedTool[EditFileArgs]):
     name = "edit_file"
     description = "Edit a file by replacing text."
     args_schema = EditFileArgs
 
-    async def run(self, args: EditFileArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: File {path} does not exist."
-        
+    def _run_sync(self, args: EditFileArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            content = path.read_text(encoding="utf-8")
-            if args.old_text not in content:
-                # Try with normalized newlines if exact match fails?
-                # For now simple string replace
-                return f"Error: old_text not found in {path}"
-            
-            new_content = content.replace(args.old_text, args.new_text)
-            path.write_text(new_content, encoding="utf-8")
+            data = path.read_bytes()
+            old = args.old_text.encode("utf-8")
+            if old and b"\r" not in data:
+                if old not in data:
+                    return f"Error: old_text not found in {path}"
+                path.write_bytes(data.replace(old, args.new_text.encode("utf-8")))
+            else:
+                _, new_content, missing = _apply_text_edits(path, [args])
+                if missing is not None:
+                    return f"Error: old_text not found in {path}"
+                path.write_text(new_content, encoding="utf-8")
             return f"Successfully edited {path}"
+        except FileNotFoundError:
+            return f"Error: File {path} does not exist."
         except Exception as e:
             return f"Error editing file: {e}"
 
-class EditFileByLinesTool(BaseTool[EditFileByLinesArgs]):
+class EditFileByLinesTool(ThreadedTool[EditFileByLinesArgs]):
     name = "edit_file_by_lines"
     description = "Replace a range of lines in a file with new content."
     args_schema = EditFileByLinesArgs
 
-    async def run(self, args: EditFileByLinesArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: File {path} does not exist."
-        
+    def _run_sync(self, args: EditFileByLinesArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            content = path.read_text(encoding="utf-8")
-            lines = content.splitlines()
-            total_lines = len(lines)
+            # Склейка по байтовым смещениям строк: без splitlines/join всего файла,
+            # CRLF и завершающий перевод строки сохраняются
+            data = path.read_bytes()
+            if _EXOTIC_EOL_RE.search(data):
+                return self._edit_text(path, args)
+            total_lines = data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
             
             # Validate lines
             if args.start_line < 1 or args.end_line > total_lines or args.start_line > args.end_line:
                 return f"Error: Invalid line range {args.start_line}-{args.end_line} (File has {total_lines} lines)"
 
-            new_lines_content = args.new_content.splitlines()
-            
-            # Replace lines
-            # start_line is 1-based, so index is start_line-1
-            # splice: lines[:start-1] + new + lines[end:]
+            pos = 0
+            for _ in range(args.start_line - 1):
+                pos = data.index(b"\n", pos) + 1
+            prefix_end = pos
+            for _ in range(args.end_line - args.start_line + 1):
+                nl = data.find(b"\n", pos)
+                pos = nl + 1 if nl != -1 else len(data)
+            suffix_start = pos
             
-            result_lines = lines[:args.start_line-1] + new_lines_content + lines[args.end_line:]
+            new_lines_content = args.new_content.splitlines()
+            if new_lines_content:
+                eol = b"\r\n" if data[suffix_start - 2:suffix_start] == b"\r\n" else b"\n"
+                new_bytes = eol.join(line.encode("utf-8") for line in new_lines_content)
+                # Перевод строки в конце - только если он был у заменённого диапазона
+                if data[suffix_start - 1:suffix_start] == b"\n":
+                    new_bytes += eol
+            else:
+                new_bytes = b""
             
-            path.write_text("\n".join(result_lines), encoding="utf-8")
+            path.write_bytes(data[:prefix_end] + new_bytes + data[suffix_start:])
             return f"Successfully edited lines {args.start_line}-{args.end_line} in {path}"
+        except FileNotFoundError:
+            return f"Error: File {path} does not exist."
         except Exception as e:
             return f"Error editing lines: {e}"
 
-class MoveFileTool(BaseTool[MoveFileArgs]):
+    @staticmethod
+    def _edit_text(path: Path, args: EditFileByLinesArgs) -> str:
+        # Файл с \r, \f, U+2028 и т.п.: строки режутся splitlines, как в read_file
+        content = path.read_text(encoding="utf-8")
+        lines = content.splitlines()
+        total_lines = len(lines)
+        if args.start_line < 1 or args.end_line > total_lines or args.start_line > args.end_line:
+            return f"Error: Invalid line range {args.start_line}-{args.end_line} (File has {total_lines} lines)"
+        result_lines = lines[:args.start_line - 1] + args.new_content.splitlines() + lines[args.end_line:]
+        text = "\n".join(result_lines)
+        if result_lines and content.splitlines(keepends=True)[-1] != lines[-1]:
+            text += "\n"  # завершающий перевод строки сохраняется, как в байтовой ветке
+        path.write_text(text, encoding="utf-8")
+        return f"Successfully edited lines {args.start_line}-{args.end_line} in {path}"
+
+class MoveFileTool(ThreadedTool[MoveFileArgs]):
     name = "move_file"
     description = "Move or rename a file or directory."
     args_schema = MoveFileArgs
 
-    async def run(self, args: MoveFileArgs) -> str:
-        src = Path(args.source).resolve()
-        dst = Path(args.destination).resolve()
+    def _run_sync(self, args: MoveFileArgs) -> str:
+        src = resolve_path(args.source)
+        dst = resolve_path(args.destination)
         
         if not src.exists():
             return f"Error: Source {src} does not exist."
@@ -241,73 +354,73 @@ class MoveFileTool(BaseTool[MoveFileArgs]):
         except Exception as e:
             return f"Error moving file: {e}"
 
-class GetFileInfoTool(BaseTool[GetFileInfoArgs]):
+class GetFileInfoTool(ThreadedTool[GetFileInfoArgs]):
     name = "get_file_info"
     description = "Get information about a file or directory."
     args_schema = GetFileInfoArgs
 
-    async def run(self, args: GetFileInfoArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: Path {path} does not exist."
-        
+    def _run_sync(self, args: GetFileInfoArgs) -> str:
+        path = resolve_path(args.path)
         try:
+            # Один stat вместо exists() + stat() + is_dir()
             stats = path.stat()
-            type_str = "Directory" if path.is_dir() else "File"
+            type_str = "Directory" if stat.S_ISDIR(stats.st_mode) else "File"
             size_str = f"{stats.st_size} bytes"
             return f"Path: {path}\nType: {type_str}\nSize: {size_str}\nPermissions: {oct(stats.st_mode)[-3:]}"
+        except FileNotFoundError:
+            return f"Error: Path {path} does not exist."
         except Exception as e:
             return f"Error getting info: {e}"
 
-class SearchFilesTool(BaseTool[SearchFilesArgs]):
+class SearchFilesTool(ThreadedTool[SearchFilesArgs]):
     name = "search_files"
     description = "Search for files searching the pattern in the name."
     args_schema = SearchFilesArgs
 
-    async def run(self, args: SearchFilesArgs) -> str:
-        root = Path(args.directory).resolve()
+    def _run_sync(self, args: SearchFilesArgs) -> str:
+        root = resolve_path(args.directory)
         if not root.exists():
             return f"Error: Directory {root} does not exist."
         
         try:
-            results = []
-            if args.recursive:
-                for path in root.rglob(args.pattern):
-                    results.append(str(path))
-            else:
-                for path in root.glob(args.pattern):
-                    results.append(str(path))
+            # glob - ленивый генератор: обход останавливается на лимите,
+            # а не собирает все совпадения ради первых _SEARCH_LIMIT
+            found = root.rglob(args.pattern) if args.recursive else root.glob(args.pattern)
+            results = [str(path) for path in islice(found, _SEARCH_LIMIT)]
             
             if not results:
                 return "No files found."
-            return "\n".join(results[:50]) # Limit to 50
+            return "\n".join(results)
         except Exception as e:
             return f"Error searching files: {e}"
 
-class MultiEditFileTool(BaseTool[MultiEditArgs]):
+class MultiEditFileTool(ThreadedTool[MultiEditArgs]):
     name = "multi_edit_file"
     description = "Perform multiple text replacements in a single file."
     args_schema = MultiEditArgs
 
-    async def run(self, args: MultiEditArgs) -> str:
-        path = Path(args.path).resolve()
-        if not path.exists():
-            return f"Error: File {path} does not exist."
-        
+    def _run_sync(self, args: MultiEditArgs) -> str:
+        path = resolve_path(args.path)
         try:
-            content = path.read_text(encoding="utf-8")
-            original_content = content
-            
-            for edit in args.edits:
-                if edit.old_text not in content:
-                    return f"Error: old_text '{edit.old_text}' not found (aborted all edits)"
-                content = content.replace(edit.old_text, edit.new_text)
-            
-            if content == original_content:
-                return "Warning: No changes made"
-            
-            path.write_text(content, encoding="utf-8")
+            data = path.read_bytes()
+            edits = [(e.old_text.encode("utf-8"), e.new_text.encode("utf-8")) for e in args.edits]
+            if all(old for old, _ in edits) and b"\r" not in data:
+                new_data, missing = _apply_edits(data, edits)
+                if missing is not None:
+                    return f"Error: old_text '{args.edits[missing].old_text}' not found (aborted all edits)"
+                if new_data == data:
+                    return "Warning: No changes made"
+                path.write_bytes(new_data)
+            else:
+                original_content, content, missing = _apply_text_edits(path, args.edits)
+                if missing is not None:
+                    return f"Error: old_text '{args.edits[missing].old_text}' not found (aborted all edits)"
+                if content == original_content:
+                    return "Warning: No changes made"
+                path.write_text(content, encoding="utf-8")
             return f"Successfully applied {len(args.edits)} edits to {path}"
+        except FileNotFoundError:
+            return f"Error: File {path} does not exist."
         except Exception as e:
             return f"Error applying multi-edits: {e}"
 
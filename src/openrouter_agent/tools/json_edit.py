@@ -1,14 +1,59 @@
 import json
-from pathlib import Path
+from functools import lru_cache
 import msgspec
 from typing import Any, Optional, Literal
 from jsonpath_ng import parse as jsonpath_parse
+from jsonpath_ng.jsonpath import Fields, Index
 from jsonpath_ng.exceptions import JSONPathError
-from .base import BaseTool
+from openrouter_agent.utils import json_dumpb
+from .base import ThreadedTool, resolve_path
+
+
+@lru_cache(maxsize=512)
+def _parse_jsonpath(json_path: str):
+    # Парсер jsonpath-ng тяжёлый (PLY), а агент часто правит одни и те же пути
+    return jsonpath_parse(json_path)
+
+
+def _dumpb(data: Any, indent: Optional[int], nonfinite: bool) -> bytes:
+    # msgspec пишет NaN/Infinity как null - такой файл сериализует stdlib json,
+    # иначе правка одного ключа молча портила бы остальные значения
+    if nonfinite:
+        return json.dumps(data, indent=indent, ensure_ascii=False).encode("utf-8")
+    return json_dumpb(data, indent)
+
+
+def _remove_matches(matches) -> Optional[str]:
+    """
+    Удаляет совпадения из их родительских контейнеров на месте.
+    Ключи собираются по родителям заранее, индексы списков удаляются по
+    убыванию - иначе каждое удаление сдвигает ещё не удалённые элементы.
+    Возвращает текст ошибки или None.
+    """
+    targets = {}  # id(parent) -> (parent, set(keys))
+    for match in matches:
+        parent = match.context.value if match.context is not None else None
+        if isinstance(match.path, Fields) and isinstance(parent, dict):
+            keys = match.path.fields
+        elif isinstance(match.path, Index) and isinstance(parent, list):
+            # indices (несколько индексов в одном Index) есть только в новых jsonpath-ng
+            indices = getattr(match.path, "indices", None) or (match.path.index,)
+            keys = tuple(i % len(parent) for i in indices if -len(parent) <= i < len(parent))
+        else:
+            return "Error: Cannot remove the root document or a computed value."
+        targets.setdefault(id(parent), (parent, set()))[1].update(keys)
+    for parent, keys in targets.values():
+        if isinstance(parent, list):
+            for i in sorted(keys, reverse=True):
+                del parent[i]
+        else:
+            for key in keys:
+                parent.pop(key, None)
+    return None
 
 # --- Schemas ---
 
-class JSONEditArgs(msgspec.Struct):
+class JSONEditArgs(msgspec.Struct, gc=False, frozen=True):
     operation: Literal["view", "set", "add", "remove"]
     file_path: str
     json_path: Optional[str] = None
@@ -17,22 +62,28 @@ class JSONEditArgs(msgspec.Struct):
 
 # --- Tools ---
 
-class JSONEditTool(BaseTool[JSONEditArgs]):
+class JSONEditTool(ThreadedTool[JSONEditArgs]):
     name = "json_edit"
     description = "Precise JSON editing using JSONPath. Operations: view, set, add, remove."
     args_schema = JSONEditArgs
 
-    async def run(self, args: JSONEditArgs) -> str:
+    def _run_sync(self, args: JSONEditArgs) -> str:
         try:
-            path = Path(args.file_path).resolve()
-            if not path.exists():
-                return f"Error: File {path} does not exist."
+            path = resolve_path(args.file_path)
             
             # Load JSON
             try:
-                content = path.read_text(encoding='utf-8')
-                data = json.loads(content)
-            except json.JSONDecodeError as e:
+                raw = path.read_bytes()
+                nonfinite = False
+                try:
+                    data = msgspec.json.decode(raw)
+                except msgspec.DecodeError:
+                    # NaN/Infinity msgspec не принимает - разбирает stdlib json
+                    data = json.loads(raw)
+                    nonfinite = True
+            except FileNotFoundError:
+                return f"Error: File {path} does not exist."
+            except ValueError as e:
                 return f"Error decoding JSON file: {e}"
 
             # Validate input
@@ -42,17 +93,17 @@ class JSONEditTool(BaseTool[JSONEditArgs]):
             if args.operation == "view":
                 if args.json_path:
                     try:
-                        expr = jsonpath_parse(args.json_path)
+                        expr = _parse_jsonpath(args.json_path)
                         matches = [match.value for match in expr.find(data)]
-                        return json.dumps(matches, indent=2 if args.pretty_print else None)
+                        return _dumpb(matches, 2 if args.pretty_print else None, nonfinite).decode("utf-8")
                     except Exception as e:
                         return f"Error parsing/executing JSONPath: {e}"
                 else:
-                    return json.dumps(data, indent=2 if args.pretty_print else None)
+                    return _dumpb(data, 2 if args.pretty_print else None, nonfinite).decode("utf-8")
 
             # Operations requiring path
             try:
-                expr = jsonpath_parse(args.json_path)
+                expr = _parse_jsonpath(args.json_path)
             except Exception as e:
                 return f"Invalid JSONPath: {e}"
 
@@ -85,22 +136,15 @@ class JSONEditTool(BaseTool[JSONEditArgs]):
                          return f"Error: Cannot add to type {type(match.value)}"
 
             elif args.operation == "remove":
-                # JSONPath remove is not standard.
-                # Simplified removal: find matches and delete them from parent.
-                # This is hard with just jsonpath-ng find. 
-                # Re-implementing full logic is complex. 
-                # For this iteration, we will implement a basic version:
-                # If path parses to a specific key in a dict or index in a list, remove it.
-                # BUT jsonpath-ng 'find' returns the value, not the reference to container easily.
-                # We will use a workaround: filter out the matches.
-                pass 
-                # Actually, proper implementation of remove/add with jsonpath is heavy.
-                # Let's fallback to 'set' and 'view' as primary reliable features for now,
-                # or implement a simpler version of remove/add if specific path.
-                return "Error: 'remove' operation not fully supported in this lightweight version yet. Use 'set' to nullify or read -> modify in python -> write."
+                matches = expr.find(data)
+                if not matches:
+                    return f"Error: JSONPath '{args.json_path}' matched nothing to remove."
+                error = _remove_matches(matches)
+                if error:
+                    return error
 
             # Save
-            path.write_text(json.dumps(data, indent=2 if args.pretty_print else None), encoding='utf-8')
+            path.write_bytes(_dumpb(data, 2 if args.pretty_print else None, nonfinite))
             return f"Operation {args.operation} completed successfully."
 
         except Exception as e:
@@ -4,7 +4,7 @@ from .base import BaseTool
 
 # --- Schemas ---
 
-class SequentialThinkingArgs(msgspec.Struct):
+class SequentialThinkingArgs(msgspec.Struct, gc=False, frozen=True):
     thought: str
     thought_number: int
     total_thoughts: int
@@ -27,20 +27,10 @@ class SequentialThinkingTool(BaseTool[SequentialThinkingArgs]):
         # For this CLI agent, we echo the thought structure back to the LLM 
         # so it remains in the context window and 'forces' the model to process it.
         
-        output = [
-            f"THOUGHT {args.thought_number}/{args.total_thoughts}",
-            f"Content: {args.thought}"
-        ]
-        
-        if args.is_revision:
-            output.append(f"(Revision of thought {args.revises_thought})")
-        
-        if args.branch_from_thought:
-            output.append(f"(Branch from thought {args.branch_from_thought}, ID: {args.branch_id})")
-            
-        if args.next_thought_needed:
-            output.append("Status: Thinking process continues...")
-        else:
-            output.append("Status: Thinking process complete.")
-            
-        return "\n".join(output)
+        revision = f"\n(Revision of thought {args.revises_thought})" if args.is_revision else ""
+        branch = (f"\n(Branch from thought {args.branch_from_thought}, ID: {args.branch_id})"
+                  if args.branch_from_thought else "")
+        status = "continues..." if args.next_thought_needed else "complete."
+        return (f"THOUGHT {args.thought_number}/{args.total_thoughts}\n"
+                f"Content: {args.thought}{revision}{branch}\n"
+                f"Status: Thinking process {status}")
@@ -1,14 +1,14 @@
 import os
-import subprocess
+import asyncio
 import msgspec
 from typing import Optional
 from .base import BaseTool
 
-class ExecuteCommandArgs(msgspec.Struct):
+class ExecuteCommandArgs(msgspec.Struct, gc=False, frozen=True):
     command: str
     cwd: Optional[str] = None
 
-class GetCurrentDirectoryArgs(msgspec.Struct):
+class GetCurrentDirectoryArgs(msgspec.Struct, gc=False, frozen=True):
     pass
 
 class ExecuteCommandTool(BaseTool[ExecuteCommandArgs]):
@@ -19,21 +19,23 @@ class ExecuteCommandTool(BaseTool[ExecuteCommandArgs]):
     async def run(self, args: ExecuteCommandArgs) -> str:
         cwd = args.cwd if args.cwd else os.getcwd()
         try:
-            # Capture both stdout and stderr
-            result = subprocess.run(
-                args.command, 
-                shell=True, 
-                cwd=cwd, 
-                text=True, 
-                capture_output=True,
-                timeout=60 # Default timeout 60s
+            # Capture both stdout and stderr; процесс не блокирует цикл событий
+            proc = await asyncio.create_subprocess_shell(
+                args.command,
+                cwd=cwd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
             )
-            output = result.stdout
-            if result.stderr:
-                output += f"\nstderr:\n{result.stderr}"
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=60) # Default timeout 60s
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return "Error: Command timed out"
+            output = stdout.decode(errors="replace")
+            if stderr:
+                output += f"\nstderr:\n{stderr.decode(errors='replace')}"
             return output if output.strip() else "(no output)"
-        except subprocess.TimeoutExpired:
-            return "Error: Command timed out"
         except Exception as e:
             return f"Error executing command: {e}"
 
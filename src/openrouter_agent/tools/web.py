@@ -1,15 +1,78 @@
-import requests
+import re
+import importlib.util
 import msgspec
 from typing import Dict, Any, Optional
 from .base import BaseTool
 
+_SCRIPT_RE = re.compile(r'<script[^>]*>.*?</script>', re.DOTALL | re.IGNORECASE)
+_STYLE_RE = re.compile(r'<style[^>]*>.*?</style>', re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
+
+_BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+_CLIENT: Optional["httpx.AsyncClient"] = None
+
+# Сколько байт тела читать: 20000 символов сырого ответа - это не больше 80 КБ UTF-8;
+# из HTML после удаления разметки нужно 10000 символов текста - с большим запасом
+_RAW_MAX_BYTES = 20000 * 4
+_HTML_MAX_BYTES = 1 << 20
+
+
+def _client() -> "httpx.AsyncClient":
+    """
+    Общий httpx-клиент веб-инструментов: keep-alive пул (HTTP/2, если
+    установлен h2), запросы не блокируют цикл событий и не открывают
+    TCP+TLS заново на каждый вызов.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        import httpx  # только при первом веб-запросе, не при загрузке реестра
+        _CLIENT = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=30.0),
+            follow_redirects=True,
+        )
+    return _CLIENT
+
+
+async def close_client() -> None:
+    """Закрывает общий клиент и его пул соединений (при остановке сервера)."""
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None:
+        await client.aclose()
+
+
+try:
+    # lexbor (C) разбирает HTML за один проход; без пакета - регэкспы ниже
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+
+def _html_to_text(html: str) -> str:
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        for node in tree.css('script, style'):
+            node.decompose()
+        if tree.root is None:
+            return ''
+        return _SPACE_RE.sub(' ', tree.root.text(separator=' ')).strip()
+    text = _SCRIPT_RE.sub('', html)
+    text = _STYLE_RE.sub('', text)
+    text = _TAG_RE.sub(' ', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
 # --- Schemas ---
 
-class WebFetchArgs(msgspec.Struct):
+class WebFetchArgs(msgspec.Struct, gc=False, frozen=True):
     url: str
     extract_text: bool = True
 
-class WebAPIArgs(msgspec.Struct):
+class WebAPIArgs(msgspec.Struct, gc=False, frozen=True):
     url: str
     method: str = "GET"
     data: Optional[Dict[str, Any]] = None
@@ -25,24 +88,23 @@ class WebFetchTool(BaseTool[WebFetchArgs]):
 
     async def run(self, args: WebFetchArgs) -> str:
         try:
-            # Mimic browser
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(args.url, headers=headers, timeout=30)
-            response.raise_for_status()
-
-            if args.extract_text and 'text/html' in response.headers.get('Content-Type', ''):
-                # Basic text extraction (removing tags)
-                import re
-                text = response.text
-                text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL | re.IGNORECASE)
-                text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL | re.IGNORECASE)
-                text = re.sub(r'<[^>]+>', ' ', text)
-                text = re.sub(r'\s+', ' ', text).strip()
+            # Mimic browser; тело читается потоком и только до лимита
+            async with _client().stream("GET", args.url, headers=_BROWSER_HEADERS, timeout=30) as response:
+                response.raise_for_status()
+                is_html = args.extract_text and 'text/html' in response.headers.get('Content-Type', '')
+                limit = _HTML_MAX_BYTES if is_html else _RAW_MAX_BYTES
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) >= limit:
+                        break
+                content = body.decode(response.encoding or 'utf-8', errors='replace')
+
+            if is_html:
+                text = _html_to_text(content)
                 return f"URL: {args.url}\n\nContent:\n{text[:10000]}..." if len(text) > 10000 else f"URL: {args.url}\n\nContent:\n{text}"
             
-            return response.text[:20000] # Limit raw content
+            return content[:20000] # Limit raw content
         except Exception as e:
             return f"Error fetching URL: {e}"
 
@@ -53,7 +115,7 @@ class WebAPITool(BaseTool[WebAPIArgs]):
 
     async def run(self, args: WebAPIArgs) -> str:
         try:
-            response = requests.request(
+            response = await _client().request(
                 method=args.method,
                 url=args.url,
                 json=args.data,
@@ -1,29 +1,47 @@
 import os
+import re
+import copy
+import asyncio
 import json
+import time
+import uuid
+import hashlib
 import logging
-from typing import Any, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional
 from difflib import unified_diff
+import msgspec
 import yaml
 
 log = logging.getLogger(__name__)
 
+# libyaml (C) в 3-10 раз быстрее чистого Python; без него - обычные классы
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+_YAML_DUMP_KW = dict(allow_unicode=True, default_flow_style=False, sort_keys=False, indent=2, width=120)
 
-def find_balanced_json(text: str) -> Optional[str]:
-    start = text.find("{")
-    if start == -1:
-        return None
+
+_JSON_SCAN_RE = re.compile(r'[{}"\\]')
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def _scan_balanced(text: str, start: int) -> Optional[str]:
+    # Прыгаем регэкспом только по значимым символам вместо посимвольного цикла
     depth = 0
     in_string = False
-    esc = False
-    for i in range(start, len(text)):
+    esc_at = -1
+    for m in _JSON_SCAN_RE.finditer(text, start):
+        i = m.start()
         ch = text[i]
-        if ch == '"' and not esc:
-            in_string = not in_string
-        if ch == "\\" and not esc:
-            esc = True
+        escaped = i == esc_at
+        if ch == '"':
+            if not escaped:
+                in_string = not in_string
+        elif ch == "\\" and not escaped:
+            esc_at = i + 1
             continue
-        else:
-            esc = False
         if not in_string:
             if ch == "{":
                 depth += 1
@@ -34,49 +52,332 @@ def find_balanced_json(text: str) -> Optional[str]:
     return None
 
 
+def find_balanced_json(text: str) -> Optional[str]:
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        # Валидный JSON (обычный случай) размечает C-сканер stdlib
+        _, end = _raw_decode(text, start)
+        return text[start:end]
+    except ValueError:
+        return _scan_balanced(text, start)
+
+
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*\n(.*?)\n\s*```", re.S)
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """
+    Первый JSON-объект из ответа LLM уже разобранным - без повторного
+    парсинга найденной подстроки. None, если объекта нет или он невалиден.
+    Обычный ответ (голый JSON или JSON в ```json-блоке) целиком разбирает
+    msgspec; поиск объекта внутри текста - только если так не вышло.
+    """
+    body = text.strip()
+    if body.startswith("```"):
+        m = _JSON_FENCE_RE.match(body)
+        if m:
+            body = m.group(1).strip()
+    if body.startswith("{"):
+        try:
+            return _json_decode(body)
+        except msgspec.DecodeError:
+            pass
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        return _raw_decode(text, start)[0]
+    except ValueError:
+        js = _scan_balanced(text, start)
+        if not js:
+            return None
+        try:
+            return json_loads(js)
+        except ValueError:
+            return None
+
+
+_json_decode = msgspec.json.Decoder().decode
+_json_encode = msgspec.json.Encoder().encode
+
+
+def json_loads(data: Any) -> Any:
+    """Быстрый разбор JSON через msgspec; нестандартный JSON (NaN, Infinity) - через stdlib."""
+    try:
+        return _json_decode(data)
+    except msgspec.DecodeError:
+        return json.loads(data)
+
+
+def json_dumpb(data: Any, indent: Optional[int] = None) -> bytes:
+    """json_dumps сразу в UTF-8 байты - для записи в файл без лишнего decode/encode."""
+    try:
+        raw = _json_encode(data)
+    except TypeError:
+        return json.dumps(data, indent=indent, ensure_ascii=False).encode("utf-8")
+    return msgspec.json.format(raw, indent=indent) if indent else raw
+
+
+def json_dumps(data: Any, indent: Optional[int] = None) -> str:
+    """
+    Сериализация JSON через msgspec (UTF-8 без экранирования, как ensure_ascii=False).
+    Типы, которые msgspec не знает, уходят в stdlib json.
+    """
+    return json_dumpb(data, indent).decode("utf-8")
+
+
 def load_json(path: str, default: Any = None) -> Any:
-    if not os.path.exists(path):
-        return default
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return json_loads(f.read())
+    except FileNotFoundError:
+        return default
     except Exception as e:
         log.warning(f"load_json error {path}: {e}")
         return default
 
 
+def _open_write(path: str, mode: str, **kwargs):
+    """open() на запись; каталог создаётся только если его нет (без лишнего stat на каждую запись)."""
+    try:
+        return open(path, mode, **kwargs)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return open(path, mode, **kwargs)
+
+
+@contextmanager
+def _atomic_open(path: str, mode: str, **kwargs):
+    """
+    Файл для атомарной записи: временный файл рядом с path, по выходу -
+    os.replace. Имя временного файла уникально, так что параллельные
+    писатели одного path не смешивают байты; при ошибке он удаляется.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex[:12]}.tmp"
+    try:
+        with _open_write(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_text(path: str, text: str, encoding: str = "utf-8") -> None:
+    """Пишет во временный файл и подменяет целевой через os.replace - без порванных файлов при сбое."""
+    with _atomic_open(path, "w", encoding=encoding) as f:
+        f.write(text)
+
+
+def write_if_changed(path: str, text: str, encoding: str = "utf-8") -> bool:
+    """Атомарно пишет text, только если содержимое файла отличается. True - если писали."""
+    payload = text.encode(encoding)
+    try:
+        if os.path.getsize(path) == len(payload):
+            with open(path, "rb") as f:
+                if f.read() == payload:
+                    return False
+    except OSError:
+        pass
+    with _atomic_open(path, "wb") as f:
+        f.write(payload)
+    return True
+
+
+def atomic_write_lines(path: str, lines: Iterable[str], encoding: str = "utf-8") -> None:
+    """
+    Как atomic_write_text("\\n".join(lines)), но строки пишутся в файл по мере
+    генерации, без сборки всего документа в памяти.
+    """
+    with _atomic_open(path, "w", encoding=encoding, buffering=1 << 16) as f:
+        write = f.write
+        it = iter(lines)
+        for first in it:
+            write(first)
+            break
+        for line in it:
+            write("\n")
+            write(line)
+
+
 def save_json(path: str, data: Any) -> None:
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    with _atomic_open(path, "wb") as f:
+        f.write(json_dumpb(data, indent=2))
+
+
+def append_json_lines(path: str, items: Iterable[Any]) -> None:
+    """Дописывает элементы в конец файла, по одному JSON на строку."""
+    text = "".join(json_dumps(item) + "\n" for item in items)
+    if text:
+        with _open_write(path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+
+def load_json_lines(path: str) -> List[Any]:
+    """Читает JSON Lines. Битые строки (оборванная дозапись) пропускаются."""
+    items = []
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json_loads(line))
+                except ValueError as e:
+                    log.warning(f"load_json_lines: skipped bad line in {path}: {e}")
+    except FileNotFoundError:
+        return []
+    return items
+
+
+_msgpack_encode = msgspec.msgpack.Encoder().encode
+_msgpack_decode = msgspec.msgpack.Decoder().decode
+
+
+def save_msgpack(path: str, data: Any) -> None:
+    """Атомарно сохраняет данные в msgpack - машинное состояние без затрат на YAML."""
+    with _atomic_open(path, "wb") as f:
+        f.write(_msgpack_encode(data))
+
+
+def load_msgpack(path: str, default: Any = None) -> Any:
+    try:
+        with open(path, "rb") as f:
+            return _msgpack_decode(f.read())
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        log.warning(f"load_msgpack error {path}: {e}")
+        return default
 
 
 def load_yaml(path: str, default: Any = None) -> Any:
     """Загружает YAML файл. Возвращает default если файл не существует или повреждён."""
-    if not os.path.exists(path):
-        return default
     try:
         with open(path, "r", encoding="utf-8") as f:
-            result = yaml.safe_load(f)
+            result = yaml.load(f, Loader=_YamlLoader)
             return result if result is not None else default
+    except FileNotFoundError:
+        return default
     except Exception as e:
         log.warning(f"load_yaml error {path}: {e}")
         return default
 
 
+@lru_cache(maxsize=128)
+def _load_yaml_at(path: str, mtime_ns: int, size: int, ino: int) -> Any:
+    return load_yaml(path)
+
+
+def load_yaml_cached(path: str, default: Any = None) -> Any:
+    """
+    load_yaml с кэшем по (path, mtime_ns, size, inode): повторное чтение
+    неизменённого файла не парсит YAML заново. Запись (в т.ч. атомарная
+    через os.replace) меняет ключ, так что кэш инвалидируется сам.
+    Возвращается копия - вызывающий может её менять.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return default
+    result = _load_yaml_at(path, st.st_mtime_ns, st.st_size, st.st_ino)
+    return copy.deepcopy(result) if result is not None else default
+
+
+def dump_yaml(data: Any) -> str:
+    """Сериализует данные в YAML с человекочитаемым форматированием."""
+    try:
+        return yaml.dump(data, Dumper=_YamlDumper, **_YAML_DUMP_KW)
+    except yaml.representer.RepresenterError:
+        # Нестандартные типы safe-дампер не знает - полный Dumper, как раньше
+        return yaml.dump(data, **_YAML_DUMP_KW)
+
+
 def save_yaml(path: str, data: Any) -> None:
     """Сохраняет данные в YAML с человекочитаемым форматированием."""
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        yaml.dump(
-            data,
-            f,
-            allow_unicode=True,
-            default_flow_style=False,
-            sort_keys=False,
-            indent=2,
-            width=120,
-        )
+    atomic_write_text(path, dump_yaml(data))
+
+
+def append_yaml_stream(path: str, items: Iterable[Any]) -> None:
+    """Дописывает элементы в конец файла как отдельные YAML-документы (---)."""
+    items = list(items)
+    try:
+        text = yaml.dump_all(items, Dumper=_YamlDumper, explicit_start=True, **_YAML_DUMP_KW)
+    except yaml.representer.RepresenterError:
+        text = yaml.dump_all(items, explicit_start=True, **_YAML_DUMP_KW)
+    with _open_write(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def load_yaml_stream(path: str) -> List[Any]:
+    """Читает многодокументный YAML. Оборванный хвост (сбой при дозаписи) отбрасывается."""
+    items = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for doc in yaml.load_all(f, Loader=_YamlLoader):
+                if doc is not None:
+                    items.append(doc)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        log.warning(f"load_yaml_stream error {path}: {e}, kept {len(items)} docs")
+    return items
+
+
+def prompt_key(model: str, prompt: str) -> bytes:
+    """Короткий ключ ответа LLM по (model, prompt)."""
+    return hashlib.blake2b(f"{model}\0{prompt}".encode("utf-8"), digest_size=16).digest()
+
+
+class TTLCache:
+    """LRU-словарь в памяти: не больше maxsize записей, каждая живёт ttl_s секунд."""
+
+    def __init__(self, maxsize: int = 1024, ttl_s: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key: Any) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl_s, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+async def wait_shared(fut: "asyncio.Future") -> Any:
+    """
+    Ждёт чужой идущий вызов (future из in-flight словаря) через shield.
+    Если владелец вызова отменён или упал, а ждущего никто не отменял,
+    возвращает None - ждущий делает вызов сам, а не наследует чужую отмену.
+    """
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        cancelling = getattr(asyncio.current_task(), "cancelling", None)  # 3.11+
+        if not fut.cancelled() or (cancelling is not None and cancelling()):
+            raise
+        return None
 
 
 def compute_diff(before: Optional[str], after: Optional[str]) -> str:
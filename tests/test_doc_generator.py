@@ -0,0 +1,154 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from openrouter_agent.agent import doc_generator
+from openrouter_agent.agent.config import PipelineConfig
+from openrouter_agent.agent.doc_generator import DocumentGenerator, _JsonEnd, _RateLimiter
+from openrouter_agent.utils import find_balanced_json
+
+
+def _response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class ScriptedClient:
+    """Каждый вызов create берёт следующий сценарий: задержку и ответ или исключение."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        delay, result = self.script[self.calls]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return _response(result)
+
+
+async def test_hedged_request_wins_over_slow_one():
+    gen = DocumentGenerator(PipelineConfig(hedge_after_s=0.05))
+    client = ScriptedClient((10, '{"slow": 1}'), (0, '{"fast": 1}'))
+
+    assert await gen.llm_json("p", client, "m") == {"fast": 1}
+    assert client.calls == 2
+    await asyncio.sleep(0)
+    assert client.cancelled == 1
+
+
+async def test_hedged_request_covers_failed_first_call():
+    gen = DocumentGenerator(PipelineConfig(hedge_after_s=0.01, llm_max_retries=0))
+    client = ScriptedClient((0.05, ValueError("boom")), (0.1, '{"ok": 1}'))
+
+    assert await gen.llm_json("p", client, "m") == {"ok": 1}
+
+
+async def test_no_hedge_by_default():
+    gen = DocumentGenerator(PipelineConfig())
+    client = ScriptedClient((0.05, '{"a": 1}'))
+
+    assert await gen.llm_json("p", client, "m") == {"a": 1}
+    assert client.calls == 1
+
+
+async def test_identical_prompts_share_one_call():
+    gen = DocumentGenerator(PipelineConfig())
+    client = ScriptedClient((0.05, '{"a": [1]}'))
+
+    first, second = await asyncio.gather(
+        gen.llm_json("p", client, "m"), gen.llm_json("p", client, "m"))
+    assert first == second == {"a": [1]}
+    assert first is not second
+    assert client.calls == 1
+
+
+async def test_rate_limiter_waits_for_window(monkeypatch):
+    now = [100.0]
+    slept = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+        now[0] += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(doc_generator, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    limiter = _RateLimiter(2)
+    await limiter.acquire()
+    now[0] += 10
+    await limiter.acquire()
+    assert slept == []
+
+    await limiter.acquire()
+    assert slept == [50.0]
+    assert now[0] == 160.0
+
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.consumed = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.consumed == len(self.pieces):
+            raise StopAsyncIteration
+        text = self.pieces[self.consumed]
+        self.consumed += 1
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    async def close(self):
+        self.closed = True
+
+
+async def test_stream_closed_after_json_end():
+    stream = FakeStream(['Вот ответ: {"a": "}', '\\"", "b": {', '"c": 1}}', " и ещё", " текст"])
+
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        return stream
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    gen = DocumentGenerator(PipelineConfig(stream_responses=True))
+
+    assert await gen.llm_json("p", client, "m") == {"a": '}"', "b": {"c": 1}}
+    assert stream.consumed == 3
+    assert stream.closed
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_json_end_matches_find_balanced_json(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice('{}"\\ab: ,') for _ in range(rng.randint(1, 60)))
+    end = _JsonEnd()
+    pos, closed_in = 0, None
+    while pos < len(text):
+        n = rng.randint(1, 5)
+        if end.feed(text[pos:pos + n]):
+            closed_in = (pos, pos + n)
+            break
+        pos += n
+
+    expected = find_balanced_json(text)
+    if expected is None:
+        assert closed_in is None
+    else:
+        # Объект закрывается внутри того куска, на котором feed вернул True
+        json_end = text.find("{") + len(expected)
+        assert closed_in is not None
+        assert closed_in[0] < json_end <= closed_in[1]
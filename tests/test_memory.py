@@ -0,0 +1,59 @@
+import os
+
+from openrouter_agent.agent.memory import EpisodeMemory
+from openrouter_agent.utils import load_json
+
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / "episodes.json")
+    mem = EpisodeMemory(path)
+    mem.add({"goal": "build todo app"})
+    mem.add({"goal": "fix login bug"})
+    assert os.listdir(tmp_path) == ["episodes.jsonl"]
+
+    loaded = EpisodeMemory(path)
+    assert [e["goal"] for e in loaded.episodes] == ["build todo app", "fix login bug"]
+    assert loaded.find_similar("fix the login bug")["goal"] == "fix login bug"
+
+
+def test_load_does_not_write(tmp_path):
+    path = str(tmp_path / "episodes.json")
+    EpisodeMemory(path).add({"goal": "a"})
+    before = sorted(os.listdir(tmp_path))
+
+    EpisodeMemory(path)
+    assert sorted(os.listdir(tmp_path)) == before
+
+
+def test_save_compacts_journal(tmp_path):
+    path = str(tmp_path / "episodes.json")
+    mem = EpisodeMemory(path)
+    mem.add({"goal": "a"})
+    mem.save()
+    mem.add({"goal": "b"})
+
+    assert load_json(path) == [{"goal": "a"}]
+    assert [e["goal"] for e in EpisodeMemory(path).episodes] == ["a", "b"]
+
+
+def test_torn_journal_line(tmp_path):
+    path = str(tmp_path / "episodes.json")
+    EpisodeMemory(path).add({"goal": "a"})
+    with open(tmp_path / "episodes.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"goal": "tor')
+
+    mem = EpisodeMemory(path)
+    assert [e["goal"] for e in mem.episodes] == ["a"]
+    mem.add({"goal": "b"})
+    mem.add({"goal": "c"})
+    assert [e["goal"] for e in EpisodeMemory(path).episodes] == ["a", "b", "c"]
+
+
+def test_find_similar_prefers_earliest_on_tie(tmp_path):
+    mem = EpisodeMemory(str(tmp_path / "episodes.json"))
+    mem.add({"goal": "deploy api", "n": 1})
+    mem.add({"goal": "api deploy", "n": 2})
+    mem.add({"goal": "unrelated", "n": 3})
+
+    assert mem.find_similar("deploy api")["n"] == 1
+    assert mem.find_similar("something else") is None
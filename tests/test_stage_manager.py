@@ -0,0 +1,119 @@
+import os
+
+from openrouter_agent.agent.stage_manager import (
+    StageManager, LATEST_FILE, read_execution_log, write_execution_log,
+)
+from openrouter_agent.utils import load_yaml_stream, save_yaml
+
+
+def _entry(cid, status="completed"):
+    return {"step_number": cid, "checklist_id": str(cid), "status": status}
+
+
+def test_running_log_appends_only_new_steps(tmp_path):
+    path = str(tmp_path / "execution_log.yaml")
+    meta = {"stage": 1, "status": "running"}
+    entries = [_entry(1)]
+
+    _, persisted = write_execution_log(path, entries, meta, 0)
+    entries.append(_entry(2, "failed"))
+    stats, persisted = write_execution_log(path, entries, meta, persisted)
+
+    assert persisted == 2
+    assert stats["completed"] == 1 and stats["failed"] == 1
+    assert not os.path.exists(path)
+    assert os.path.exists(tmp_path / "execution_log.msgpack")
+    assert load_yaml_stream(str(tmp_path / "execution_log.steps.yaml")) == entries
+
+    data = read_execution_log(path)
+    assert data["meta"]["status"] == "running"
+    assert data["stats"] == stats
+    assert data["steps"] == entries
+
+
+def test_final_log_folds_into_single_yaml(tmp_path):
+    path = str(tmp_path / "execution_log.yaml")
+    entries = [_entry(1), _entry(2, "blocked")]
+    _, persisted = write_execution_log(path, entries, {"status": "running"}, 0)
+
+    stats, persisted = write_execution_log(path, entries, {"status": "completed"}, persisted)
+
+    assert persisted == 0
+    assert stats == {"completed": 1, "failed": 0, "blocked": 1, "skipped": 0}
+    assert sorted(os.listdir(tmp_path)) == ["execution_log.yaml"]
+    data = read_execution_log(path)
+    assert data["meta"]["status"] == "completed"
+    assert data["steps"] == entries
+
+
+def test_resume_rewrites_stream_instead_of_duplicating(tmp_path):
+    path = str(tmp_path / "execution_log.yaml")
+    meta = {"status": "running"}
+    previous = [_entry(1), _entry(2, "failed")]
+    write_execution_log(path, previous, meta, 0)
+
+    # Новый процесс не знает, сколько шагов уже в потоке (persisted == 0)
+    resumed = list(read_execution_log(path)["steps"]) + [_entry(2)]
+    _, persisted = write_execution_log(path, resumed, meta, 0)
+
+    assert persisted == 3
+    assert read_execution_log(path)["steps"] == resumed
+
+
+def test_stage_save_execution_log_round_trip(tmp_path):
+    stage = StageManager(str(tmp_path)).create_stage("build", "q")
+    entries = [_entry(1)]
+    stage.save_execution_log(entries, {"status": "running"})
+    entries.append(_entry(2))
+    stage.save_execution_log(entries, {"status": "running"})
+    assert stage.load_execution_log()["steps"] == entries
+
+    stage.save_execution_log(entries, {"status": "completed"})
+    data = stage.load_execution_log()
+    assert data["steps"] == entries
+    assert data["stats"]["completed"] == 2
+    assert os.path.exists(os.path.join(stage.stage_dir, "execution_log.md"))
+
+
+def test_meta_msgpack_and_yaml_copy(tmp_path):
+    mgr = StageManager(str(tmp_path))
+    stage = mgr.create_stage("build", "q")
+    meta_yaml = os.path.join(stage.stage_dir, "meta.yaml")
+    # Пока стейдж running, YAML-копия meta не пишется
+    assert not os.path.exists(meta_yaml)
+    assert mgr.load_stage(stage.num).meta["status"] == "running"
+
+    stage.update_status("completed")
+    assert os.path.exists(meta_yaml)
+    loaded = StageManager(str(tmp_path)).load_stage(stage.num)
+    assert loaded.status == "completed"
+    assert loaded.meta["finished_at"]
+
+
+def test_load_stage_without_msgpack(tmp_path):
+    stage_dir = tmp_path / "flow" / "stage-1"
+    stage_dir.mkdir(parents=True)
+    save_yaml(str(stage_dir / "meta.yaml"), {"stage": 1, "workflow": "fix", "status": "partial"})
+
+    mgr = StageManager(str(tmp_path))
+    assert mgr.get_latest_stage_num() == 1
+    assert mgr.find_resumable_stage().workflow == "fix"
+    assert mgr.load_stage(2) is None
+
+
+def test_latest_pointer(tmp_path):
+    mgr = StageManager(str(tmp_path))
+    mgr.create_stage("build", "a")
+    mgr.create_stage("fix", "b")
+    latest = tmp_path / "flow" / LATEST_FILE
+    assert latest.read_text(encoding="utf-8").strip() == "2"
+
+    # Стейдж, созданный другим процессом, виден без полного листинга
+    StageManager(str(tmp_path)).create_stage("analyze", "c")
+    assert mgr.get_latest_stage_num() == 3
+
+    # Указатель на несуществующий стейдж - откат к листингу flow/
+    latest.write_text("7\n", encoding="utf-8")
+    assert StageManager(str(tmp_path)).get_latest_stage_num() == 3
+    latest.write_text("garbage", encoding="utf-8")
+    assert StageManager(str(tmp_path)).load_latest_stage().workflow == "analyze"
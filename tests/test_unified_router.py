@@ -0,0 +1,31 @@
+from openrouter_agent.agent.unified_router import _step_levels
+
+
+def _ids(levels):
+    return [[s["checklist_id"] for s in level] for level in levels]
+
+
+def test_independent_steps_share_a_level():
+    steps = [
+        {"checklist_id": "1"},
+        {"checklist_id": "2"},
+        {"checklist_id": "3", "depends_on": ["1"]},
+        {"checklist_id": "4", "depends_on": [1, "2"]},
+        {"checklist_id": "5", "depends_on": ["3"]},
+    ]
+    assert _ids(_step_levels(steps)) == [["1", "2"], ["3", "4"], ["5"]]
+
+
+def test_forward_and_unknown_dependencies_are_ignored():
+    steps = [
+        {"checklist_id": "1", "depends_on": ["2"]},
+        {"checklist_id": "2", "depends_on": ["missing"]},
+        {"checklist_id": "3", "depends_on": ["2"]},
+    ]
+    assert _ids(_step_levels(steps)) == [["1", "2"], ["3"]]
+
+
+def test_steps_keyed_by_id_fallback():
+    steps = [{"id": "a"}, {"id": "b", "depends_on": ["a"]}, {"checklist_id": "c"}]
+    assert [[s.get("checklist_id", s.get("id")) for s in level]
+            for level in _step_levels(steps)] == [["a", "c"], ["b"]]
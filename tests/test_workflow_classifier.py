@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from openrouter_agent.agent.workflow_classifier import WorkflowClassifier, _INFLIGHT
+
+
+class FakeClient:
+    """chat.completions.create, который ждёт release и отвечает JSON-классификацией."""
+
+    def __init__(self, content='{"workflow": "modify", "confidence": 0.9}'):
+        self.calls = 0
+        self.content = content
+        self.release = asyncio.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await self.release.wait()
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def test_concurrent_requests_share_one_call():
+    classifier = WorkflowClassifier()
+    client = FakeClient()
+    tasks = [
+        asyncio.create_task(classifier.classify("qwerty zxcv", "", client, "m"))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    client.release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert client.calls == 1
+    assert {r.workflow for r in results} == {"modify"}
+    assert not _INFLIGHT
+
+    # Уверенный ответ закэширован
+    await classifier.classify("qwerty   ZXCV", "", client, "m")
+    assert client.calls == 1
+
+
+async def test_waiter_survives_owner_cancellation():
+    classifier = WorkflowClassifier()
+    client = FakeClient()
+    owner = asyncio.create_task(classifier.classify("asdf ghjk", "", client, "m"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(classifier.classify("asdf ghjk", "", client, "m"))
+    await asyncio.sleep(0)
+
+    owner.cancel()
+    await asyncio.sleep(0)
+    client.release.set()
+    result = await waiter
+
+    assert owner.cancelled()
+    assert result.workflow == "modify"
+    assert client.calls == 2
+    assert not _INFLIGHT
@@ -43,6 +43,34 @@ function addMessage(type, text, payload) {
   messages.update(list => [...list, { id: nextId(), type, text, ts: Date.now(), payload }])
 }
 
+// Потоковые фрагменты ответа (type 'stream') дописываются в одно сообщение
+let _streamId = null
+let _streamText = ''
+
+function appendStream(chunk) {
+  if (_streamId === null) {
+    _streamId = nextId()
+    _streamText = chunk
+    messages.update(list => [...list, { id: _streamId, type: 'assistant', text: chunk, ts: Date.now() }])
+    return
+  }
+  _streamText += chunk
+  const id = _streamId, text = _streamText
+  messages.update(list => list.map(m => (m.id === id ? { ...m, text } : m)))
+}
+
+// Закрывает поток; true - если итоговое сообщение повторяет его текст и уже показано
+function finishStream(type, text, payload) {
+  if (_streamId === null) return false
+  const id = _streamId, same = type === 'result' && text === _streamText
+  _streamId = null
+  _streamText = ''
+  if (same) {
+    messages.update(list => list.map(m => (m.id === id ? { ...m, type, payload } : m)))
+  }
+  return same
+}
+
 export function connect() {
   if (_socket) return _socket
 
@@ -64,6 +92,12 @@ export function connect() {
     const type = data.type || 'assistant'
     const payload = data.payload || null
 
+    if (type === 'stream') {
+      appendStream(text)
+      return
+    }
+    const shown = finishStream(type, text, payload)
+
     if (payload && payload.workflow) {
       activeWorkflow.set(payload.workflow)
       if (payload.workflow !== 'chat') {
@@ -74,14 +108,17 @@ export function connect() {
       pipelineDone.set({ status: payload.status })
     }
 
-    addMessage(type, text, payload)
+    if (!shown) addMessage(type, text, payload)
   })
 
   _socket.on(EVT.LOG, (data) => {
-    const msg = data.message || data.msg || ''
-    const level = data.level || 'INFO'
+    // Сервер шлёт логи пачками: { batch: [{ message, level }, ...] }
+    const items = data.batch || [data]
+    const ts = Date.now()
     logs.update(list => {
-      const next = [...list, { level, msg, ts: Date.now() }]
+      const next = list.concat(items.map(d => ({
+        level: d.level || 'INFO', msg: d.message || d.msg || '', ts,
+      })))
       return next.length > 500 ? next.slice(-500) : next
     })
   })